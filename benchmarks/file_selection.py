@@ -0,0 +1,88 @@
+"""Latest-file selection over synthetic tachograph directories.
+
+Run from the repository root::
+
+    python -m benchmarks.file_selection [--files 100000]
+
+Compares the previous filter-into-a-list selection with ``NewestFiles``,
+alone and with a top-10 heap, on time and peak allocated memory.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from services.file_selection import NewestFiles
+
+C_CODE = "I100000165067000"
+
+
+def directory(count: int, match_ratio: float, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    files = []
+    for i in range(count):
+        name = (
+            f"C_20220901_{i:06d}_{C_CODE}.DDD"
+            if rng.random() < match_ratio
+            else f"M_{i:06d}.DDD"
+        )
+        files.append(
+            {
+                "n": name,
+                "s": rng.randint(10_000, 60_000),
+                "ct": i,
+                "mt": rng.randint(0, 10**9),
+            }
+        )
+    return files
+
+
+def filtered_list(files):
+    filtered = []
+    for data in files:
+        if C_CODE in data["n"]:
+            filtered.append(data)
+    return filtered[-1]["mt"] if filtered else None
+
+
+def newest(files):
+    return NewestFiles(C_CODE).update(files).mt
+
+
+def newest_top10(files):
+    selector = NewestFiles(C_CODE, top=10).update(files)
+    selector.files()
+    return selector.mt
+
+
+def measure(func, files, number: int):
+    best = float("inf")
+    for _ in range(number):
+        start = time.perf_counter()
+        func(files)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(files)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100_000)
+    parser.add_argument("--number", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'matching':>9} {'selector':<14}{'best ms':>10}{'peak KiB':>11}")
+    for ratio in (0.01, 0.5, 1.0):
+        files = directory(args.files, ratio)
+        for func in (filtered_list, newest, newest_top10):
+            best, peak = measure(func, files, args.number)
+            print(
+                f"{ratio:>9.0%} {func.__name__:<14}{best * 1000:>10.2f}{peak / 1024:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Compare the stdlib and orjson codecs on the Wialon fixtures.
+
+Run from the repository root::
+
+    python -m benchmarks.json_backend [--number 200]
+
+The driver directory and the file list are also replicated to fleet-sized
+payloads, since those are the replies that grow with the account.
+"""
+import argparse
+import json
+import timeit
+
+from tests.topfly_api_responeses import (
+    COMPANY_CARD_API_RESPONSE,
+    DRIVER_FILE_API_RESPONSE,
+    SEARCH_DRIVER_GROUP_ID_WITH_CODE_API_RESPONSE,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _stdlib_dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+CODECS = {"json": (_stdlib_dumps, json.loads)}
+if orjson is not None:
+    CODECS["orjson"] = (orjson.dumps, orjson.loads)
+
+
+def payloads(scale: int) -> dict:
+    directory = SEARCH_DRIVER_GROUP_ID_WITH_CODE_API_RESPONSE
+    return {
+        "driver_directory": directory,
+        f"driver_directory_x{scale}": {
+            **directory,
+            "items": directory["items"] * scale,
+        },
+        "driver_files": DRIVER_FILE_API_RESPONSE,
+        f"driver_files_x{scale}": DRIVER_FILE_API_RESPONSE * scale,
+        "company_card": COMPANY_CARD_API_RESPONSE,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--scale", type=int, default=50)
+    args = parser.parse_args()
+
+    print(
+        f"{'payload':<24}{'bytes':>10}"
+        + "".join(
+            f"{name + ' ' + op:>16}" for name in CODECS for op in ("dumps", "loads")
+        )
+    )
+    for label, payload in payloads(args.scale).items():
+        body = _stdlib_dumps(payload)
+        row = f"{label:<24}{len(body):>10}"
+        for dumps, loads in CODECS.values():
+            for func, arg in ((dumps, payload), (loads, body)):
+                seconds = min(
+                    timeit.repeat(lambda: func(arg), number=args.number, repeat=3)
+                )
+                row += f"{seconds / args.number * 1e6:>13.1f} us"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
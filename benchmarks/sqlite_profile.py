@@ -0,0 +1,102 @@
+"""Concurrent ``company_sn`` writes under each SQLite storage profile.
+
+Run from the repository root::
+
+    python -m benchmarks.sqlite_profile [--threads 16] [--writes 200]
+
+Every thread plays a webhook: claim the card's cooldown window with
+``claim_trigger``, read the holding row when the card is in cooldown and
+commit, against a fresh database file per profile. Webhook ``i`` happens
+``i`` minutes into a simulated clock, so most claims write. Reports
+throughput, latency percentiles and how many writes failed with "database
+is locked".
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from config import Settings
+from database import Base, make_engine
+from models import CompanySN
+from services.company_sn import claim_trigger
+
+CLOCK = datetime.datetime(2022, 1, 1)
+
+PROFILES = {
+    "bare": {"SQLITE_PROFILE": "default"},
+    "concurrent": {"SQLITE_PROFILE": "concurrent"},
+}
+
+
+def webhook(session_factory, sn: str, now: datetime.datetime) -> float:
+    start = time.perf_counter()
+    with session_factory() as db:
+        if claim_trigger(db, sn, "driver", "unit", now) is None:
+            db.query(CompanySN).filter(CompanySN.sn == sn).first()
+        db.commit()
+    return time.perf_counter() - start
+
+
+def run(profile: dict, threads: int, writes: int, cards: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        setting = Settings(**profile, DB_POOL_SIZE=threads)
+        engine = make_engine(
+            f"sqlite:///{os.path.join(directory, 'bench.db')}", setting
+        )
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        rng = random.Random(7)
+        serials = [f"SN{rng.randrange(cards):06d}" for _ in range(threads * writes)]
+
+        latencies, locked = [], 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = [
+                pool.submit(
+                    webhook, session_factory, sn, CLOCK + datetime.timedelta(minutes=i)
+                )
+                for i, sn in enumerate(serials)
+            ]
+            for future in futures:
+                try:
+                    latencies.append(future.result())
+                except OperationalError:
+                    locked += 1
+        elapsed = time.perf_counter() - start
+        engine.dispose()
+
+    latencies.sort()
+    return {
+        "ops/s": len(latencies) / elapsed,
+        "p50 ms": statistics.median(latencies) * 1000 if latencies else 0,
+        "p95 ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0,
+        "locked": locked,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=200, help="per thread")
+    parser.add_argument("--cards", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'profile':<12}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'locked':>8}")
+    for name, profile in PROFILES.items():
+        result = run(profile, args.threads, args.writes, args.cards)
+        print(
+            f"{name:<12}{result['ops/s']:>10.0f}{result['p50 ms']:>10.2f}"
+            f"{result['p95 ms']:>10.2f}{result['locked']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,5 +5,70 @@ class Settings(BaseSettings):
     TOKEN: str
     SENTRY_DNS: str = None
 
+    HTTP_POOL_CONNECTIONS: int = 4
+    HTTP_POOL_MAXSIZE: int = 20
+    HTTP_POOL_BLOCK: bool = False
+    HTTP_TIMEOUT: float = 30
+    HTTP_ASYNC_MAX_CONNECTIONS: int = 100
+
+    WEBHOOK_PREFETCH_LOOKUPS: bool = False
+    WEBHOOK_BATCH_LOOKUPS: bool = False
+    WEBHOOK_COALESCE: bool = True
+    WEBHOOK_ASYNC_JOBS: bool = False
+    WEBHOOK_JOB_WORKERS: int = 4
+    WEBHOOK_JOB_POLL_INTERVAL: float = 5
+    WEBHOOK_JOB_LEASE: float = 300
+
+    COMMAND_BATCHING: bool = False
+    COMMAND_BATCH_WINDOW: float = 0.2
+    COMMAND_BATCH_MAX_SIZE: int = 50
+
+    COMMAND_OUTBOX: bool = False
+    COMMAND_OUTBOX_BATCH_SIZE: int = 20
+    COMMAND_OUTBOX_MAX_ATTEMPTS: int = 5
+    COMMAND_OUTBOX_BACKOFF: float = 30
+    COMMAND_OUTBOX_MAX_BACKOFF: float = 900
+    COMMAND_OUTBOX_POLL_INTERVAL: float = 5
+    COMMAND_OUTBOX_LEASE: float = 300
+
+    COOLDOWN_MINUTES: float = 30
+    COOLDOWN_INDEX: bool = True
+
+    TRIGGER_HISTORY: bool = True
+    TRIGGER_HISTORY_BATCH_SIZE: int = 100
+    TRIGGER_HISTORY_FLUSH_INTERVAL: float = 5
+    TRIGGER_HISTORY_MAX_BUFFER: int = 10000
+    TRIGGER_HISTORY_RETENTION_DAYS: int = 30
+    TRIGGER_HISTORY_ROLLUP_INTERVAL: float = 3600
+
+    DRIVER_DIRECTORY_TTL: float = 3600
+    DRIVER_DIRECTORY_MISS_REFRESH_INTERVAL: float = 60
+
+    BACT_CACHE_SIZE: int = 4096
+    BACT_CACHE_TTL: float = 86400
+    BACT_CACHE_NEGATIVE_TTL: float = 300
+
+    COMPANY_CARD_CACHE_SIZE: int = 4096
+    COMPANY_CARD_CACHE_TTL: float = 600
+
+    FILE_LIST_SERVER_MASK: bool = True
+
+    STREAM_JSON_RESPONSES: bool = False
+    STREAM_CHUNK_SIZE: int = 65536
+
+    JSON_BACKEND: str = "auto"
+
+    DATABASE_URL: str = "sqlite:///./topfly.db"
+    DB_ASYNC: bool = False
+
+    SQLITE_PROFILE: str = "concurrent"
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT: int = 5000
+    SQLITE_CACHE_SIZE: int = -16000
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+
     class Config:
         env_file = ".env"
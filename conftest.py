@@ -1,5 +1,8 @@
 import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 
+from database import Base
 from tests.topfly_api_responeses import SEND_COMMAND_API_RESPONSE
 
 
@@ -32,7 +35,16 @@ def company_card_sn():
 def send_command_response():
     return SEND_COMMAND_API_RESPONSE
 
+
 @pytest.fixture
 def get_bact():
     return 23080205
 
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Sessions on a fresh SQLite file holding every table."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
@@ -1,12 +1,143 @@
-from sqlalchemy import create_engine
+import asyncio
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from config import Settings
+from utils.sql_stats import sql_statements
+
+setting = Settings()
+
+SQLALCHEMY_DATABASE_URL = setting.DATABASE_URL
+
+# The driver an async engine uses for each backend of ``DATABASE_URL``.
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+# The driver the sync engine uses when ``DATABASE_URL`` names none.
+SYNC_DRIVERS = {"postgresql": "psycopg"}
+
+
+def sqlite_pragmas(setting: Settings) -> dict:
+    """Pragmas run on every new connection for the configured ``SQLITE_PROFILE``.
+
+    ``concurrent`` lets readers run alongside the single writer (WAL), waits
+    for a locked database instead of failing at once, and syncs at WAL
+    checkpoints rather than on every commit. ``default`` keeps SQLite's own
+    settings.
+    """
+    if setting.SQLITE_PROFILE == "default":
+        return {}
+    return {
+        "journal_mode": setting.SQLITE_JOURNAL_MODE,
+        "synchronous": setting.SQLITE_SYNCHRONOUS,
+        "busy_timeout": setting.SQLITE_BUSY_TIMEOUT,
+        "cache_size": setting.SQLITE_CACHE_SIZE,
+    }
+
+
+def make_engine(url: str, setting: Settings = setting):
+    is_sqlite = make_url(url).get_backend_name() == "sqlite"
+    engine = create_engine(
+        sync_url(url),
+        connect_args={"check_same_thread": False} if is_sqlite else {},
+        poolclass=QueuePool,
+        pool_size=setting.DB_POOL_SIZE,
+        max_overflow=setting.DB_MAX_OVERFLOW,
+        pool_timeout=setting.DB_POOL_TIMEOUT,
+    )
+    if is_sqlite:
+        _apply_sqlite_pragmas(engine, setting)
+    sql_statements.attach(engine)
+    return engine
+
+
+def sync_url(url: str) -> str:
+    """``url`` with the driver in ``SYNC_DRIVERS`` if it names none, e.g. ``postgresql+psycopg://...``."""
+    url = make_url(url)
+    driver = SYNC_DRIVERS.get(url.drivername)
+    if driver is not None:
+        url = url.set(drivername=f"{url.drivername}+{driver}")
+    return url.render_as_string(hide_password=False)
+
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./topfly.db"
+def async_url(url: str) -> str:
+    """``url`` with the backend's async driver, e.g. ``sqlite+aiosqlite:///...``."""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(
+            f"No async driver known for {url.get_backend_name()!r} databases"
+        )
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}").render_as_string(
+        hide_password=False
+    )
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+
+def make_async_engine(url: str, setting: Settings = setting):
+    """Async engine for ``url`` through the backend's driver in ``ASYNC_DRIVERS``."""
+    engine = create_async_engine(
+        async_url(url),
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=setting.DB_POOL_SIZE,
+        max_overflow=setting.DB_MAX_OVERFLOW,
+        pool_timeout=setting.DB_POOL_TIMEOUT,
+    )
+    if make_url(url).get_backend_name() == "sqlite":
+        _apply_sqlite_pragmas(engine.sync_engine, setting)
+    sql_statements.attach(engine.sync_engine)
+    return engine
+
+
+def _apply_sqlite_pragmas(engine, setting: Settings) -> None:
+    pragmas = sqlite_pragmas(setting)
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def dialect_insert(db):
+    """``insert`` of the session's dialect, for ``ON CONFLICT`` upserts."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+async def run_db(db, func, *args):
+    """Run ``func(session, *args)`` on a plain or an async session without blocking the loop.
+
+    A plain ``Session`` is handed to a worker thread, as FastAPI does for
+    sync endpoints; an ``AsyncSession`` runs it through ``run_sync``. Either
+    way the same ORM code serves both engines.
+    """
+    if hasattr(db, "run_sync"):
+        return await db.run_sync(func, *args)
+    return await asyncio.to_thread(func, db, *args)
+
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
+# Rows stay readable after the webhook's single commit without a refresh SELECT.
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Request handlers use async sessions when DB_ASYNC is set; background
+# workers, startup and migrations keep the synchronous engine.
+AsyncSessionLocal = None
+if setting.DB_ASYNC:
+    AsyncSessionLocal = async_sessionmaker(
+        make_async_engine(SQLALCHEMY_DATABASE_URL),
+        autoflush=False,
+        expire_on_commit=False,
+    )
 
 Base = declarative_base()
@@ -5,15 +5,39 @@ from fastapi import Depends, FastAPI, Form
 from sqlalchemy.orm import Session
 
 from config import Settings
-from database import SessionLocal, engine
-from models import Base, CompanySN
-from services.topfly_service import TopflyService, Topflygeofence_create, Topflygeofence_delete
-from utils.exception_handler import add_topfly_exception_handler
+from database import AsyncSessionLocal, SessionLocal, engine, run_db
+from migrations import migrate
+from models import Base, CompanySN, WebhookJob
+from services.async_topfly_service import (
+    AsyncTopflygeofence_create,
+    AsyncTopflygeofence_delete,
+    AsyncTopflyService,
+)
+from services.caches import bact_cache, company_card_cache
+from services.command_dispatcher import command_dispatcher
+from services.command_outbox import CommandOutbox
+from services.company_sn import NEW, claim_trigger, release_trigger
+from services.cooldown_index import cooldown_index
+from services.driver_directory import driver_directory
+from services.http_client import async_http_client, http_client
+from services.topfly_service import wialon_session
+from services.trigger_history import TriggerHistory
+from services.webhook_jobs import WebhookJobPool
+from services.webhook_lookups import (
+    WebhookLookups,
+    lookup_counters,
+    lookup_flights,
+    webhook_flights,
+)
+from utils.exception_handler import TopflyException, add_topfly_exception_handler
 from utils.resp import TopflyResponse
+from utils.sql_stats import sql_statements
+from utils.timing import StepTimer, webhook_timings
 
 setting = Settings()
 
 Base.metadata.create_all(bind=engine)
+migrate(engine)
 
 sentry_sdk.init(
     dsn=setting.SENTRY_DNS,
@@ -36,6 +60,10 @@ tags_metadata = [
         "name": "Delete Geofence",
         "description": "Delete Geofence from Trailer",
     },
+    {
+        "name": "Metrics",
+        "description": "Runtime statistics of the Wialon integration",
+    },
 ]
 
 
@@ -53,8 +81,34 @@ app = FastAPI(
 add_topfly_exception_handler(app)
 
 
+@app.on_event("startup")
+async def start_webhook_jobs():
+    if setting.COOLDOWN_INDEX:
+        with SessionLocal() as db:
+            await run_db(db, cooldown_index.load)
+    if setting.WEBHOOK_ASYNC_JOBS:
+        await webhook_jobs.start()
+    if setting.COMMAND_OUTBOX:
+        await command_outbox.start()
+    if setting.TRIGGER_HISTORY:
+        await trigger_history.start()
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await webhook_jobs.stop()
+    await command_outbox.stop()
+    await trigger_history.stop()
+    http_client.close()
+    await async_http_client.close()
+
+
 # Dependency
-def get_db():
+async def get_db():
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
     db: Session = SessionLocal()
     try:
         yield db
@@ -62,58 +116,109 @@ def get_db():
         db.close()
 
 
-@app.post("/topfly-webhook/notification/", tags=["Automatically Download Unit & Driver File"])
-def notification_webhook(
+@app.post(
+    "/topfly-webhook/notification/", tags=["Automatically Download Unit & Driver File"]
+)
+async def notification_webhook(
     unitId: str = Form(),
     driver: str = Form(),
     date: str = Form(),
     db: Session = Depends(get_db),
 ):
-    sid = TopflyService.get_sid()
-    service = TopflyService(sid, unitId, driver, None)
-    bact = service.get_bact()
-    mt_unit_epoch = service.get_unit_mt_epoch_time(unitId)
-    c_code = service.get_driver_c_code()
-    mt_epoch = service.get_mt_epoch_time(c_code, bact)
-
-    if mt_unit_epoch == None:
-        sn_value = service.get_value_from_company_card_api()
-        company_sn = db.query(CompanySN).filter(
-            CompanySN.sn == sn_value).first()
-        if not company_sn:
-            service.send_command()
-            db.add(
-                CompanySN(
-                    sn=sn_value,
-                    driver=driver,
-                    unitId=unitId,
-                )
-            )
-            db.commit()
-        else:
-            now = datetime.datetime.utcnow()
-            trigger_diff = (now - company_sn.trigger_at).total_seconds() / 60
-            if round(trigger_diff) > 30:
-                service.send_command_tachigrafo()
-                company_sn.trigger_at = now
-                company_sn.driver = driver
-                company_sn.unitId = unitId
-                db.add(company_sn)
-                db.commit()
-                db.refresh(company_sn)
-            else:
-                return TopflyResponse(
-                    data={
-                        "trigger_at": str(company_sn.trigger_at),
-                        "driver": company_sn.driver,
-                        "unitId": company_sn.unitId,
-                    },
-                    message=f"A command already triggered at {company_sn.trigger_at} for driver {company_sn.driver}, unitId {company_sn.unitId}",
-                )
-
-        return TopflyResponse(message="Tachigrafo command has been triggered successfully.")
-
-    if mt_unit_epoch != None and mt_epoch != None:
+    if setting.WEBHOOK_ASYNC_JOBS:
+        job_id = await run_db(
+            db, lambda session: webhook_jobs.enqueue(session, unitId, driver, date).id
+        )
+        return TopflyResponse(
+            status_code=202,
+            message="Notification has been queued.",
+            data={"job_id": job_id},
+        )
+    return await _run_notification(db, unitId, driver)
+
+
+@app.get(
+    "/topfly-webhook/jobs/{job_id}/", tags=["Automatically Download Unit & Driver File"]
+)
+async def notification_job(job_id: int, db: Session = Depends(get_db)):
+    job = await run_db(db, Session.get, WebhookJob, job_id)
+    if job is None:
+        raise TopflyException(message=f"No job found with id {job_id}", status_code=404)
+    return TopflyResponse(
+        message=job.message or "",
+        data={
+            "status": job.status,
+            "status_code": job.status_code,
+            "attempts": job.attempts,
+            "created_at": str(job.created_at),
+            "started_at": str(job.started_at) if job.started_at else None,
+            "finished_at": str(job.finished_at) if job.finished_at else None,
+        },
+    )
+
+
+async def _run_notification(db: Session, unitId: str, driver: str):
+    if not setting.WEBHOOK_COALESCE:
+        return await _notification_webhook(db, unitId, driver)
+    # Duplicate notifications in flight for the same unit and driver share one decision.
+    return await webhook_flights.do(
+        ("notification", unitId, driver),
+        lambda: _notification_webhook(db, unitId, driver),
+    )
+
+
+webhook_jobs = WebhookJobPool(
+    SessionLocal,
+    _run_notification,
+    workers=setting.WEBHOOK_JOB_WORKERS,
+    poll_interval=setting.WEBHOOK_JOB_POLL_INTERVAL,
+    lease=setting.WEBHOOK_JOB_LEASE,
+)
+
+
+async def _notification_webhook(db: Session, unitId: str, driver: str):
+    sid = await wialon_session.async_get_sid()
+    service = AsyncTopflyService(
+        sid,
+        unitId,
+        driver,
+        None,
+        session=wialon_session,
+        drivers=driver_directory,
+        bacts=bact_cache,
+        company_cards=company_card_cache,
+        commands=command_dispatcher if setting.COMMAND_BATCHING else None,
+    )
+    timer = StepTimer()
+    lookups = WebhookLookups(
+        service,
+        timer,
+        prefetch=setting.WEBHOOK_PREFETCH_LOOKUPS,
+        batch=setting.WEBHOOK_BATCH_LOOKUPS,
+        flights=lookup_flights if setting.WEBHOOK_COALESCE else None,
+    )
+    try:
+        with sql_statements.scope("webhook"):
+            return await _notification(lookups, db, unitId, driver)
+    finally:
+        lookups.close()
+        webhook_timings.record(timer)
+
+
+async def _notification(lookups: WebhookLookups, db: Session, unitId: str, driver: str):
+    mt_unit_epoch = await lookups.unit_mt_epoch.get()
+    if mt_unit_epoch is None:
+        return await _trigger_command(
+            lookups,
+            db,
+            unitId,
+            driver,
+            "send_command_tachigrafo",
+            "Tachigrafo command has been triggered successfully.",
+        )
+
+    mt_epoch = await lookups.mt_epoch.get()
+    if mt_epoch is not None:
         mt_unit_utc_datetime = datetime.datetime.utcfromtimestamp(mt_unit_epoch)
         unit_now = datetime.datetime.utcnow()
         unit_days_difference = (unit_now - mt_unit_utc_datetime).days
@@ -121,103 +226,227 @@ def notification_webhook(
         now = datetime.datetime.utcnow()
         days_difference = (now - mt_utc_datetime).days
         if unit_days_difference < 60 and days_difference < 15:
-            return TopflyResponse(message="Last modification time for unit is less than 60 days and for driver is less than 15 days")
+            return TopflyResponse(
+                message="Last modification time for unit is less than 60 days and for driver is less than 15 days"
+            )
 
         if unit_days_difference >= 60 and days_difference < 20:
-            sn_value = service.get_value_from_company_card_api()
-            company_sn = db.query(CompanySN).filter(
-                CompanySN.sn == sn_value).first()
-            if not company_sn:
-                service.send_command()
-                db.add(
-                    CompanySN(
-                        sn=sn_value,
-                        driver=driver,
-                        unitId=unitId,
-                    )
-                )
-                db.commit()
-            else:
-                now = datetime.datetime.utcnow()
-                trigger_diff = (
-                    now - company_sn.trigger_at).total_seconds() / 60
-                if round(trigger_diff) > 30:
-                    service.send_command_tachigrafo()
-                    company_sn.trigger_at = now
-                    company_sn.driver = driver
-                    company_sn.unitId = unitId
-                    db.add(company_sn)
-                    db.commit()
-                    db.refresh(company_sn)
-                else:
-                    return TopflyResponse(
-                        data={
-                            "trigger_at": str(company_sn.trigger_at),
-                            "driver": company_sn.driver,
-                            "unitId": company_sn.unitId,
-                        },
-                        message=f"A command already triggered at {company_sn.trigger_at} for driver {company_sn.driver}, unitId {company_sn.unitId}",
-                    )
-
-            return TopflyResponse(message="Tachigrafo command has been triggered successfully.")
-
-    sn_value = service.get_value_from_company_card_api()
-    company_sn = db.query(CompanySN).filter(CompanySN.sn == sn_value).first()
-    if not company_sn:
-        service.send_command()
-        db.add(
-            CompanySN(
-                sn=sn_value,
-                driver=driver,
-                unitId=unitId,
+            return await _trigger_command(
+                lookups,
+                db,
+                unitId,
+                driver,
+                "send_command_tachigrafo",
+                "Tachigrafo command has been triggered successfully.",
             )
+
+    return await _trigger_command(
+        lookups,
+        db,
+        unitId,
+        driver,
+        "send_command",
+        "Tessera command has been triggered successfully.",
+    )
+
+
+async def _trigger_command(
+    lookups: WebhookLookups,
+    db: Session,
+    unitId: str,
+    driver: str,
+    repeat_command: str,
+    message: str,
+):
+    """Send a download command unless one was triggered for the card within the cooldown.
+
+    A card seen for the first time always gets ``send_command``; ``repeat_command``
+    names the service method a known card gets once its window has passed.
+    """
+    sn_value = await lookups.company_sn.get()
+    recent = cooldown_index.recent(sn_value) if setting.COOLDOWN_INDEX else None
+    if recent is not None:
+        return _already_triggered(recent)
+    now = datetime.datetime.utcnow()
+    claim, company_sn = await run_db(
+        db, _claim_trigger, unitId, driver, sn_value, repeat_command, now
+    )
+    while claim is None and company_sn is None:
+        # The claim holding the card was released in between; try again.
+        claim, company_sn = await run_db(
+            db, _claim_trigger, unitId, driver, sn_value, repeat_command, now
         )
-        db.commit()
-    else:
-        now = datetime.datetime.utcnow()
-        trigger_diff = (now - company_sn.trigger_at).total_seconds() / 60
-        if round(trigger_diff) > 30:
-            service.send_command()
-            company_sn.trigger_at = now
-            company_sn.driver = driver
-            company_sn.unitId = unitId
-            db.add(company_sn)
-            db.commit()
-            db.refresh(company_sn)
-        else:
-            return TopflyResponse(
-                data={
-                    "trigger_at": str(company_sn.trigger_at),
-                    "driver": company_sn.driver,
-                    "unitId": company_sn.unitId,
-                },
-                message=f"A command already triggered at {company_sn.trigger_at} for driver {company_sn.driver}, unitId {company_sn.unitId}",
-            )
+    if claim is None:
+        cooldown_index.record(
+            sn_value, company_sn.trigger_at, company_sn.driver, company_sn.unitId
+        )
+        return _already_triggered(company_sn)
+
+    command = "send_command" if claim == NEW else repeat_command
+    if not setting.COMMAND_OUTBOX:
+        try:
+            await getattr(lookups.service, command)()
+        except BaseException:
+            await run_db(db, _release_trigger, sn_value, claim, now)
+            raise
+    _notify_outbox()
+    cooldown_index.record(sn_value, now, driver, unitId)
+    if setting.TRIGGER_HISTORY:
+        trigger_history.record(sn_value, driver, unitId, command, now)
+    return TopflyResponse(message=message)
+
+
+def _already_triggered(trigger):
+    """``trigger`` is a ``CompanySN`` row or a ``CooldownEntry``; both carry the same fields."""
+    return TopflyResponse(
+        data={
+            "trigger_at": str(trigger.trigger_at),
+            "driver": trigger.driver,
+            "unitId": trigger.unitId,
+        },
+        message=f"A command already triggered at {trigger.trigger_at} for driver {trigger.driver}, unitId {trigger.unitId}",
+    )
+
+
+def _claim_trigger(
+    db: Session,
+    unitId: str,
+    driver: str,
+    sn: str,
+    repeat_command: str,
+    now: datetime.datetime,
+):
+    """The webhook's unit of work: claim the card's window, or read who holds it.
+
+    With the outbox the command is staged in the same transaction, which
+    commits once. Returns the claim and, when the card is in cooldown, its row.
+    """
+    company_sn = None
+    claim = claim_trigger(db, sn, driver, unitId, now, setting.COOLDOWN_MINUTES)
+    if claim is None:
+        company_sn = db.query(CompanySN).filter(CompanySN.sn == sn).first()
+    elif setting.COMMAND_OUTBOX:
+        command = "send_command" if claim == NEW else repeat_command
+        command_outbox.add(db, unitId, driver, sn, command)
+    db.commit()
+    return claim, company_sn
+
+
+def _release_trigger(db: Session, sn: str, claim: str, now: datetime.datetime):
+    release_trigger(db, sn, claim, now, setting.COOLDOWN_MINUTES)
+    db.commit()
+
+
+def _notify_outbox():
+    if setting.COMMAND_OUTBOX:
+        command_outbox.notify()
+
+
+async def _deliver_command(unitId: str, driver: str, command: str):
+    sid = await wialon_session.async_get_sid()
+    service = AsyncTopflyService(
+        sid,
+        unitId,
+        driver,
+        None,
+        session=wialon_session,
+        company_cards=company_card_cache,
+        commands=command_dispatcher if setting.COMMAND_BATCHING else None,
+    )
+    return await getattr(service, command)()
+
+
+command_outbox = CommandOutbox(
+    SessionLocal,
+    _deliver_command,
+    batch_size=setting.COMMAND_OUTBOX_BATCH_SIZE,
+    max_attempts=setting.COMMAND_OUTBOX_MAX_ATTEMPTS,
+    backoff=setting.COMMAND_OUTBOX_BACKOFF,
+    max_backoff=setting.COMMAND_OUTBOX_MAX_BACKOFF,
+    poll_interval=setting.COMMAND_OUTBOX_POLL_INTERVAL,
+    lease=setting.COMMAND_OUTBOX_LEASE,
+)
+
+trigger_history = TriggerHistory(
+    SessionLocal,
+    batch_size=setting.TRIGGER_HISTORY_BATCH_SIZE,
+    flush_interval=setting.TRIGGER_HISTORY_FLUSH_INTERVAL,
+    max_buffer=setting.TRIGGER_HISTORY_MAX_BUFFER,
+    retention_days=setting.TRIGGER_HISTORY_RETENTION_DAYS,
+    rollup_interval=setting.TRIGGER_HISTORY_ROLLUP_INTERVAL,
+)
 
-    return TopflyResponse(message="Tessera command has been triggered successfully.")
 
 @app.post("/topfly-geofence/create/", tags=["Create Geofence"])
-def geofence_create(
+async def geofence_create(
     trailer: str = Form(),
     lon: str = Form(),
     lat: str = Form(),
 ):
-    sid = Topflygeofence_create.get_sid()
-    service = Topflygeofence_create(sid, trailer, lon, lat)
-    bact = service.get_bact()
-    data = service.create(bact)
-    
+    sid = await wialon_session.async_get_sid()
+    service = AsyncTopflygeofence_create(
+        sid, trailer, lon, lat, session=wialon_session, bacts=bact_cache
+    )
+    bact = await service.get_bact()
+    data = await service.create(bact)
+
     return TopflyResponse(data=data, message="Geofence has been created successfully.")
 
 
 @app.post("/topfly-geofence/delete/", tags=["Delete Geofence"])
-def geofence_delete(
+async def geofence_delete(
     trailer: str = Form(),
 ):
-    sid = Topflygeofence_delete.get_sid()
-    service = Topflygeofence_delete(sid, trailer)
-    bact = service.get_bact()
-    geofence = service.get_geofence(bact)
-    data = service.delete(bact, geofence)
+    sid = await wialon_session.async_get_sid()
+    service = AsyncTopflygeofence_delete(
+        sid, trailer, session=wialon_session, bacts=bact_cache
+    )
+    bact = await service.get_bact()
+    geofence = await service.get_geofence(bact)
+    data = await service.delete(bact, geofence)
 
     return TopflyResponse(data=data, message="Geofence has been deleted successfully.")
+
+
+@app.get("/topfly-metrics/", tags=["Metrics"])
+def metrics():
+    return TopflyResponse(
+        data={
+            "session": wialon_session.stats(),
+            "http": http_client.stats(),
+            "async_http": async_http_client.stats(),
+            "webhook_timings": webhook_timings.stats(),
+            "webhook_lookups": lookup_counters.stats(),
+            "webhook_coalescing": webhook_flights.stats(),
+            "lookup_coalescing": lookup_flights.stats(),
+            "webhook_jobs": webhook_jobs.stats(),
+            "command_batches": command_dispatcher.stats(),
+            "command_outbox": command_outbox.stats(),
+            "cooldown_index": cooldown_index.stats(),
+            "sql_statements": sql_statements.stats(),
+            "trigger_history": trigger_history.stats(),
+            "driver_directory": driver_directory.stats(),
+            "bact_cache": bact_cache.stats(),
+            "company_card_cache": company_card_cache.stats(),
+        },
+    )
+
+
+@app.get("/topfly-metrics/files/", tags=["Metrics"])
+async def tachograph_files(unitId: str, driver: str = None, top: int = 5):
+    sid = await wialon_session.async_get_sid()
+    service = AsyncTopflyService(
+        sid,
+        unitId,
+        driver,
+        None,
+        session=wialon_session,
+        drivers=driver_directory,
+        bacts=bact_cache,
+    )
+    data = {"unit": await service.get_unit_files(unitId, top)}
+    if driver is not None:
+        c_code = await service.get_driver_c_code()
+        bact = await service.get_bact()
+        data["driver"] = await service.get_driver_files(c_code, bact, top)
+    return TopflyResponse(data=data)
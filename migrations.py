@@ -0,0 +1,53 @@
+from sqlalchemy import exists, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased
+
+from models import CompanySN, OutboxCommand
+
+
+def dedupe_company_sn(connection) -> int:
+    """Keep only the latest trigger of every card serial; returns how many rows went."""
+    newer = aliased(CompanySN)
+    table = CompanySN.__table__
+    superseded = exists(
+        select(newer.id).where(
+            newer.sn == table.c.sn,
+            (newer.trigger_at > table.c.trigger_at)
+            | ((newer.trigger_at == table.c.trigger_at) & (newer.id > table.c.id)),
+        )
+    )
+    return connection.execute(table.delete().where(superseded)).rowcount
+
+
+def add_missing_columns(connection, table) -> list:
+    """Add the nullable columns of ``table`` the existing table lacks; returns their names."""
+    inspector = inspect(connection)
+    if not inspector.has_table(table.name):
+        return []
+    present = {column["name"] for column in inspector.get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name not in present:
+            connection.execute(
+                text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                    f"{column.type.compile(connection.dialect)}"
+                )
+            )
+            added.append(column.name)
+    return added
+
+
+def migrate(engine: Engine) -> None:
+    """Bring a database created by an older release up to the current models.
+
+    ``create_all`` only creates missing tables; the unique index on
+    ``company_sn.sn`` has to be added to an existing table by hand, after
+    the duplicate rows older releases could write are removed. Likewise
+    ``outbox_command.claimed_at``, which came after the table.
+    """
+    with engine.begin() as connection:
+        dedupe_company_sn(connection)
+        for index in CompanySN.__table__.indexes:
+            index.create(connection, checkfirst=True)
+        add_missing_columns(connection, OutboxCommand.__table__)
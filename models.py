@@ -1,6 +1,16 @@
 from datetime import datetime
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+)
 
 from database import Base
 
@@ -8,7 +18,58 @@ from database import Base
 class CompanySN(Base):
     __tablename__ = "company_sn"
     id = Column(Integer, primary_key=True, index=True)
-    sn = Column(String)
+    sn = Column(String, unique=True, index=True)
     driver = Column(String)
     unitId = Column(String)
     trigger_at = Column(DateTime, default=datetime.utcnow)
+
+
+class WebhookJob(Base):
+    __tablename__ = "webhook_job"
+    id = Column(Integer, primary_key=True, index=True)
+    unitId = Column(String)
+    driver = Column(String)
+    date = Column(String)
+    status = Column(String, default="pending", index=True)
+    attempts = Column(Integer, default=0)
+    status_code = Column(Integer)
+    message = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+
+class OutboxCommand(Base):
+    __tablename__ = "outbox_command"
+    id = Column(Integer, primary_key=True, index=True)
+    unitId = Column(String)
+    driver = Column(String)
+    sn = Column(String)
+    command = Column(String)
+    status = Column(String, default="pending", index=True)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    claimed_at = Column(DateTime)
+    sent_at = Column(DateTime)
+
+
+class TriggerEvent(Base):
+    __tablename__ = "trigger_event"
+    __table_args__ = (Index("ix_trigger_event_sn_trigger_at", "sn", "trigger_at"),)
+    id = Column(Integer, primary_key=True, index=True)
+    sn = Column(String)
+    driver = Column(String)
+    unitId = Column(String)
+    command = Column(String)
+    trigger_at = Column(DateTime, index=True)
+
+
+class TriggerDailyCount(Base):
+    __tablename__ = "trigger_daily_count"
+    __table_args__ = (UniqueConstraint("day", "sn"),)
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, index=True)
+    sn = Column(String)
+    count = Column(Integer, default=0)
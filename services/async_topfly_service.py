@@ -0,0 +1,198 @@
+import asyncio
+import functools
+import json
+
+from services.command_dispatcher import CommandDispatcher
+from services.topfly_service import (
+    Topflygeofence_create,
+    Topflygeofence_delete,
+    TopflyService,
+    _DirectoryDrivers,
+    _driver_search_call,
+    _driver_stream,
+    _GeofenceIds,
+    _mask_rejected,
+    _parse_trailer_bact,
+    _reraise,
+    _trailer_bact_call,
+    async_login,
+    setting,
+)
+from utils.exception_handler import TopflyException
+
+
+class AsyncTopflyService(TopflyService):
+    def __init__(self, *args, commands: CommandDispatcher = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commands = commands
+
+    @staticmethod
+    async def get_sid():
+        return await async_login()
+
+    async def get_bact(self):
+        return await self._aget_bact(
+            self._bact_key(), self._bact_call(), self._parse_bact
+        )
+
+    async def get_driver_c_code(self):
+        c_code = self._cached_driver_c_code()
+        if c_code is None and self.drivers is not None:
+            await self.drivers.refresh(self._aload_drivers)
+            c_code = self._directory_c_code()
+        elif c_code is None and setting.STREAM_JSON_RESPONSES:
+            visit = self._driver_visitor()
+            c_code = self._parse_streamed_driver_c_code(
+                await self._astream(_driver_search_call(), visit, _driver_stream), visit
+            )
+        elif c_code is None:
+            c_code = self._parse_driver_c_code(
+                await self._arequest(_driver_search_call())
+            )
+        return c_code
+
+    async def get_unit_mt_epoch_time(self, unitId):
+        return (await self._alist_files(*self._unit_files(unitId))).mt
+
+    async def get_mt_epoch_time(self, c_code: str, bact):
+        return (await self._alist_files(*self._driver_files(bact, c_code))).mt
+
+    async def get_unit_files(self, unitId, top: int = 5):
+        return (await self._alist_files(*self._unit_files(unitId, top))).files()
+
+    async def get_driver_files(self, c_code: str, bact, top: int = 5):
+        return (await self._alist_files(*self._driver_files(bact, c_code, top))).files()
+
+    async def get_value_from_company_card_api(self):
+        sn_value = self._cached_company_card()
+        if sn_value is None:
+            sn_value = self._remember_company_card(
+                self._parse_company_card_content(
+                    await self._arequest_content(self._company_card_call())
+                )
+            )
+        return sn_value
+
+    async def send_command(self):
+        return self._command_sent(await self._asend_command("Scarico Tessera"))
+
+    async def send_command_tachigrafo(self):
+        return self._command_sent(await self._asend_command("Scarico Tachigrafo"))
+
+    async def _asend_command(self, command_name: str):
+        if self.commands is None:
+            return self._parse_command(
+                await self._arequest(self._command_call(command_name))
+            )
+        return self._parse_command_item(
+            await self.commands.submit(self, self._exec_command_call(command_name))
+        )
+
+    async def _alist_files(self, files_call, selector, select):
+        if setting.STREAM_JSON_RESPONSES:
+            fields = await self._astream(files_call(), selector)
+            if _mask_rejected(fields):
+                fields = await self._astream(files_call(masked=False), selector)
+            return select(fields, selector)
+        data_list = await self._arequest(files_call())
+        if _mask_rejected(data_list):
+            data_list = await self._arequest(files_call(masked=False))
+        return select(data_list, selector)
+
+    async def get_read_batch(self):
+        """Issue every independent webhook read as one ``core/batch`` request.
+
+        Returns a zero-argument parser per lookup name, so an item that failed
+        only raises its ``TopflyException`` for the lookup that uses it.
+        """
+        calls = self._read_calls()
+        parsers = self._read_parsers()
+        reads = self._cached_reads()
+        for name in reads:
+            del calls[name]
+        if self.drivers is not None and "get_driver_c_code" in calls:
+            # Refreshed for every webhook at once rather than inside each batch.
+            del calls["get_driver_c_code"]
+            batch, reads["get_driver_c_code"] = await asyncio.gather(
+                self._abatch(list(calls.values())), self._arefreshed_driver_c_code()
+            )
+        else:
+            batch = await self._abatch(list(calls.values()))
+        results = dict(zip(calls, batch))
+        unit_files = results.get("get_unit_mt_epoch_time")
+        if unit_files is not None and _mask_rejected(unit_files):
+            # Same fallback as ``_alist_files``: the batch sent the masked listing.
+            results["get_unit_mt_epoch_time"] = await self._arequest(
+                self._unit_files_call(self.unitId, masked=False)
+            )
+        reads.update(
+            {
+                name: functools.partial(parsers[name], result)
+                for name, result in results.items()
+            }
+        )
+        return reads
+
+    async def _aload_drivers(self):
+        if setting.STREAM_JSON_RESPONSES:
+            visit = _DirectoryDrivers()
+            self._load_streamed_drivers(
+                await self._astream(_driver_search_call(), visit, _driver_stream), visit
+            )
+        else:
+            self._load_drivers(await self._arequest(_driver_search_call()))
+
+    async def _arefreshed_driver_c_code(self):
+        """Reader for the card code once the shared directory refresh is done."""
+        try:
+            await self.drivers.refresh(self._aload_drivers)
+        except TopflyException as exc:
+            return functools.partial(_reraise, exc)
+        return self._directory_c_code
+
+
+class AsyncTopflygeofence_create(Topflygeofence_create):
+    @staticmethod
+    async def get_sid():
+        return await async_login()
+
+    async def get_bact(self):
+        return await self._aget_bact(
+            ("trailers", self.trailer),
+            _trailer_bact_call(self.trailer),
+            _parse_trailer_bact,
+            _reraise,
+        )
+
+    async def create(self, bact):
+        return self._parse_create(await self._arequest(self._create_call(bact)))
+
+
+class AsyncTopflygeofence_delete(Topflygeofence_delete):
+    @staticmethod
+    async def get_sid():
+        return await async_login()
+
+    async def get_bact(self):
+        return await self._aget_bact(
+            ("trailers", self.trailer),
+            _trailer_bact_call(self.trailer),
+            _parse_trailer_bact,
+            _reraise,
+        )
+
+    async def get_geofence(self, bact):
+        if setting.STREAM_JSON_RESPONSES:
+            visit = _GeofenceIds(self.trailer)
+            return self._parse_streamed_geofence(
+                await self._astream(self._geofence_call(bact), visit), visit
+            )
+        return self._parse_geofence(await self._arequest(self._geofence_call(bact)))
+
+    async def delete(self, bact, geofence):
+        data = []
+        for call in self._delete_calls(bact, geofence):
+            data.append(await self._arequest(call))
+            self._check_delete(data)
+
+        return json.dumps(data)
@@ -0,0 +1,17 @@
+from config import Settings
+from utils.cache import TTLCache
+
+setting = Settings()
+
+# (property type, name) -> bact, e.g. ("drivers", "Zaramella Andrea") or ("trailers", "AB123CD").
+bact_cache = TTLCache(
+    maxsize=setting.BACT_CACHE_SIZE,
+    ttl=setting.BACT_CACHE_TTL,
+    negative_ttl=setting.BACT_CACHE_NEGATIVE_TTL,
+)
+
+# unitId -> cc_sn of the company card inserted in the unit.
+company_card_cache = TTLCache(
+    maxsize=setting.COMPANY_CARD_CACHE_SIZE,
+    ttl=setting.COMPANY_CARD_CACHE_TTL,
+)
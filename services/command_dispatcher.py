@@ -0,0 +1,78 @@
+import asyncio
+
+from config import Settings
+
+setting = Settings()
+
+
+class CommandDispatcher:
+    """Send the ``unit/exec_cmd`` calls of many webhooks as one ``core/batch``.
+
+    A submitted command waits up to ``window`` seconds for others, or until
+    ``max_size`` are waiting, then the whole group goes out through the first
+    submitter's service (any session can command any unit). Each caller gets
+    its own item of the reply; a failure of the whole request is raised to
+    every caller of the group.
+    """
+
+    def __init__(self, window: float = 0.2, max_size: int = 50):
+        self.window = window
+        self.max_size = max_size
+        self._pending = []
+        self._timer = None
+        self.batches = 0
+        self.commands = 0
+        self.largest = 0
+        self.failed = 0
+
+    async def submit(self, service, call):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((service, call, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.window, self._flush
+            )
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "waiting": len(self._pending),
+            "batches": self.batches,
+            "commands": self.commands,
+            "avg_size": self.commands / self.batches if self.batches else 0,
+            "largest": self.largest,
+            "failed_batches": self.failed,
+        }
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            asyncio.ensure_future(self._send(pending))
+
+    async def _send(self, pending: list) -> None:
+        self.batches += 1
+        self.commands += len(pending)
+        self.largest = max(self.largest, len(pending))
+        service = pending[0][0]
+        try:
+            results = await service._abatch([call for _, call, _ in pending])
+        except Exception as exc:
+            self.failed += 1
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, _, future), result in zip(pending, results):
+            if not future.done():
+                future.set_result(result)
+
+
+command_dispatcher = CommandDispatcher(
+    window=setting.COMMAND_BATCH_WINDOW,
+    max_size=setting.COMMAND_BATCH_MAX_SIZE,
+)
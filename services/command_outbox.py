@@ -0,0 +1,208 @@
+import asyncio
+import datetime
+import time
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from models import OutboxCommand
+from utils.background import BackgroundLoop
+from utils.exception_handler import TopflyException
+from utils.timing import StepStats
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class CommandOutbox:
+    """Download commands written with the webhook decision and delivered afterwards.
+
+    ``add`` stages an :class:`OutboxCommand` in the caller's session, so the
+    ``CompanySN`` update and the command commit together; ``notify`` then
+    wakes the dispatcher. The dispatcher claims due rows, runs
+    ``sender(unitId, driver, command)`` for up to ``batch_size`` of them at
+    once and marks each ``sent``, or schedules a retry ``backoff`` seconds
+    later, doubling per attempt up to ``max_backoff``. After ``max_attempts``
+    a command is left ``failed``.
+
+    A claim is a lease of ``lease`` seconds, which must outlast a send. A row
+    still ``sending`` after that, because its process died or could not
+    record the outcome, is put back to ``pending`` by ``start`` and by the
+    running dispatcher, which checks at most once per ``lease``; rows other
+    live processes are sending are left alone. Delivery is at least once.
+    The dispatcher is a :class:`BackgroundLoop`; claims and outcomes are
+    written in a thread and no session is held across sends.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        sender,
+        batch_size: int = 20,
+        max_attempts: int = 5,
+        backoff: float = 30,
+        max_backoff: float = 900,
+        poll_interval: float = 5,
+        lease: float = 300,
+    ):
+        self.session_factory = session_factory
+        self.sender = sender
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.delivered = 0
+        self.retries = 0
+        self.failed = 0
+        self.requeued = 0
+        self._next_requeue = 0
+        self.latency = StepStats()
+        self._dispatcher = BackgroundLoop(self.deliver_due, poll_interval)
+
+    def add(
+        self, db: Session, unitId: str, driver: str, sn: str, command: str
+    ) -> OutboxCommand:
+        outbox_command = OutboxCommand(
+            unitId=unitId, driver=driver, sn=sn, command=command, status=PENDING
+        )
+        db.add(outbox_command)
+        return outbox_command
+
+    def notify(self) -> None:
+        self._dispatcher.wake()
+
+    async def start(self) -> None:
+        with self.session_factory() as db:
+            await asyncio.to_thread(self._requeue_stale, db)
+        self._dispatcher.start()
+
+    async def stop(self) -> None:
+        await self._dispatcher.stop()
+
+    async def deliver_due(self) -> int:
+        """Deliver one group of due commands; returns how many were attempted."""
+        claimed = await asyncio.to_thread(self._claim_due)
+        if not claimed:
+            return 0
+        outcomes = await asyncio.gather(
+            *(
+                self.sender(command.unitId, command.driver, command.command)
+                for command in claimed
+            ),
+            return_exceptions=True,
+        )
+        await asyncio.to_thread(
+            self._settle_all, [command.id for command in claimed], outcomes
+        )
+        return len(claimed)
+
+    def stats(self) -> dict:
+        with self.session_factory() as db:
+            by_status = dict(
+                db.query(OutboxCommand.status, func.count(OutboxCommand.id))
+                .group_by(OutboxCommand.status)
+                .all()
+            )
+            oldest = (
+                db.query(func.min(OutboxCommand.created_at))
+                .filter(OutboxCommand.status == PENDING)
+                .scalar()
+            )
+        return {
+            "pending": by_status.get(PENDING, 0),
+            "failed_total": by_status.get(FAILED, 0),
+            "oldest_pending_age": None
+            if oldest is None
+            else (datetime.datetime.utcnow() - oldest).total_seconds(),
+            "delivered": self.delivered,
+            "retries": self.retries,
+            "failed": self.failed,
+            "requeued": self.requeued,
+            "latency": self.latency.stats(),
+        }
+
+    def _requeue_stale(self, db: Session) -> None:
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.lease)
+        self.requeued += db.execute(
+            update(OutboxCommand)
+            .where(
+                OutboxCommand.status == SENDING,
+                # Rows claimed before claimed_at existed have none.
+                OutboxCommand.claimed_at.is_(None)
+                | (OutboxCommand.claimed_at < expired),
+            )
+            .values(status=PENDING)
+        ).rowcount
+        db.commit()
+        self._next_requeue = time.monotonic() + self.lease
+
+    def _claim_due(self) -> list:
+        with self.session_factory() as db:
+            if time.monotonic() >= self._next_requeue:
+                self._requeue_stale(db)
+            return self._claim(db)
+
+    def _settle_all(self, ids: list, outcomes: list) -> None:
+        now = datetime.datetime.utcnow()
+        with self.session_factory() as db:
+            commands = {
+                command.id: command
+                for command in db.query(OutboxCommand).filter(OutboxCommand.id.in_(ids))
+            }
+            for command_id, outcome in zip(ids, outcomes):
+                self._settle(commands[command_id], outcome, now)
+            db.commit()
+
+    def _claim(self, db: Session) -> list:
+        now = datetime.datetime.utcnow()
+        due = (
+            db.query(OutboxCommand.id)
+            .filter(
+                OutboxCommand.status == PENDING, OutboxCommand.next_attempt_at <= now
+            )
+            .order_by(OutboxCommand.id)
+            .limit(self.batch_size)
+            .all()
+        )
+        claimed = []
+        for (command_id,) in due:
+            # Conditional, so a row another dispatcher took first is skipped.
+            if db.execute(
+                update(OutboxCommand)
+                .where(OutboxCommand.id == command_id, OutboxCommand.status == PENDING)
+                .values(
+                    status=SENDING,
+                    claimed_at=now,
+                    attempts=OutboxCommand.attempts + 1,
+                )
+            ).rowcount:
+                claimed.append(command_id)
+        db.commit()
+        if not claimed:
+            return []
+        return db.query(OutboxCommand).filter(OutboxCommand.id.in_(claimed)).all()
+
+    def _settle(self, command: OutboxCommand, outcome, now: datetime.datetime) -> None:
+        if not isinstance(outcome, BaseException):
+            command.status = SENT
+            command.sent_at = now
+            command.last_error = None
+            self.delivered += 1
+            self.latency.record_step("lag", (now - command.created_at).total_seconds())
+            self.latency.record_step("attempts", command.attempts)
+            return
+        command.last_error = (
+            outcome.message if isinstance(outcome, TopflyException) else repr(outcome)
+        )
+        if command.attempts >= self.max_attempts:
+            command.status = FAILED
+            self.failed += 1
+            return
+        delay = min(self.backoff * 2 ** (command.attempts - 1), self.max_backoff)
+        command.status = PENDING
+        command.next_attempt_at = now + datetime.timedelta(seconds=delay)
+        self.retries += 1
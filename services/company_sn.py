@@ -0,0 +1,71 @@
+import datetime
+from typing import Optional
+
+from sqlalchemy import delete, or_, update
+from sqlalchemy.orm import Session
+
+from database import dialect_insert
+from models import CompanySN
+from services.cooldown_index import cooldown_cutoff
+
+NEW = "new"
+REPEAT = "repeat"
+
+
+def claim_trigger(
+    db: Session,
+    sn: str,
+    driver: str,
+    unitId: str,
+    now: datetime.datetime,
+    minutes: float = 30,
+) -> Optional[str]:
+    """Take the card's cooldown window for a command sent at ``now``.
+
+    A conditional ``UPDATE`` moves ``trigger_at`` forward only if the last
+    trigger is outside the window; for an unknown card an ``INSERT ... ON
+    CONFLICT DO NOTHING`` takes it instead. The affected-row count decides,
+    so of two concurrent webhooks exactly one claims. Returns ``NEW`` or
+    ``REPEAT`` for the claimer and ``None`` while the card is in cooldown.
+    Runs in the caller's transaction; the claim holds once it commits.
+    """
+    values = {"driver": driver, "unitId": unitId, "trigger_at": now}
+    claimed = db.execute(
+        update(CompanySN)
+        .where(
+            CompanySN.sn == sn,
+            or_(
+                CompanySN.trigger_at <= cooldown_cutoff(now, minutes),
+                CompanySN.trigger_at.is_(None),
+            ),
+        )
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if claimed:
+        return REPEAT
+    statement = dialect_insert(db)(CompanySN).values(sn=sn, **values)
+    inserted = db.execute(
+        statement.on_conflict_do_nothing(index_elements=[CompanySN.sn])
+    ).rowcount
+    return NEW if inserted else None
+
+
+def release_trigger(
+    db: Session, sn: str, claim: str, now: datetime.datetime, minutes: float = 30
+) -> None:
+    """Give back a claim whose command could not be sent, so the next webhook retries.
+
+    A new card's row is removed, so it still gets its first-time command; a
+    known card's trigger is moved back out of the window. Only the claim made
+    at ``now`` is touched.
+    """
+    if claim == NEW:
+        statement = delete(CompanySN)
+    else:
+        statement = update(CompanySN).values(trigger_at=cooldown_cutoff(now, minutes))
+    db.execute(
+        statement.where(
+            CompanySN.sn == sn, CompanySN.trigger_at == now
+        ).execution_options(synchronize_session=False)
+    )
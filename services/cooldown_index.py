@@ -0,0 +1,111 @@
+import datetime
+import heapq
+import threading
+from typing import NamedTuple
+
+from sqlalchemy.orm import Session
+
+from config import Settings
+from models import CompanySN
+
+setting = Settings()
+
+
+class CooldownEntry(NamedTuple):
+    trigger_at: datetime.datetime
+    driver: str
+    unitId: str
+
+
+def cooldown_cutoff(now: datetime.datetime, minutes: float = 30) -> datetime.datetime:
+    """Triggers at or before this moment no longer block a new command at ``now``.
+
+    The window is counted in whole minutes, rounded, so half a minute is added.
+    """
+    return now - datetime.timedelta(minutes=minutes + 0.5)
+
+
+def in_cooldown(
+    trigger_at: datetime.datetime, now: datetime.datetime, minutes: float = 30
+) -> bool:
+    """Whether a command triggered at ``trigger_at`` still blocks another one at ``now``."""
+    return trigger_at > cooldown_cutoff(now, minutes)
+
+
+class CooldownIndex:
+    """Card serials whose last download command is still inside the cooldown window.
+
+    Loaded from ``CompanySN`` at startup and written through after every
+    commit that triggers a command. It only answers "triggered recently";
+    a miss falls back to the table, so a trigger written by another process
+    is never skipped, at worst looked up in SQLite. Entries are dropped as
+    their window closes.
+    """
+
+    def __init__(self, minutes: float = 30):
+        self.minutes = minutes
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._expiries = []
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def recent(self, sn: str, now: datetime.datetime = None):
+        now = now or datetime.datetime.utcnow()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(sn)
+            if entry is not None and in_cooldown(entry.trigger_at, now, self.minutes):
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def record(
+        self, sn: str, trigger_at: datetime.datetime, driver: str, unitId: str
+    ) -> None:
+        with self._lock:
+            current = self._entries.get(sn)
+            if current is not None and current.trigger_at > trigger_at:
+                return
+            self._entries[sn] = CooldownEntry(trigger_at, driver, unitId)
+            heapq.heappush(self._expiries, (self._expires_at(trigger_at), sn))
+
+    def load(self, db: Session, now: datetime.datetime = None) -> None:
+        now = now or datetime.datetime.utcnow()
+        # One extra minute covers the rounding of ``in_cooldown``.
+        since = now - datetime.timedelta(minutes=self.minutes + 1)
+        rows = db.query(CompanySN).filter(CompanySN.trigger_at >= since).all()
+        for row in rows:
+            if in_cooldown(row.trigger_at, now, self.minutes):
+                self.record(row.sn, row.trigger_at, row.driver, row.unitId)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = {}
+            self._expiries = []
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+            }
+
+    def _expires_at(self, trigger_at: datetime.datetime) -> datetime.datetime:
+        return trigger_at + datetime.timedelta(minutes=self.minutes + 1)
+
+    def _expire(self, now: datetime.datetime) -> None:
+        while self._expiries and self._expiries[0][0] <= now:
+            expires_at, sn = heapq.heappop(self._expiries)
+            entry = self._entries.get(sn)
+            # A later ``record`` for the same card pushed its own expiry.
+            if entry is not None and self._expires_at(entry.trigger_at) == expires_at:
+                del self._entries[sn]
+                self.expired += 1
+
+
+cooldown_index = CooldownIndex(minutes=setting.COOLDOWN_MINUTES)
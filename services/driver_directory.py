@@ -0,0 +1,165 @@
+import threading
+import time
+from typing import NamedTuple
+
+from config import Settings
+from utils.singleflight import SingleFlight
+
+setting = Settings()
+
+
+class DriverEntry(NamedTuple):
+    c_code: str
+    resource_id: int
+
+
+class _IndexedDriver(NamedTuple):
+    mt: int
+    name: str
+    entry: DriverEntry
+
+
+class DriverDirectory:
+    """In-process index of every driver of the account, by driver name.
+
+    Built from the ``SEARCH_DRIVER_GROUP_ID_WITH_CODE_API`` response and trusted
+    for ``ttl`` seconds. A name that is not in a fresh index may trigger an early
+    refresh, at most once every ``miss_refresh_interval`` seconds.
+
+    After the first load a refresh is applied as a diff: drivers are keyed by
+    (resource id, driver id) and only those whose ``mt`` changed, appeared or
+    disappeared touch the index. Concurrent async refreshes go through
+    ``refresh``, so a cold or stale directory is downloaded once however many
+    drivers are being looked up.
+    """
+
+    def __init__(self, ttl: float = 3600, miss_refresh_interval: float = 60):
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self._lock = threading.Lock()
+        self._drivers = {}
+        self._by_name = {}
+        self._loaded_at = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.last_sync = {"added": 0, "changed": 0, "removed": 0}
+        self.flights = SingleFlight()
+
+    def get(self, name: str):
+        with self._lock:
+            entry = None if self._is_stale() else self._entry(name)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def should_refresh(self) -> bool:
+        with self._lock:
+            if self._loaded_at is None:
+                return True
+            return time.monotonic() - self._loaded_at >= min(
+                self.ttl, self.miss_refresh_interval
+            )
+
+    async def refresh(self, load) -> None:
+        """Await ``load()``, which downloads and syncs the directory, once for all concurrent callers."""
+        await self.flights.do(("refresh",), load)
+
+    def load(self, items: list) -> None:
+        seen = {}
+        for item in items:
+            drvrs = item.get("drvrs")
+            if drvrs:
+                for driver_id, driver in drvrs.items():
+                    index_driver(
+                        seen,
+                        item.get("id"),
+                        driver_id,
+                        driver["n"],
+                        driver["c"],
+                        driver.get("mt"),
+                    )
+        self.sync(seen)
+
+    def sync(self, seen: dict) -> None:
+        """Make the index match ``seen``, as built by :func:`index_driver`."""
+        with self._lock:
+            added = changed = 0
+            for key, driver in seen.items():
+                current = self._drivers.get(key)
+                if current == driver:
+                    continue
+                if current is None:
+                    added += 1
+                else:
+                    changed += 1
+                    self._unindex(key, current.name)
+                self._drivers[key] = driver
+                self._by_name.setdefault(driver.name, []).append(key)
+            removed = [key for key in self._drivers if key not in seen]
+            for key in removed:
+                self._unindex(key, self._drivers.pop(key).name)
+            self.last_sync = {
+                "added": added,
+                "changed": changed,
+                "removed": len(removed),
+            }
+            self._loaded_at = time.monotonic()
+            self.refreshes += 1
+
+    def find(self, name: str):
+        """Look ``name`` up without touching the hit/miss counters."""
+        with self._lock:
+            return self._entry(name)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._drivers = {}
+            self._by_name = {}
+            self._loaded_at = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "drivers": len(self._drivers),
+                "age": None
+                if self._loaded_at is None
+                else time.monotonic() - self._loaded_at,
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "last_sync": dict(self.last_sync),
+                "coalesced_refreshes": self.flights.stats()["coalesced_total"],
+            }
+
+    def _entry(self, name: str):
+        keys = self._by_name.get(name)
+        if not keys:
+            return None
+        return self._drivers[keys[0]].entry
+
+    def _unindex(self, key, name: str) -> None:
+        keys = self._by_name[name]
+        keys.remove(key)
+        if not keys:
+            del self._by_name[name]
+
+    def _is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+
+def index_driver(
+    seen: dict, resource_id, driver_id, name: str, c_code: str, mt
+) -> None:
+    """Add one driver of the search reply to ``seen``, keeping only what the index needs."""
+    seen[(resource_id, driver_id)] = _IndexedDriver(
+        mt, name, DriverEntry(c_code, resource_id)
+    )
+
+
+driver_directory = DriverDirectory(
+    ttl=setting.DRIVER_DIRECTORY_TTL,
+    miss_refresh_interval=setting.DRIVER_DIRECTORY_MISS_REFRESH_INTERVAL,
+)
@@ -0,0 +1,70 @@
+import heapq
+
+
+class NewestFiles:
+    """Single-pass pick of the newest ``file/list`` entries named like ``needle``.
+
+    Keeps the newest matching entry by ``mt`` (the later one on ties, as when
+    the list order was trusted) and, when ``top`` is set, a heap of the ``top``
+    newest for diagnostics. Works over a decoded list through ``update`` or as
+    a visitor of a streamed reply.
+    """
+
+    def __init__(self, needle: str, top: int = 0):
+        self.needle = needle
+        self.top = top
+        self.newest = None
+        self.matched = 0
+        self._heap = []
+
+    def __call__(self, data) -> bool:
+        if self.needle in data["n"]:
+            self._match(data)
+        return False
+
+    def update(self, data_list) -> "NewestFiles":
+        needle = self.needle
+        if self.top:
+            match = self._match
+            for data in data_list:
+                if needle in data["n"]:
+                    match(data)
+            return self
+        # Same selection as ``_match``, inlined: this loop runs once per listed file.
+        newest = self.newest
+        best = float("-inf") if newest is None else newest["mt"]
+        matched = self.matched
+        for data in data_list:
+            if needle in data["n"]:
+                matched += 1
+                if data["mt"] >= best:
+                    newest = data
+                    best = newest["mt"]
+        self.newest = newest
+        self.matched = matched
+        return self
+
+    def _match(self, data) -> None:
+        mt = data["mt"]
+        if self.newest is None or mt >= self.newest["mt"]:
+            self.newest = data
+        if self.top:
+            heap = self._heap
+            if len(heap) < self.top:
+                heapq.heappush(heap, (mt, self.matched, _summary(data)))
+            # ``matched`` only grows, so ties go to the later file.
+            elif mt >= heap[0][0]:
+                heapq.heapreplace(heap, (mt, self.matched, _summary(data)))
+        self.matched += 1
+
+    @property
+    def mt(self):
+        return None if self.newest is None else self.newest["mt"]
+
+    def files(self) -> list:
+        """The ``top`` newest matches, newest first."""
+        return [summary for _, _, summary in sorted(self._heap, reverse=True)]
+
+
+def _summary(data) -> dict:
+    return {"n": data["n"], "s": data.get("s"), "ct": data.get("ct"), "mt": data["mt"]}
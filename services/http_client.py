@@ -0,0 +1,200 @@
+import contextlib
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Settings
+
+setting = Settings()
+
+
+class TransferStats:
+    """Response body bytes per Wialon ``svc``, e.g. ``file/list``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_svc = {}
+
+    def record(self, url: str, size: int) -> None:
+        svc = _svc(url)
+        with self._lock:
+            transfer = self._by_svc.setdefault(svc, {"calls": 0, "bytes": 0, "last": 0})
+            transfer["calls"] += 1
+            transfer["bytes"] += size
+            transfer["last"] = size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                svc: {**transfer, "avg": transfer["bytes"] / transfer["calls"]}
+                for svc, transfer in self._by_svc.items()
+            }
+
+
+class WialonHttpClient:
+    """Keep-alive ``requests.Session`` shared by every Wialon call.
+
+    ``pool_maxsize`` caps the connections kept per host and, with
+    ``pool_block``, the number of concurrent connections opened to it.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = 4,
+        pool_maxsize: int = 20,
+        pool_block: bool = False,
+        timeout: float = None,
+    ):
+        self.timeout = timeout
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.transfers = TransferStats()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        with self._lock:
+            self.requests += 1
+        response = self.session.get(url, **kwargs)
+        if not kwargs.get("stream"):
+            self.transfers.record(url, len(response.content))
+        return response
+
+    @contextlib.contextmanager
+    def stream(self, url: str, chunk_size: int = 65536, **kwargs):
+        """Yield the body of ``url`` in chunks; leaving early drops the connection."""
+        response = self.get(url, stream=True, **kwargs)
+        size = 0
+        try:
+
+            def chunks():
+                nonlocal size
+                for chunk in response.iter_content(chunk_size):
+                    size += len(chunk)
+                    yield chunk
+
+            yield chunks()
+        finally:
+            response.close()
+            self.transfers.record(url, size)
+
+    def stats(self) -> dict:
+        pools = self.adapter.poolmanager.pools
+        hosts = []
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts.append(
+                {
+                    "host": pool.host,
+                    "port": pool.port,
+                    "maxsize": pool.pool.maxsize if pool.pool else 0,
+                    "idle": _idle_connections(pool),
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                }
+            )
+        return {
+            "requests": self.requests,
+            "pools": hosts,
+            "transfers": self.transfers.stats(),
+        }
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncWialonHttpClient:
+    """``httpx.AsyncClient`` counterpart of :class:`WialonHttpClient` for the async services."""
+
+    def __init__(
+        self,
+        pool_maxsize: int = 20,
+        max_connections: int = 100,
+        timeout: float = None,
+    ):
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=pool_maxsize,
+            ),
+            timeout=timeout,
+        )
+        self.requests = 0
+        self.in_flight = 0
+        self.transfers = TransferStats()
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            response = await self.client.get(url, **kwargs)
+        finally:
+            self.in_flight -= 1
+        self.transfers.record(url, len(response.content))
+        return response
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, chunk_size: int = 65536, **kwargs):
+        """Async counterpart of :meth:`WialonHttpClient.stream`."""
+        self.requests += 1
+        self.in_flight += 1
+        size = 0
+        try:
+            async with self.client.stream("GET", url, **kwargs) as response:
+
+                async def chunks():
+                    nonlocal size
+                    async for chunk in response.aiter_bytes(chunk_size):
+                        size += len(chunk)
+                        yield chunk
+
+                yield chunks()
+        finally:
+            self.in_flight -= 1
+            self.transfers.record(url, size)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "transfers": self.transfers.stats(),
+        }
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def _svc(url: str) -> str:
+    return url.partition("svc=")[2].partition("&")[0] or "unknown"
+
+
+def _idle_connections(pool) -> int:
+    # urllib3 pre-fills the queue with ``None`` slots for connections not yet opened.
+    if pool.pool is None:
+        return 0
+    return sum(1 for conn in list(pool.pool.queue) if conn is not None)
+
+
+http_client = WialonHttpClient(
+    pool_connections=setting.HTTP_POOL_CONNECTIONS,
+    pool_maxsize=setting.HTTP_POOL_MAXSIZE,
+    pool_block=setting.HTTP_POOL_BLOCK,
+    timeout=setting.HTTP_TIMEOUT,
+)
+
+async_http_client = AsyncWialonHttpClient(
+    pool_maxsize=setting.HTTP_POOL_MAXSIZE,
+    max_connections=setting.HTTP_ASYNC_MAX_CONNECTIONS,
+    timeout=setting.HTTP_TIMEOUT,
+)
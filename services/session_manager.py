@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+
+
+class WialonSessionManager:
+    """Process-wide Wialon session shared by every webhook.
+
+    Logs in once through ``login`` and hands the cached ``eid`` to the services.
+    When a call comes back with the invalid-session error the services ask for
+    a re-login, which only hits ``TOKEN_LOGIN_API`` again if no other caller
+    has already replaced the stale session. ``async_login`` serves the same
+    session to the async services without blocking the event loop.
+    """
+
+    def __init__(self, login, async_login=None):
+        self._login = login
+        self._async_login = async_login
+        self._lock = threading.Lock()
+        self._async_lock = None
+        self._sid = None
+        self._logged_in_at = None
+        self.logins = 0
+        self.relogins = 0
+
+    def get_sid(self) -> str:
+        with self._lock:
+            if self._sid is None:
+                self._refresh()
+            return self._sid
+
+    def relogin(self, stale_sid: str) -> str:
+        with self._lock:
+            if self._sid is None or self._sid == stale_sid:
+                self._refresh()
+                self.relogins += 1
+            return self._sid
+
+    async def async_get_sid(self) -> str:
+        if self._sid is not None:
+            return self._sid
+        async with self._get_async_lock():
+            if self._sid is None:
+                await self._async_refresh()
+            return self._sid
+
+    async def async_relogin(self, stale_sid: str) -> str:
+        async with self._get_async_lock():
+            if self._sid is None or self._sid == stale_sid:
+                await self._async_refresh()
+                self.relogins += 1
+            return self._sid
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._sid = None
+            self._logged_in_at = None
+
+    @property
+    def age(self):
+        if self._logged_in_at is None:
+            return None
+        return time.monotonic() - self._logged_in_at
+
+    def stats(self) -> dict:
+        return {
+            "active": self._sid is not None,
+            "age": self.age,
+            "logins": self.logins,
+            "relogins": self.relogins,
+        }
+
+    def _refresh(self) -> None:
+        self._sid = self._login()
+        self._logged_in_at = time.monotonic()
+        self.logins += 1
+
+    async def _async_refresh(self) -> None:
+        sid = await self._async_login()
+        with self._lock:
+            self._sid = sid
+            self._logged_in_at = time.monotonic()
+            self.logins += 1
+
+    def _get_async_lock(self) -> asyncio.Lock:
+        # Created lazily so it binds to the running loop, not the import-time one.
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        return self._async_lock
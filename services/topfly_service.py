@@ -1,50 +1,311 @@
+import functools
 import json
-
-import requests
+from typing import NamedTuple
 
 from config import Settings
+from services.driver_directory import DriverDirectory, index_driver
+from services.file_selection import NewestFiles
+from services.http_client import async_http_client, http_client
+from services.session_manager import WialonSessionManager
+from utils import json_backend
+from utils.cache import TTLCache
 from utils.exception_handler import TopflyException
+from utils.json_stream import ITEMS, MEMBERS, JsonArrayStream, JsonStream
 
 setting = Settings()
 
 TOKEN = setting.TOKEN
 TOKEN_LOGIN_API = "https://hst-api.wialon.com/wialon/ajax.html?svc=token/login"
-SEARCH_DRIVER_GROUP_ID_WITH_CODE_API = 'https://hst-api.wialon.com/wialon/ajax.html?svc=core/search_items&params={"spec":{"itemsType":"avl_resource","propType":"propitemname","propName":"drivers","propValueMask":"*","sortType":"drivers"},"force":1,"flags":256,"from":0,"to":0}'
+SEARCH_DRIVER_GROUP_ID_WITH_CODE_API = (
+    "https://hst-api.wialon.com/wialon/ajax.html?svc=core/search_items"
+)
+SEARCH_DRIVER_GROUP_ID_WITH_CODE_PARAMS = {
+    "spec": {
+        "itemsType": "avl_resource",
+        "propType": "propitemname",
+        "propName": "drivers",
+        "propValueMask": "*",
+        "sortType": "drivers",
+    },
+    "force": 1,
+    "flags": 257,
+    "from": 0,
+    "to": 0,
+}
 DRIVER_FILE_API = "https://hst-api.wialon.com/wialon/ajax.html?svc=file/list"
 UNIT_FILE_API = "https://hst-api.wialon.com/wialon/ajax.html?svc=file/list"
 COMPANY_CARD_API = (
     "https://hst-api.wialon.com/wialon/ajax.html?svc=unit/update_hw_params"
 )
 SEND_COMMAND_API = "https://hst-api.wialon.com/wialon/ajax.html?svc=core/batch"
+EXEC_COMMAND_API = "https://hst-api.wialon.com/wialon/ajax.html?svc=unit/exec_cmd"
+BATCH_API = "https://hst-api.wialon.com/wialon/ajax.html?svc=core/batch"
 
 GET_BACT_API = "https://hst-api.wialon.com/wialon/ajax.html?svc=core/search_items"
-GET_GEOFENCE_API = "https://hst-api.wialon.com/wialon/ajax.html?svc=resource/get_zone_data"
-CREATE_GEOFENCE_API = "https://hst-api.wialon.com/wialon/ajax.html?svc=resource/update_zone"
-DELETE_GEOFENCE_API = "https://hst-api.wialon.com/wialon/ajax.html?svc=resource/update_zone"
+GET_GEOFENCE_API = (
+    "https://hst-api.wialon.com/wialon/ajax.html?svc=resource/get_zone_data"
+)
+CREATE_GEOFENCE_API = (
+    "https://hst-api.wialon.com/wialon/ajax.html?svc=resource/update_zone"
+)
+DELETE_GEOFENCE_API = (
+    "https://hst-api.wialon.com/wialon/ajax.html?svc=resource/update_zone"
+)
+
+INVALID_SESSION_ERROR = 1
+UNIT_FILE_NAME = "tacho_file.DDD"
+UNIT_FILE_MASK = f"*{UNIT_FILE_NAME}*"
+
+
+def _login_url():
+    params = {"token": TOKEN, "fl": 2}
+    str_params = json_backend.dumps(params)
+    return f"{TOKEN_LOGIN_API}&params={str_params}"
+
+
+def _parse_login(data):
+    if "error" in data:
+        raise TopflyException(
+            data=data,
+            message=f"TOKEN_LOGIN_API: Failed to get session id with reason {data['reason']}",
+        )
+    return data["eid"]
+
+
+def login():
+    response = http_client.get(_login_url())
+    return _parse_login(json_backend.loads(response.content))
+
+
+async def async_login():
+    response = await async_http_client.get(_login_url())
+    return _parse_login(json_backend.loads(response.content))
 
 
-class TopflyService:
-    def __init__(self, sid: str, unitId: str, driver: str, date: str):
+def is_invalid_session(data) -> bool:
+    return isinstance(data, dict) and data.get("error") == INVALID_SESSION_ERROR
+
+
+def _is_invalid_session_content(content: bytes) -> bool:
+    # Only error replies are JSON objects; skip decoding the (large) list payloads.
+    return content.lstrip()[:1] == b"{" and is_invalid_session(
+        json_backend.loads(content)
+    )
+
+
+wialon_session = WialonSessionManager(login, async_login)
+
+
+class MissingBact(NamedTuple):
+    """Negative ``bact_cache`` entry: the search returned no item for the name."""
+
+    data: dict
+    message: str
+
+
+class WialonService:
+    def __init__(
+        self, sid: str, session: WialonSessionManager = None, bacts: TTLCache = None
+    ):
         self.sid = sid
+        self.session = session
+        self.bacts = bacts
+
+    @staticmethod
+    def get_sid():
+        return login()
+
+    def _get(self, url: str):
+        return json_backend.loads(self._get_content(url))
+
+    async def _aget(self, url: str):
+        return json_backend.loads(await self._aget_content(url))
+
+    def _get_content(self, url: str) -> bytes:
+        content = http_client.get(f"{url}&sid={self.sid}").content
+        if self.session is not None and _is_invalid_session_content(content):
+            self.sid = self.session.relogin(self.sid)
+            content = http_client.get(f"{url}&sid={self.sid}").content
+        return content
+
+    async def _aget_content(self, url: str) -> bytes:
+        content = (await async_http_client.get(f"{url}&sid={self.sid}")).content
+        if self.session is not None and _is_invalid_session_content(content):
+            self.sid = await self.session.async_relogin(self.sid)
+            content = (await async_http_client.get(f"{url}&sid={self.sid}")).content
+        return content
+
+    def _request(self, call):
+        api, params = call
+        return self._get(f"{api}&params={json_backend.dumps(params)}")
+
+    async def _arequest(self, call):
+        api, params = call
+        return await self._aget(f"{api}&params={json_backend.dumps(params)}")
+
+    def _request_content(self, call) -> bytes:
+        api, params = call
+        return self._get_content(f"{api}&params={json_backend.dumps(params)}")
+
+    async def _arequest_content(self, call) -> bytes:
+        api, params = call
+        return await self._aget_content(f"{api}&params={json_backend.dumps(params)}")
+
+    def _stream(self, call, visit, parser=JsonArrayStream):
+        """Feed what ``parser()`` emits from ``call``'s reply to ``visit`` until it returns true.
+
+        By default that is each element of the top-level JSON array. The
+        reply is decoded incrementally and never held whole. Returns its
+        other top-level members, e.g. ``{"error": 1}``.
+        """
+        api, params = call
+        url = f"{api}&params={json_backend.dumps(params)}"
+        fields = self._stream_get(url, visit, parser)
+        if self.session is not None and is_invalid_session(fields):
+            self.sid = self.session.relogin(self.sid)
+            fields = self._stream_get(url, visit, parser)
+        return fields
+
+    async def _astream(self, call, visit, parser=JsonArrayStream):
+        api, params = call
+        url = f"{api}&params={json_backend.dumps(params)}"
+        fields = await self._astream_get(url, visit, parser)
+        if self.session is not None and is_invalid_session(fields):
+            self.sid = await self.session.async_relogin(self.sid)
+            fields = await self._astream_get(url, visit, parser)
+        return fields
+
+    def _stream_get(self, url: str, visit, parser):
+        stream = parser()
+        with http_client.stream(
+            f"{url}&sid={self.sid}", setting.STREAM_CHUNK_SIZE
+        ) as chunks:
+            for item in stream.parse(chunks):
+                if visit(item):
+                    break
+        return stream.fields
+
+    async def _astream_get(self, url: str, visit, parser):
+        stream = parser()
+        async with async_http_client.stream(
+            f"{url}&sid={self.sid}", setting.STREAM_CHUNK_SIZE
+        ) as chunks:
+            items = stream.aparse(chunks)
+            try:
+                async for item in items:
+                    if visit(item):
+                        break
+            finally:
+                await items.aclose()
+        return stream.fields
+
+    async def _abatch(self, calls):
+        return _parse_batch(await self._arequest(_batch_call(calls)), len(calls))
+
+    def _get_bact(self, key, call, parse):
+        bact = self._cached_bact(key)
+        if bact is None:
+            bact = self._remember_bact(key, parse, self._request(call))
+        return bact
+
+    async def _aget_bact(self, key, call, parse):
+        bact = self._cached_bact(key)
+        if bact is None:
+            bact = self._remember_bact(key, parse, await self._arequest(call))
+        return bact
+
+    def _cached_bact(self, key):
+        if self.bacts is None:
+            return None
+        bact = self.bacts.get(key)
+        if isinstance(bact, MissingBact):
+            raise TopflyException(data=bact.data, message=bact.message)
+        return bact
+
+    def _remember_bact(self, key, parse, data):
+        try:
+            bact = parse(data)
+        except TopflyException as exc:
+            if self.bacts is not None and "error" not in data:
+                self.bacts.set_negative(key, MissingBact(exc.data, exc.message))
+            raise
+        if self.bacts is not None:
+            self.bacts.set(key, bact)
+        return bact
+
+
+class TopflyService(WialonService):
+    def __init__(
+        self,
+        sid: str,
+        unitId: str,
+        driver: str,
+        date: str,
+        session: WialonSessionManager = None,
+        drivers: DriverDirectory = None,
+        bacts: TTLCache = None,
+        company_cards: TTLCache = None,
+    ):
+        super().__init__(sid, session, bacts)
         self.unitId = unitId
         self.driver = driver
         self.date = date
+        self.drivers = drivers
+        self.company_cards = company_cards
 
-    @staticmethod
-    def get_sid():
-        params = {"token": TOKEN, "fl": 2}
-        str_params = json.dumps(params)
-        response = requests.get(f"{TOKEN_LOGIN_API}&params={str_params}")
-        data = response.json()
-        if "error" in data:
-            raise TopflyException(
-                data=data,
-                message=f"TOKEN_LOGIN_API: Failed to get session id with reason {data['reason']}",
+    def get_bact(self):
+        return self._get_bact(self._bact_key(), self._bact_call(), self._parse_bact)
+
+    def get_driver_c_code(self):
+        c_code = self._cached_driver_c_code()
+        if c_code is None and setting.STREAM_JSON_RESPONSES:
+            visit = self._driver_visitor()
+            c_code = self._parse_streamed_driver_c_code(
+                self._stream(_driver_search_call(), visit, _driver_stream), visit
             )
-        return data["eid"]
+        elif c_code is None:
+            c_code = self._parse_driver_c_code(self._request(_driver_search_call()))
+        return c_code
 
-    def get_bact(self):
-        params = json.dumps(
+    def get_unit_mt_epoch_time(self, unitId):
+        return self._list_files(*self._unit_files(unitId)).mt
+
+    def get_mt_epoch_time(self, c_code: str, bact):
+        return self._list_files(*self._driver_files(bact, c_code)).mt
+
+    def get_unit_files(self, unitId, top: int = 5):
+        """The ``top`` newest tachograph files of the unit, for diagnostics."""
+        return self._list_files(*self._unit_files(unitId, top)).files()
+
+    def get_driver_files(self, c_code: str, bact, top: int = 5):
+        return self._list_files(*self._driver_files(bact, c_code, top)).files()
+
+    def get_value_from_company_card_api(self):
+        sn_value = self._cached_company_card()
+        if sn_value is None:
+            sn_value = self._remember_company_card(
+                self._parse_company_card_content(
+                    self._request_content(self._company_card_call())
+                )
+            )
+        return sn_value
+
+    def send_command(self):
+        return self._command_sent(
+            self._parse_command(self._request(self._command_call("Scarico Tessera")))
+        )
+
+    def send_command_tachigrafo(self):
+        return self._command_sent(
+            self._parse_command(self._request(self._command_call("Scarico Tachigrafo")))
+        )
+
+    def _bact_key(self):
+        return ("drivers", self.driver)
+
+    def _bact_call(self):
+        return (
+            GET_BACT_API,
             {
                 "spec": {
                     "itemsType": "avl_resource",
@@ -57,11 +318,10 @@ class TopflyService:
                 "flags": 4,
                 "from": 0,
                 "to": 0,
-            }
+            },
         )
-        response = requests.get(
-            f"{GET_BACT_API}&params={params}&sid={self.sid}")
-        data = response.json()
+
+    def _parse_bact(self, data):
         if "error" in data:
             raise TopflyException(
                 data=data,
@@ -77,88 +337,208 @@ class TopflyService:
 
         return items[0]["bact"]
 
-    def get_driver_c_code(self):
-        response = requests.get(
-            f"{SEARCH_DRIVER_GROUP_ID_WITH_CODE_API}&sid={self.sid}"
-        )
-        data = response.json()
-        if "error" in data:
-            raise TopflyException(
-                data=data,
-                message=f"SEARCH_DRIVER_GROUP_ID_WITH_CODE_API: Failed with error {data['error']}. Most likely because of invalid sid",
-            )
+    def _read_calls(self):
+        """Every call of ``notification_webhook`` that depends on no other lookup."""
+        return {
+            "get_unit_mt_epoch_time": self._unit_files_call(self.unitId),
+            "get_bact": self._bact_call(),
+            "get_driver_c_code": _driver_search_call(),
+            "get_value_from_company_card_api": self._company_card_call(),
+        }
+
+    def _read_parsers(self):
+        return {
+            "get_unit_mt_epoch_time": self._parse_unit_mt_epoch_time,
+            "get_bact": functools.partial(
+                self._remember_bact, self._bact_key(), self._parse_bact
+            ),
+            "get_driver_c_code": self._parse_driver_c_code,
+            "get_value_from_company_card_api": lambda data_list: self._remember_company_card(
+                self._parse_company_card(data_list)
+            ),
+        }
+
+    def _cached_reads(self):
+        """Readers for the ``_read_calls`` the in-process caches can already answer."""
+        cached = {
+            "get_bact": functools.partial(self._cached_bact, self._bact_key()),
+            "get_driver_c_code": self._cached_driver_c_code,
+            "get_value_from_company_card_api": self._cached_company_card,
+        }
+        reads = {}
+        for name, read in cached.items():
+            try:
+                value = read()
+            except TopflyException as exc:
+                reads[name] = functools.partial(_reraise, exc)
+                continue
+            if value is not None:
+                reads[name] = functools.partial(_identity, value)
+        return reads
+
+    def _cached_driver_c_code(self):
+        """Card code from the driver directory, or ``None`` when it has to be searched."""
+        if self.drivers is None:
+            return None
+        entry = self.drivers.get(self.driver)
+        if entry is not None:
+            return entry.c_code
+        if not self.drivers.should_refresh():
+            self._raise_driver_not_found()
+        return None
+
+    def _parse_driver_c_code(self, data):
+        if self.drivers is not None:
+            self._load_drivers(data)
+            return self._directory_c_code()
+        self._check_driver_search(data)
         for item in data["items"]:
             drvrs = item.get("drvrs")
             if drvrs:
                 for _, driver in drvrs.items():
                     if self.driver == driver["n"]:
                         return driver["c"]
+        self._raise_driver_not_found()
+
+    def _driver_visitor(self):
+        # The directory indexes every driver, so only a plain lookup can stop early.
+        if self.drivers is not None:
+            return _DirectoryDrivers()
+        return _DriverMatch(self.driver)
+
+    def _parse_streamed_driver_c_code(self, fields, visit):
+        if isinstance(visit, _DirectoryDrivers):
+            self._load_streamed_drivers(fields, visit)
+            return self._directory_c_code()
+        self._check_driver_search(fields)
+        if visit.c_code is not None:
+            return visit.c_code
+        self._raise_driver_not_found()
+
+    def _load_drivers(self, data):
+        """Refresh the driver directory from a whole search reply."""
+        self._check_driver_search(data)
+        self.drivers.load(data["items"])
+
+    def _load_streamed_drivers(self, fields, visit):
+        self._check_driver_search(fields)
+        self.drivers.sync(visit.seen)
+
+    def _directory_c_code(self):
+        """Card code from the just refreshed driver directory."""
+        entry = self.drivers.find(self.driver)
+        if entry is None:
+            self._raise_driver_not_found()
+        return entry.c_code
+
+    def _check_driver_search(self, data):
+        if "error" in data:
+            raise TopflyException(
+                data=data,
+                message=f"SEARCH_DRIVER_GROUP_ID_WITH_CODE_API: Failed with error {data['error']}. Most likely because of invalid sid",
+            )
+
+    def _unit_files(self, unitId, top: int = 0):
+        return (
+            functools.partial(self._unit_files_call, unitId),
+            NewestFiles(UNIT_FILE_NAME, top),
+            self._select_unit_files,
+        )
+
+    def _driver_files(self, bact, c_code: str, top: int = 0):
+        return (
+            functools.partial(self._driver_files_call, bact, c_code),
+            NewestFiles(c_code, top),
+            self._select_driver_files,
+        )
+
+    def _list_files(self, files_call, selector, select):
+        """Run a ``file/list`` call through ``selector``, unmasked if the mask is rejected."""
+        if setting.STREAM_JSON_RESPONSES:
+            fields = self._stream(files_call(), selector)
+            if _mask_rejected(fields):
+                fields = self._stream(files_call(masked=False), selector)
+            # A streamed list leaves ``fields`` empty; an error reply raises.
+            return select(fields, selector)
+        data_list = self._request(files_call())
+        if _mask_rejected(data_list):
+            data_list = self._request(files_call(masked=False))
+        return select(data_list, selector)
+
+    def _raise_driver_not_found(self):
         raise TopflyException(
             message=f"No driver found with name {self.driver}",
         )
 
-    def get_unit_mt_epoch_time(self, unitId):
-        params = json.dumps(
+    def _unit_files_call(self, unitId, masked: bool = True):
+        return (
+            UNIT_FILE_API,
             {
                 "itemId": unitId,
                 "storageType": 2,
                 "path": "/tachograph",
-                "mask": "*",
+                "mask": _file_mask(UNIT_FILE_MASK, masked),
                 "recursive": False,
                 "fullPath": False,
-            }
+            },
         )
-        response = requests.get(
-            f"{UNIT_FILE_API}&params={params}&sid={self.sid}")
-        filtered_list = []
-        data_list = response.json()
+
+    def _parse_unit_mt_epoch_time(self, data_list):
+        return self._select_unit_files(data_list, NewestFiles(UNIT_FILE_NAME)).mt
+
+    def _select_unit_files(self, data_list, selector):
         if "error" in data_list:
             raise TopflyException(
                 data=data_list,
                 message=f"UNIT_FILE_API: Failed with error {data_list['error']}. Most likely because of invalid sid",
             )
-        for data in data_list:
-            if "tacho_file.DDD" in data["n"]:
-                filtered_list.append(data)
-        if len(filtered_list) == 0:
-            return None
-        return filtered_list[-1]["mt"]
+        return selector.update(data_list)
 
-    def get_mt_epoch_time(self, c_code: str, bact):
-        params = json.dumps(
+    def _driver_files_call(self, bact, c_code: str, masked: bool = True):
+        return (
+            DRIVER_FILE_API,
             {
                 "itemId": bact,
                 "storageType": 2,
                 "path": "tachograph/",
-                "mask": "*",
+                "mask": _file_mask(f"*{c_code}*", masked),
                 "recursive": False,
                 "fullPath": False,
-            }
+            },
         )
-        response = requests.get(
-            f"{DRIVER_FILE_API}&params={params}&sid={self.sid}")
-        filtered_list = []
-        data_list = response.json()
+
+    def _select_driver_files(self, data_list, selector):
         if "error" in data_list:
             raise TopflyException(
                 data=data_list,
                 message=f"DRIVER_FILE_API: Failed with error {data_list['error']}. Most likely because of invalid sid",
             )
-        for data in data_list:
-            if c_code in data["n"]:
-                filtered_list.append(data)
-        if len(filtered_list) == 0:
-            return None
-        return filtered_list[-1]["mt"]
+        return selector.update(data_list)
 
-    def get_value_from_company_card_api(self):
-        params = json.dumps(
-            {"itemId": self.unitId, "hwId": "23036132",
-                "fullData": 0, "action": "get"}
+    def _company_card_call(self):
+        return (
+            COMPANY_CARD_API,
+            {"itemId": self.unitId, "hwId": "23036132", "fullData": 0, "action": "get"},
         )
-        response = requests.get(
-            f"{COMPANY_CARD_API}&params={params}&sid={self.sid}")
-        data_list = response.json()
+
+    def _cached_company_card(self):
+        if self.company_cards is None:
+            return None
+        return self.company_cards.get(self.unitId)
+
+    def _remember_company_card(self, sn_value):
+        if self.company_cards is not None:
+            self.company_cards.set(self.unitId, sn_value)
+        return sn_value
+
+    def _parse_company_card_content(self, content: bytes):
+        if content.lstrip()[:1] == b"[":
+            data = _find_hw_param(content, "cc_sn")
+            if data is not None:
+                return data["value"]
+        return self._parse_company_card(json_backend.loads(content))
+
+    def _parse_company_card(self, data_list):
         if "error" in data_list:
             raise TopflyException(
                 data=data_list,
@@ -168,31 +548,32 @@ class TopflyService:
         for data in data_list:
             if data["name"] == name:
                 return data["value"]
-        raise TopflyException(
-            message=f"No Company sn found from company card API")
+        raise TopflyException(message=f"No Company sn found from company card API")
 
-    def send_command(self):
-        params = {
-            "params": [
-                {
-                    "svc": "unit/exec_cmd",
-                    "params": {
-                        "itemId": self.unitId,
-                        "commandName": "Scarico Tessera",
-                        "linkType": "",
-                        "param": "",
-                        "timeout": 60,
-                        "flags": 0,
-                    },
-                }
-            ],
-            "flags": 0,
-        }
-        str_params = json.dumps(params)
-        response = requests.get(
-            f"{SEND_COMMAND_API}&params={str_params}&sid={self.sid}"
+    def _command_call(self, command_name: str):
+        api, params = self._exec_command_call(command_name)
+        return (
+            SEND_COMMAND_API,
+            {
+                "params": [{"svc": api.split("svc=", 1)[1], "params": params}],
+                "flags": 0,
+            },
+        )
+
+    def _exec_command_call(self, command_name: str):
+        return (
+            EXEC_COMMAND_API,
+            {
+                "itemId": self.unitId,
+                "commandName": command_name,
+                "linkType": "",
+                "param": "",
+                "timeout": 60,
+                "flags": 0,
+            },
         )
-        data = response.json()
+
+    def _parse_command(self, data):
         if "error" in data:
             raise TopflyException(
                 data=data,
@@ -200,92 +581,50 @@ class TopflyService:
             )
         return data
 
-    def send_command_tachigrafo(self):
-        params = {
-            "params": [
-                {
-                    "svc": "unit/exec_cmd",
-                    "params": {
-                        "itemId": self.unitId,
-                        "commandName": "Scarico Tachigrafo",
-                        "linkType": "",
-                        "param": "",
-                        "timeout": 60,
-                        "flags": 0,
-                    },
-                }
-            ],
-            "flags": 0,
-        }
-        str_params = json.dumps(params)
-        response = requests.get(
-            f"{SEND_COMMAND_API}&params={str_params}&sid={self.sid}"
-        )
-        data = response.json()
-        if "error" in data:
+    def _parse_command_item(self, item):
+        """One ``unit/exec_cmd`` result of a shared ``core/batch``, shaped like ``_parse_command``'s."""
+        if "error" in item:
             raise TopflyException(
-                data=data,
-                message=f"SEND_COMMAND_API: Failed",
+                data=item,
+                message=f"SEND_COMMAND_API: Failed with error {item['error']}",
             )
+        return [item]
+
+    def _command_sent(self, data):
+        # The download may pick up a different card, so read it again next time.
+        if self.company_cards is not None:
+            self.company_cards.invalidate(self.unitId)
         return data
 
 
-class Topflygeofence_create:
-    def __init__(self, sid: str, trailer: str, lon: str, lat: str):
-        self.sid = sid
+class Topflygeofence_create(WialonService):
+    def __init__(
+        self,
+        sid: str,
+        trailer: str,
+        lon: str,
+        lat: str,
+        session: WialonSessionManager = None,
+        bacts: TTLCache = None,
+    ):
+        super().__init__(sid, session, bacts)
         self.trailer = trailer
         self.lon = lon
         self.lat = lat
 
-    @staticmethod
-    def get_sid():
-        params = {"token": TOKEN, "fl": 2}
-        str_params = json.dumps(params)
-        response = requests.get(f"{TOKEN_LOGIN_API}&params={str_params}")
-        data = response.json()
-        if "error" in data:
-            raise TopflyException(
-                data=data,
-                message=f"TOKEN_LOGIN_API: Failed to get session id with reason {data['reason']}",
-            )
-        return data["eid"]
-
     def get_bact(self):
-        params = json.dumps(
-            {
-                "spec": {
-                    "itemsType": "avl_resource",
-                    "propType": "propitemname",
-                    "propName": "trailers",
-                    "propValueMask": self.trailer,
-                    "sortType": "trailers",
-                },
-                "force": 1,
-                "flags": 4,
-                "from": 0,
-                "to": 0,
-            }
+        return self._get_bact(
+            ("trailers", self.trailer),
+            _trailer_bact_call(self.trailer),
+            _parse_trailer_bact,
         )
-        response = requests.get(
-            f"{GET_BACT_API}&params={params}&sid={self.sid}")
-        data = response.json()
-        if "error" in data:
-            raise TopflyException(
-                data=data,
-                message=f"GET_BACT_API: Failed.",
-            )
-
-        items = data["items"]
-        if len(items) == 0:
-            raise TopflyException(
-                data=data,
-                message=f"GET_BACT_API: BACT unavailable, please check permissions/trailer name.",
-            )
-
-        return items[0]["bact"]
 
     def create(self, bact):
-        params = json.dumps(
+        return self._parse_create(self._request(self._create_call(bact)))
+
+    def _create_call(self, bact):
+        return (
+            CREATE_GEOFENCE_API,
             {
                 "n": self.trailer,
                 "d": "",
@@ -304,12 +643,10 @@ class Topflygeofence_create:
                 "id": 0,
                 "callMode": "create",
                 "flags": 0,
-            }
+            },
         )
-        response = requests.get(
-            f"{CREATE_GEOFENCE_API}&params={params}&sid={self.sid}"
-        )
-        data = response.json()
+
+    def _parse_create(self, data):
         if "error" in data:
             raise TopflyException(
                 data=data,
@@ -318,69 +655,44 @@ class Topflygeofence_create:
         return data
 
 
-class Topflygeofence_delete:
-    def __init__(self, sid: str, trailer: str):
-        self.sid = sid
+class Topflygeofence_delete(WialonService):
+    def __init__(
+        self,
+        sid: str,
+        trailer: str,
+        session: WialonSessionManager = None,
+        bacts: TTLCache = None,
+    ):
+        super().__init__(sid, session, bacts)
         self.trailer = trailer
 
-    @staticmethod
-    def get_sid():
-        params = {"token": TOKEN, "fl": 2}
-        str_params = json.dumps(params)
-        response = requests.get(f"{TOKEN_LOGIN_API}&params={str_params}")
-        data = response.json()
-        if "error" in data:
-            raise TopflyException(
-                data=data,
-                message=f"TOKEN_LOGIN_API: Failed to get session id with reason {data['reason']}",
-            )
-        return data["eid"]
-
     def get_bact(self):
-        params = json.dumps(
-            {
-                "spec": {
-                    "itemsType": "avl_resource",
-                    "propType": "propitemname",
-                    "propName": "trailers",
-                    "propValueMask": self.trailer,
-                    "sortType": "trailers",
-                },
-                "force": 1,
-                "flags": 4,
-                "from": 0,
-                "to": 0,
-            }
+        return self._get_bact(
+            ("trailers", self.trailer),
+            _trailer_bact_call(self.trailer),
+            _parse_trailer_bact,
         )
-        response = requests.get(
-            f"{GET_BACT_API}&params={params}&sid={self.sid}")
-        data = response.json()
-        if "error" in data:
-            raise TopflyException(
-                data=data,
-                message=f"GET_BACT_API: Failed.",
-            )
 
-        items = data["items"]
-        if len(items) == 0:
-            raise TopflyException(
-                data=data,
-                message=f"GET_BACT_API: BACT unavailable, please check permissions/trailer name.",
+    def get_geofence(self, bact):
+        if setting.STREAM_JSON_RESPONSES:
+            visit = _GeofenceIds(self.trailer)
+            return self._parse_streamed_geofence(
+                self._stream(self._geofence_call(bact), visit), visit
             )
+        return self._parse_geofence(self._request(self._geofence_call(bact)))
 
-        return items[0]["bact"]
+    def delete(self, bact, geofence):
+        data = []
+        for call in self._delete_calls(bact, geofence):
+            data.append(self._request(call))
+            self._check_delete(data)
 
-    def get_geofence(self, bact):
-        params = json.dumps(
-            {
-                "itemId": bact,
-                "col": "*",
-                "flags": 31
-            }
-        )
-        response = requests.get(
-            f"{GET_GEOFENCE_API}&params={params}&sid={self.sid}")
-        data = response.json()
+        return json.dumps(data)
+
+    def _geofence_call(self, bact):
+        return (GET_GEOFENCE_API, {"itemId": bact, "col": "*", "flags": 31})
+
+    def _parse_geofence(self, data):
         if "error" in data:
             raise TopflyException(
                 data=data,
@@ -400,26 +712,193 @@ class Topflygeofence_delete:
 
         return geofence
 
-    def delete(self, bact, geofence):
-        params = []
+    def _parse_streamed_geofence(self, fields, visit):
+        if "error" in fields:
+            self._parse_geofence(fields)
+        # Only the trailer's zones were kept, so a miss reports an empty list.
+        return self._parse_geofence(visit.zones)
+
+    def _delete_calls(self, bact, geofence):
+        calls = []
         for i in geofence:
-            params.append(json.dumps(
-                {
-                    "itemId": bact,
-                    "id": i,
-                    "callMode": "delete"
-                }
-            ))
+            calls.append(
+                (DELETE_GEOFENCE_API, {"itemId": bact, "id": i, "callMode": "delete"})
+            )
+        return calls
 
-        data = []
-        for j in params:
-            response = requests.get(
-                f"{DELETE_GEOFENCE_API}&params={j}&sid={self.sid}")
-            data.append(response.json())
-            if "error" in data:
-                raise TopflyException(
-                    data=json.dumps(data),
-                    message=f"DELETE_GEOFENCE_API: Failed to delete geofence.",
-                )
+    def _check_delete(self, data):
+        if "error" in data:
+            raise TopflyException(
+                data=json.dumps(data),
+                message=f"DELETE_GEOFENCE_API: Failed to delete geofence.",
+            )
 
-        return json.dumps(data)
+
+def _driver_stream():
+    return JsonStream(("items", ITEMS, "drvrs", MEMBERS))
+
+
+class _DirectoryDrivers:
+    """Streaming visitor indexing each driver as it is decoded, for the driver directory.
+
+    A resource's id may follow its ``drvrs``, so its drivers wait, already
+    reduced to what the index keeps, until the resource closes.
+    """
+
+    def __init__(self):
+        self.seen = {}
+        self._pending = []
+
+    def __call__(self, event) -> bool:
+        path, value = event
+        if len(path) == 4:
+            self._pending.append((path[3], value["n"], value["c"], value.get("mt")))
+        elif len(path) == 2:
+            resource_id = value.fields.get("id")
+            for driver in self._pending:
+                index_driver(self.seen, resource_id, *driver)
+            self._pending = []
+        return False
+
+
+class _DriverMatch:
+    """Streaming visitor stopping at the first driver named ``name``."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.c_code = None
+
+    def __call__(self, event) -> bool:
+        path, value = event
+        if len(path) == 4 and value["n"] == self.name:
+            self.c_code = value["c"]
+            return True
+        return False
+
+
+class _GeofenceIds:
+    """Streaming visitor keeping only the zones of ``trailer``."""
+
+    def __init__(self, trailer: str):
+        self.trailer = trailer
+        self.zones = []
+
+    def __call__(self, item) -> bool:
+        if self.trailer in item["n"]:
+            self.zones.append({"n": item["n"], "id": item["id"]})
+        return False
+
+
+def _file_mask(mask: str, masked: bool) -> str:
+    """``file/list`` mask; the parsers filter client side as well, so ``*`` stays correct."""
+    return mask if masked and setting.FILE_LIST_SERVER_MASK else "*"
+
+
+def _mask_rejected(data) -> bool:
+    # Retry unmasked when Wialon refuses the mask itself, not when the session expired.
+    return (
+        setting.FILE_LIST_SERVER_MASK
+        and isinstance(data, dict)
+        and "error" in data
+        and not is_invalid_session(data)
+    )
+
+
+def _identity(value):
+    return value
+
+
+def _reraise(exc: Exception):
+    raise exc
+
+
+def _find_hw_param(content: bytes, name: str):
+    """Decode only ``name``'s entry of a raw ``unit/update_hw_params`` list.
+
+    Returns ``None`` when the entry cannot be isolated, in which case the caller
+    falls back to decoding the whole list.
+    """
+    needle = json.dumps(name).encode()
+    at = content.find(needle)
+    while at >= 0:
+        start = content.rfind(b"{", 0, at)
+        end = content.find(b"}", at)
+        if start >= 0 and end >= 0:
+            try:
+                data = json_backend.loads(content[start : end + 1])
+            except ValueError:
+                data = None
+            if isinstance(data, dict) and data.get("name") == name:
+                return data
+        at = content.find(needle, at + len(needle))
+    return None
+
+
+def _driver_search_call():
+    return (
+        SEARCH_DRIVER_GROUP_ID_WITH_CODE_API,
+        SEARCH_DRIVER_GROUP_ID_WITH_CODE_PARAMS,
+    )
+
+
+def _batch_call(calls):
+    return (
+        BATCH_API,
+        {
+            "params": [
+                {"svc": api.split("svc=", 1)[1], "params": params}
+                for api, params in calls
+            ],
+            "flags": 0,
+        },
+    )
+
+
+def _parse_batch(data, count: int):
+    if "error" in data:
+        raise TopflyException(
+            data=data,
+            message=f"BATCH_API: Failed with error {data['error']}",
+        )
+    if len(data) != count:
+        raise TopflyException(
+            data=data,
+            message=f"BATCH_API: Expected {count} results, got {len(data)}",
+        )
+    return data
+
+
+def _trailer_bact_call(trailer: str):
+    return (
+        GET_BACT_API,
+        {
+            "spec": {
+                "itemsType": "avl_resource",
+                "propType": "propitemname",
+                "propName": "trailers",
+                "propValueMask": trailer,
+                "sortType": "trailers",
+            },
+            "force": 1,
+            "flags": 4,
+            "from": 0,
+            "to": 0,
+        },
+    )
+
+
+def _parse_trailer_bact(data):
+    if "error" in data:
+        raise TopflyException(
+            data=data,
+            message=f"GET_BACT_API: Failed.",
+        )
+
+    items = data["items"]
+    if len(items) == 0:
+        raise TopflyException(
+            data=data,
+            message=f"GET_BACT_API: BACT unavailable, please check permissions/trailer name.",
+        )
+
+    return items[0]["bact"]
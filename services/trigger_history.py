@@ -0,0 +1,166 @@
+import asyncio
+import datetime
+
+from sentry_sdk import capture_exception
+from sqlalchemy import delete, func, insert, select
+
+from database import dialect_insert
+from models import TriggerDailyCount, TriggerEvent
+from utils.background import BackgroundLoop
+
+
+class TriggerHistory:
+    """Append-only log of every download command, written off the request path.
+
+    ``record`` only buffers the trigger in memory; a background task inserts
+    the buffer in one ``executemany`` every ``flush_interval`` seconds, or as
+    soon as ``batch_size`` triggers are waiting. If a flush fails the rows are
+    kept for the next one, up to ``max_buffer``; beyond that the oldest are
+    dropped and counted. Every ``rollup_interval`` seconds the events of days
+    older than ``retention_days`` are folded into per-card daily counts and
+    deleted, so the event table only holds the recent window. Both run on a
+    :class:`BackgroundLoop`, with the database work in a thread.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        batch_size: int = 100,
+        flush_interval: float = 5,
+        max_buffer: int = 10000,
+        retention_days: int = 30,
+        rollup_interval: float = 3600,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.retention_days = retention_days
+        self.rollup_interval = rollup_interval
+        self.written = 0
+        self.flushes = 0
+        self.dropped = 0
+        self.rolled_up = 0
+        self._buffer = []
+        self._next_rollup = None
+        self._writer = BackgroundLoop(self._flush_and_roll_up, flush_interval)
+
+    def record(
+        self,
+        sn: str,
+        driver: str,
+        unitId: str,
+        command: str,
+        trigger_at: datetime.datetime,
+    ) -> None:
+        self._buffer.append(
+            {
+                "sn": sn,
+                "driver": driver,
+                "unitId": unitId,
+                "command": command,
+                "trigger_at": trigger_at,
+            }
+        )
+        if len(self._buffer) > self.max_buffer:
+            del self._buffer[0]
+            self.dropped += 1
+        if len(self._buffer) >= self.batch_size:
+            self._writer.wake()
+
+    async def start(self) -> None:
+        self._next_rollup = asyncio.get_running_loop().time()
+        self._writer.start()
+
+    async def stop(self) -> None:
+        await self._writer.stop()
+        try:
+            await self.flush()
+        except Exception as exc:
+            # Shutdown goes on; the rows still buffered are lost with the process.
+            capture_exception(exc)
+
+    async def flush(self) -> int:
+        """Insert every buffered trigger in one statement; returns how many were written.
+
+        The buffer is swapped on the event loop, where ``record`` appends, and
+        the insert runs in a thread.
+        """
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        try:
+            await asyncio.to_thread(self._insert, rows)
+        except Exception:
+            # Keep them, ahead of the triggers recorded meanwhile.
+            self._buffer = rows + self._buffer
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped += overflow
+            raise
+        self.written += len(rows)
+        self.flushes += 1
+        return len(rows)
+
+    def _insert(self, rows: list) -> None:
+        with self.session_factory() as db:
+            db.execute(insert(TriggerEvent), rows)
+            db.commit()
+
+    def rollup(self, now: datetime.datetime = None) -> int:
+        """Fold events of whole days past the retention into daily counts; returns rows removed."""
+        now = now or datetime.datetime.utcnow()
+        cutoff = datetime.datetime.combine(
+            now.date() - datetime.timedelta(days=self.retention_days), datetime.time()
+        )
+        day = func.date(TriggerEvent.trigger_at)
+        with self.session_factory() as db:
+            counts = db.execute(
+                select(day, TriggerEvent.sn, func.count(TriggerEvent.id))
+                .where(TriggerEvent.trigger_at < cutoff)
+                .group_by(day, TriggerEvent.sn)
+            ).all()
+            if not counts:
+                return 0
+            upsert = dialect_insert(db)(TriggerDailyCount)
+            db.execute(
+                upsert.on_conflict_do_update(
+                    index_elements=[TriggerDailyCount.day, TriggerDailyCount.sn],
+                    set_={"count": TriggerDailyCount.count + upsert.excluded.count},
+                ),
+                [
+                    {"day": _as_date(event_day), "sn": sn, "count": count}
+                    for event_day, sn, count in counts
+                ],
+            )
+            removed = db.execute(
+                delete(TriggerEvent).where(TriggerEvent.trigger_at < cutoff)
+            ).rowcount
+            db.commit()
+        self.rolled_up += removed
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "flushes": self.flushes,
+            "dropped": self.dropped,
+            "rolled_up": self.rolled_up,
+        }
+
+    async def _flush_and_roll_up(self) -> None:
+        # A failed flush keeps its rows for the next round and skips the rollup.
+        await self.flush()
+        now = asyncio.get_running_loop().time()
+        if now >= self._next_rollup:
+            self._next_rollup = now + self.rollup_interval
+            await asyncio.to_thread(self.rollup)
+
+
+def _as_date(value) -> datetime.date:
+    # SQLite's date() returns text, Postgres returns a date.
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    return value
@@ -0,0 +1,180 @@
+import asyncio
+import datetime
+import time
+
+from sentry_sdk import capture_exception
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from models import WebhookJob
+from utils import json_backend
+from utils.background import BackgroundLoop
+from utils.exception_handler import TopflyException
+from utils.timing import StepStats
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class WebhookJobPool:
+    """Durable notification queue drained by ``workers`` concurrent tasks.
+
+    ``enqueue`` stores a :class:`WebhookJob` row and wakes the workers. Each
+    worker claims the oldest pending job with its own session, runs
+    ``handler(db, unitId, driver)`` and records the outcome on the row. The
+    table is polled every ``poll_interval`` seconds so rows written by other
+    processes are picked up too. The workers are a :class:`BackgroundLoop`;
+    claims and outcomes are written in a thread.
+
+    ``started_at`` doubles as a lease: a job that has been ``running`` for
+    over ``lease`` seconds was lost with its worker (or its outcome never
+    saved) and goes back to ``pending``. That sweep runs in ``start`` and,
+    at most once per ``lease``, before a claim.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        handler,
+        workers: int = 4,
+        poll_interval: float = 5,
+        lease: float = 300,
+    ):
+        self.session_factory = session_factory
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.processed = 0
+        self.failed = 0
+        self.requeued = 0
+        self._next_requeue = 0
+        self.latency = StepStats()
+        self._workers = BackgroundLoop(self._run_next, poll_interval, workers)
+
+    def enqueue(self, db: Session, unitId: str, driver: str, date: str) -> WebhookJob:
+        job = WebhookJob(unitId=unitId, driver=driver, date=date, status=PENDING)
+        db.add(job)
+        db.commit()
+        self.notify()
+        return job
+
+    def notify(self) -> None:
+        """Wake the workers; safe to call from the request's database thread."""
+        self._workers.wake()
+
+    async def start(self) -> None:
+        with self.session_factory() as db:
+            await asyncio.to_thread(self._requeue_stale, db)
+        self._workers.start()
+
+    async def stop(self) -> None:
+        await self._workers.stop()
+
+    async def run_pending(self) -> int:
+        """Process pending jobs in this task until none is left; returns how many ran."""
+        count = 0
+        while await self._run_next():
+            count += 1
+        return count
+
+    def stats(self) -> dict:
+        with self.session_factory() as db:
+            by_status = dict(
+                db.query(WebhookJob.status, func.count(WebhookJob.id))
+                .group_by(WebhookJob.status)
+                .all()
+            )
+        return {
+            "workers": self._workers.running,
+            "queue_depth": by_status.get(PENDING, 0),
+            "running": by_status.get(RUNNING, 0),
+            "processed": self.processed,
+            "failed": self.failed,
+            "requeued": self.requeued,
+            "latency": self.latency.stats(),
+        }
+
+    async def _run_next(self) -> bool:
+        with self.session_factory() as db:
+            job = await asyncio.to_thread(self._claim, db)
+            if job is None:
+                return False
+            await self._run(db, job)
+            return True
+
+    def _requeue_stale(self, db: Session) -> None:
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.lease)
+        self.requeued += db.execute(
+            update(WebhookJob)
+            .where(
+                WebhookJob.status == RUNNING,
+                WebhookJob.started_at.is_(None) | (WebhookJob.started_at < expired),
+            )
+            .values(status=PENDING)
+        ).rowcount
+        db.commit()
+        self._next_requeue = time.monotonic() + self.lease
+
+    def _claim(self, db: Session):
+        if time.monotonic() >= self._next_requeue:
+            self._requeue_stale(db)
+        while True:
+            job_id = (
+                db.query(WebhookJob.id)
+                .filter(WebhookJob.status == PENDING)
+                .order_by(WebhookJob.id)
+                .limit(1)
+                .scalar()
+            )
+            if job_id is None:
+                return None
+            claimed = db.execute(
+                update(WebhookJob)
+                .where(WebhookJob.id == job_id, WebhookJob.status == PENDING)
+                .values(
+                    status=RUNNING,
+                    started_at=datetime.datetime.utcnow(),
+                    attempts=WebhookJob.attempts + 1,
+                )
+            ).rowcount
+            db.commit()
+            if claimed:
+                return db.get(WebhookJob, job_id)
+
+    async def _run(self, db: Session, job: WebhookJob) -> None:
+        unitId, driver = job.unitId, job.driver
+        try:
+            response = await self.handler(db, unitId, driver)
+        except TopflyException as exc:
+            status, status_code, message = FAILED, exc.status_code, exc.message
+        except Exception as exc:
+            # A worker outlives any single job; report it like the request path would.
+            capture_exception(exc)
+            status, status_code, message = FAILED, 500, repr(exc)
+        else:
+            status, status_code = DONE, response.status_code
+            message = json_backend.loads(response.body)["message"]
+        await asyncio.to_thread(self._finish, db, job, status, status_code, message)
+        self.processed += 1
+        if status == FAILED:
+            self.failed += 1
+
+    def _finish(
+        self, db: Session, job: WebhookJob, status: str, status_code: int, message: str
+    ) -> None:
+        if status == FAILED:
+            db.rollback()
+        job.status = status
+        job.status_code = status_code
+        job.message = message
+        job.finished_at = datetime.datetime.utcnow()
+        db.commit()
+        self.latency.record_step(
+            "queued", (job.started_at - job.created_at).total_seconds()
+        )
+        self.latency.record_step(
+            "run", (job.finished_at - job.started_at).total_seconds()
+        )
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+
+from services.async_topfly_service import AsyncTopflyService
+from utils.lazy import LazyValue
+from utils.singleflight import SingleFlight
+from utils.timing import StepTimer
+
+
+class LookupCounters:
+    """How often each webhook lookup was fetched or skipped because no branch needed it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fetched = {}
+        self.avoided = {}
+
+    def record(self, name: str, started: bool) -> None:
+        counters = self.fetched if started else self.avoided
+        with self._lock:
+            counters[name] = counters.get(name, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "fetched": dict(self.fetched),
+                "avoided": dict(self.avoided),
+                "avoided_total": sum(self.avoided.values()),
+            }
+
+
+lookup_counters = LookupCounters()
+lookup_flights = SingleFlight()
+webhook_flights = SingleFlight()
+
+
+class WebhookLookups:
+    """Upstream values ``notification_webhook`` may need, each fetched on demand.
+
+    With ``prefetch`` every lookup is started up front and they run concurrently;
+    otherwise a lookup only hits Wialon when a decision branch awaits it. With
+    ``batch`` the lookups that depend on nothing else are read together in one
+    ``core/batch`` request the first time any of them is needed.
+
+    With ``flights`` a lookup already in flight for another webhook with the
+    same inputs (unit, driver, ...) is awaited instead of fetched again.
+    """
+
+    def __init__(
+        self,
+        service: AsyncTopflyService,
+        timer: StepTimer,
+        prefetch: bool = False,
+        batch: bool = False,
+        counters: LookupCounters = lookup_counters,
+        flights: SingleFlight = None,
+    ):
+        self.service = service
+        self.timer = timer
+        self.counters = counters
+        self.flights = flights
+        self._read_batch = None
+        self._batched = set()
+        if batch:
+            self._read_batch = self._lazy(
+                ("get_read_batch", service.unitId, service.driver),
+                service.get_read_batch,
+            )
+        self.unit_mt_epoch = self._read(
+            ("get_unit_mt_epoch_time", service.unitId),
+            lambda: service.get_unit_mt_epoch_time(service.unitId),
+        )
+        self.bact = self._read(("get_bact", service.driver), service.get_bact)
+        self.c_code = self._read(
+            ("get_driver_c_code", service.driver), service.get_driver_c_code
+        )
+        self.mt_epoch = LazyValue(self._get_mt_epoch_time)
+        self.company_sn = self._read(
+            ("get_value_from_company_card_api", service.unitId),
+            service.get_value_from_company_card_api,
+        )
+        self._values = {
+            "get_unit_mt_epoch_time": self.unit_mt_epoch,
+            "get_bact": self.bact,
+            "get_driver_c_code": self.c_code,
+            "get_mt_epoch_time": self.mt_epoch,
+            "get_value_from_company_card_api": self.company_sn,
+        }
+        if prefetch:
+            for value in self._values.values():
+                value.start()
+
+    def close(self) -> None:
+        batched = self._read_batch is not None and self._read_batch.started
+        for name, value in self._values.items():
+            self.counters.record(
+                name, value.started or (batched and name in self._batched)
+            )
+            value.discard()
+        if self._read_batch is not None:
+            self._read_batch.discard()
+
+    async def _get_mt_epoch_time(self):
+        bact, c_code = await asyncio.gather(self.bact.get(), self.c_code.get())
+        return await self.timer.measure(
+            "get_mt_epoch_time",
+            self._fetch(
+                ("get_mt_epoch_time", c_code, bact),
+                lambda: self.service.get_mt_epoch_time(c_code, bact),
+            ),
+        )
+
+    def _fetch(self, key: tuple, fetch):
+        if self.flights is None:
+            return fetch()
+        return self.flights.do(key, fetch)
+
+    def _lazy(self, key: tuple, fetch) -> LazyValue:
+        return LazyValue(lambda: self.timer.measure(key[0], self._fetch(key, fetch)))
+
+    def _read(self, key: tuple, fetch) -> LazyValue:
+        if self._read_batch is None:
+            return self._lazy(key, fetch)
+        name = key[0]
+        self._batched.add(name)
+        return LazyValue(lambda: self._from_read_batch(name))
+
+    async def _from_read_batch(self, name: str):
+        parsers = await self._read_batch.get()
+        return parsers[name]()
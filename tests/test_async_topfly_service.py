@@ -0,0 +1,209 @@
+import asyncio
+import contextlib
+import json
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from services.async_topfly_service import AsyncTopflygeofence_delete, AsyncTopflyService
+from services.driver_directory import DriverDirectory
+from services.session_manager import WialonSessionManager
+from services.topfly_service import UNIT_FILE_NAME, async_login, login
+from tests.topfly_api_responeses import (
+    COMPANY_CARD_API_RESPONSE,
+    DRIVER_FILE_API_RESPONSE,
+    GET_BACT_API_RESPONSE,
+    INVALID_SID_RESPONSE,
+    SEARCH_DRIVER_GROUP_ID_WITH_CODE_API_RESPONSE,
+    SEND_COMMAND_API_RESPONSE,
+    TOKEN_LOGIN_API_RESPONSE,
+)
+from utils.exception_handler import TopflyException
+
+
+def mock_responses(mock_get, *payloads):
+    mock_get.side_effect = [
+        Mock(json=Mock(return_value=payload), content=json.dumps(payload).encode())
+        for payload in payloads
+    ]
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_async_get_sid(mock_get, sid):
+    mock_responses(mock_get, TOKEN_LOGIN_API_RESPONSE)
+    assert asyncio.run(AsyncTopflyService.get_sid()) == sid
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_async_lookups(mock_get, driver_name, c_code, company_card_sn):
+    mock_responses(
+        mock_get,
+        GET_BACT_API_RESPONSE,
+        SEARCH_DRIVER_GROUP_ID_WITH_CODE_API_RESPONSE,
+        DRIVER_FILE_API_RESPONSE,
+        COMPANY_CARD_API_RESPONSE,
+        SEND_COMMAND_API_RESPONSE,
+    )
+    service = AsyncTopflyService("sid", "unitId", driver_name, "date")
+
+    async def run():
+        return (
+            await service.get_bact(),
+            await service.get_driver_c_code(),
+            await service.get_mt_epoch_time(c_code, 0),
+            await service.get_value_from_company_card_api(),
+            await service.send_command(),
+        )
+
+    assert asyncio.run(run()) == (
+        23080205,
+        c_code,
+        1663944440,
+        company_card_sn,
+        SEND_COMMAND_API_RESPONSE,
+    )
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_async_get_bact_with_invalid_sid(mock_get):
+    mock_responses(mock_get, INVALID_SID_RESPONSE)
+    service = AsyncTopflyService("sid", "unitId", "driver_name", "date")
+    with pytest.raises(TopflyException) as exc_info:
+        asyncio.run(service.get_bact())
+    assert exc_info.value.data == INVALID_SID_RESPONSE
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_async_relogin_on_invalid_sid(mock_get, sid):
+    mock_responses(
+        mock_get, INVALID_SID_RESPONSE, TOKEN_LOGIN_API_RESPONSE, GET_BACT_API_RESPONSE
+    )
+    session = WialonSessionManager(login, async_login)
+    service = AsyncTopflyService(
+        "expired_sid", "unitId", "driver_name", "date", session=session
+    )
+    assert asyncio.run(service.get_bact()) == 23080205
+    assert service.sid == sid
+    assert session.relogins == 1
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_async_geofence_delete(mock_get):
+    mock_responses(mock_get, {}, {})
+    service = AsyncTopflygeofence_delete("sid", "trailer")
+    assert asyncio.run(service.delete(0, [1, 2])) == "[{}, {}]"
+    assert mock_get.await_count == 2
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_get_read_batch_demultiplexes_results(mock_get, driver_name, c_code):
+    mock_responses(
+        mock_get,
+        [
+            DRIVER_FILE_API_RESPONSE,
+            GET_BACT_API_RESPONSE,
+            SEARCH_DRIVER_GROUP_ID_WITH_CODE_API_RESPONSE,
+            {"error": 7},
+        ],
+    )
+    service = AsyncTopflyService("sid", "unitId", driver_name, "date")
+    parsers = asyncio.run(service.get_read_batch())
+    assert mock_get.await_count == 1
+    assert "svc=core/batch" in mock_get.call_args.args[0]
+    assert parsers["get_unit_mt_epoch_time"]() is None
+    assert parsers["get_bact"]() == 23080205
+    assert parsers["get_driver_c_code"]() == c_code
+    with pytest.raises(TopflyException) as exc_info:
+        parsers["get_value_from_company_card_api"]()
+    assert exc_info.value.data == {"error": 7}
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_get_read_batch_refreshes_the_directory_outside_the_batch(
+    mock_get, driver_name, c_code
+):
+    def reply(url):
+        payload = (
+            [DRIVER_FILE_API_RESPONSE, GET_BACT_API_RESPONSE, COMPANY_CARD_API_RESPONSE]
+            if "svc=core/batch" in url
+            else SEARCH_DRIVER_GROUP_ID_WITH_CODE_API_RESPONSE
+        )
+        return Mock(
+            json=Mock(return_value=payload), content=json.dumps(payload).encode()
+        )
+
+    mock_get.side_effect = reply
+    directory = DriverDirectory(ttl=60)
+    service = AsyncTopflyService(
+        "sid", "unitId", driver_name, "date", drivers=directory
+    )
+    parsers = asyncio.run(service.get_read_batch())
+    assert mock_get.await_count == 2
+    assert parsers["get_bact"]() == 23080205
+    assert parsers["get_driver_c_code"]() == c_code
+    assert directory.refreshes == 1
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_get_read_batch_with_invalid_sid(mock_get):
+    mock_responses(mock_get, INVALID_SID_RESPONSE)
+    service = AsyncTopflyService("sid", "unitId", "driver_name", "date")
+    with pytest.raises(TopflyException) as exc_info:
+        asyncio.run(service.get_read_batch())
+    assert exc_info.value.data == INVALID_SID_RESPONSE
+
+
+def async_streamed(*payloads):
+    bodies = iter(json.dumps(payload).encode() for payload in payloads)
+
+    @contextlib.asynccontextmanager
+    async def stream(url, chunk_size):
+        body = next(bodies)
+
+        async def chunks():
+            for i in range(0, len(body), 8):
+                yield body[i : i + 8]
+
+        yield chunks()
+
+    return Mock(side_effect=stream)
+
+
+def test_async_streamed_get_geofence_relogin_on_invalid_sid(sid):
+    zones = [
+        {"n": "trailer A", "id": 3},
+        {"n": "other", "id": 4},
+        {"n": "trailer A 2", "id": 5},
+    ]
+    session = WialonSessionManager(login, AsyncMock(return_value=sid))
+    stream = async_streamed(INVALID_SID_RESPONSE, zones)
+    with patch("services.topfly_service.setting.STREAM_JSON_RESPONSES", True), patch(
+        "services.topfly_service.async_http_client.stream", stream
+    ):
+        service = AsyncTopflygeofence_delete(
+            "expired_sid", "trailer A", session=session
+        )
+        assert asyncio.run(service.get_geofence(0)) == [3, 5]
+    assert stream.call_args.args[0].endswith(f"&sid={sid}")
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_get_read_batch_retries_rejected_unit_mask_unmasked(mock_get, driver_name):
+    mock_responses(
+        mock_get,
+        [
+            {"error": 4},
+            GET_BACT_API_RESPONSE,
+            SEARCH_DRIVER_GROUP_ID_WITH_CODE_API_RESPONSE,
+            {},
+        ],
+        [{"n": f"20220901_{UNIT_FILE_NAME}", "mt": 1663944440}],
+    )
+    service = AsyncTopflyService("sid", "unitId", driver_name, "date")
+    parsers = asyncio.run(service.get_read_batch())
+    assert mock_get.await_count == 2
+    params = json.loads(
+        mock_get.call_args.args[0].partition("params=")[2].partition("&")[0]
+    )
+    assert params["mask"] == "*"
+    assert parsers["get_unit_mt_epoch_time"]() == 1663944440
@@ -0,0 +1,54 @@
+import asyncio
+from unittest.mock import patch
+
+from sqlalchemy.exc import OperationalError
+
+from utils.background import BackgroundLoop
+
+
+def test_a_failing_step_is_reported_and_retried_after_the_interval():
+    steps = []
+
+    async def step():
+        steps.append(len(steps))
+        if len(steps) == 1:
+            raise OperationalError("SELECT", {}, Exception("database is locked"))
+        return len(steps) < 3
+
+    loop = BackgroundLoop(step, interval=0.01)
+
+    async def run():
+        with patch("utils.background.capture_exception") as capture:
+            loop.start()
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if len(steps) >= 3:
+                    break
+            await loop.stop()
+        return capture
+
+    capture = asyncio.run(run())
+    capture.assert_called_once()
+    assert steps[:3] == [0, 1, 2]
+    assert loop.running == 0
+
+
+def test_wake_cuts_the_idle_wait_short():
+    steps = 0
+
+    async def step():
+        nonlocal steps
+        steps += 1
+
+    loop = BackgroundLoop(step, interval=60, tasks=2)
+
+    async def run():
+        loop.start()
+        await asyncio.sleep(0.01)
+        assert (loop.running, steps) == (2, 2)
+        loop.wake()
+        await asyncio.sleep(0.01)
+        await loop.stop()
+
+    asyncio.run(run())
+    assert steps >= 3
@@ -0,0 +1,71 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, Mock, patch
+
+from services.async_topfly_service import AsyncTopflyService
+from services.command_dispatcher import CommandDispatcher
+from tests.topfly_api_responeses import INVALID_SID_RESPONSE
+from utils.exception_handler import TopflyException
+
+
+def reply(payload):
+    return Mock(content=json.dumps(payload).encode())
+
+
+def services(dispatcher, *units):
+    return [
+        AsyncTopflyService("sid", unit, "driver", "date", commands=dispatcher)
+        for unit in units
+    ]
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_commands_in_window_share_one_batch(mock_get):
+    mock_get.return_value = reply([{}, {"error": 5}, {}])
+    dispatcher = CommandDispatcher(window=0.01, max_size=10)
+    first, second, third = services(dispatcher, "1", "2", "3")
+
+    async def run():
+        return await asyncio.gather(
+            first.send_command(),
+            second.send_command_tachigrafo(),
+            third.send_command(),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert mock_get.await_count == 1
+    params = json.loads(
+        mock_get.call_args.args[0].partition("params=")[2].partition("&")[0]
+    )
+    assert [
+        (item["svc"], item["params"]["itemId"], item["params"]["commandName"])
+        for item in params["params"]
+    ] == [
+        ("unit/exec_cmd", "1", "Scarico Tessera"),
+        ("unit/exec_cmd", "2", "Scarico Tachigrafo"),
+        ("unit/exec_cmd", "3", "Scarico Tessera"),
+    ]
+    assert results[0] == results[2] == [{}]
+    assert isinstance(results[1], TopflyException)
+    assert results[1].data == {"error": 5}
+    assert dispatcher.stats()["largest"] == 3
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_size_cap_flushes_and_batch_errors_reach_every_caller(mock_get):
+    mock_get.return_value = reply(INVALID_SID_RESPONSE)
+    dispatcher = CommandDispatcher(window=60, max_size=2)
+
+    async def run():
+        return await asyncio.wait_for(
+            asyncio.gather(
+                *(service.send_command() for service in services(dispatcher, "1", "2")),
+                return_exceptions=True,
+            ),
+            timeout=1,
+        )
+
+    results = asyncio.run(run())
+    assert all(result.data == INVALID_SID_RESPONSE for result in results)
+    assert dispatcher.stats()["failed_batches"] == 1
@@ -0,0 +1,81 @@
+import asyncio
+import datetime
+from unittest.mock import AsyncMock
+
+from models import OutboxCommand
+from services.command_outbox import FAILED, PENDING, SENDING, SENT, CommandOutbox
+from utils.exception_handler import TopflyException
+
+
+def stage(outbox, session_factory, *units):
+    with session_factory() as db:
+        for unit in units:
+            outbox.add(db, unit, "driver", f"sn-{unit}", "send_command")
+        db.commit()
+
+
+def test_deliver_due_marks_sent_and_backs_off_failures(session_factory):
+    sender = AsyncMock(
+        side_effect=[[{}], TopflyException(message="SEND_COMMAND_API: Failed")]
+    )
+    outbox = CommandOutbox(session_factory, sender, backoff=30, max_backoff=40)
+    stage(outbox, session_factory, "1", "2")
+
+    assert asyncio.run(outbox.deliver_due()) == 2
+    with session_factory() as db:
+        sent, retry = db.query(OutboxCommand).order_by(OutboxCommand.id).all()
+        assert (sent.status, sent.attempts) == (SENT, 1)
+        assert (retry.status, retry.attempts) == (PENDING, 1)
+        assert retry.last_error == "SEND_COMMAND_API: Failed"
+        assert retry.next_attempt_at - datetime.datetime.utcnow() > datetime.timedelta(
+            seconds=25
+        )
+    # Not due yet.
+    assert asyncio.run(outbox.deliver_due()) == 0
+    stats = outbox.stats()
+    assert (stats["pending"], stats["delivered"], stats["retries"]) == (1, 1, 1)
+    assert stats["latency"]["lag"]["count"] == 1
+
+
+def test_command_fails_after_max_attempts(session_factory):
+    outbox = CommandOutbox(
+        session_factory,
+        AsyncMock(side_effect=ConnectionError("down")),
+        max_attempts=2,
+        backoff=0,
+    )
+    stage(outbox, session_factory, "1")
+
+    assert asyncio.run(outbox.deliver_due()) == 1
+    assert asyncio.run(outbox.deliver_due()) == 1
+    assert asyncio.run(outbox.deliver_due()) == 0
+    with session_factory() as db:
+        command = db.query(OutboxCommand).one()
+        assert (command.status, command.attempts) == (FAILED, 2)
+        assert "down" in command.last_error
+    assert outbox.stats()["failed_total"] == 1
+
+
+def test_only_expired_leases_are_resent(session_factory):
+    sender = AsyncMock(return_value=[{}])
+    outbox = CommandOutbox(session_factory, sender, lease=300)
+    stage(outbox, session_factory, "expired", "live", "legacy")
+    now = datetime.datetime.utcnow()
+    with session_factory() as db:
+        for command, claimed_at in zip(
+            db.query(OutboxCommand).order_by(OutboxCommand.id),
+            [now - datetime.timedelta(minutes=10), now, None],
+        ):
+            command.status, command.claimed_at = SENDING, claimed_at
+        db.commit()
+
+    # Another process is still sending "live"; the other two lost their sender.
+    assert asyncio.run(outbox.deliver_due()) == 2
+    assert sorted(call.args[0] for call in sender.await_args_list) == [
+        "expired",
+        "legacy",
+    ]
+    with session_factory() as db:
+        live = db.query(OutboxCommand).filter(OutboxCommand.unitId == "live").one()
+        assert live.status == SENDING
+    assert outbox.stats()["requeued"] == 2
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from models import CompanySN
+from services.company_sn import NEW, REPEAT, claim_trigger, release_trigger
+
+NOW = datetime(2022, 1, 30, 12, 0)
+
+
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def test_claim_trigger_lets_one_claim_per_window():
+    db = session()
+
+    assert claim_trigger(db, "sn", "first", "1", NOW) == NEW
+    assert claim_trigger(db, "sn", "second", "2", NOW + timedelta(minutes=10)) is None
+    assert claim_trigger(db, "sn", "third", "3", NOW + timedelta(minutes=31)) == REPEAT
+    db.commit()
+
+    row = db.query(CompanySN).one()
+    assert (row.driver, row.trigger_at) == ("third", NOW + timedelta(minutes=31))
+    db.close()
+
+
+def test_release_trigger_reopens_the_window():
+    db = session()
+    claim_trigger(db, "new", "d", "u", NOW)
+    release_trigger(db, "new", NEW, NOW)
+    assert db.query(CompanySN).count() == 0
+
+    claim_trigger(db, "known", "d", "u", NOW - timedelta(hours=1))
+    assert claim_trigger(db, "known", "d", "u", NOW) == REPEAT
+    release_trigger(db, "known", REPEAT, NOW)
+    assert claim_trigger(db, "known", "d", "u", NOW + timedelta(seconds=1)) == REPEAT
+    db.close()
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from models import CompanySN
+from services.cooldown_index import CooldownIndex, in_cooldown
+
+NOW = datetime(2022, 1, 30, 12, 0)
+
+
+def test_in_cooldown_rounds_to_minutes():
+    assert in_cooldown(NOW - timedelta(minutes=30, seconds=20), NOW)
+    assert not in_cooldown(NOW - timedelta(minutes=31), NOW)
+
+
+def test_recent_returns_entry_inside_window():
+    index = CooldownIndex(minutes=30)
+    index.record("sn", NOW - timedelta(minutes=10), "driver", "unit")
+
+    entry = index.recent("sn", now=NOW)
+
+    assert (entry.driver, entry.unitId) == ("driver", "unit")
+    assert index.recent("other", now=NOW) is None
+    assert index.stats()["hits"] == 1
+    assert index.stats()["misses"] == 1
+
+
+def test_entries_expire_after_window():
+    index = CooldownIndex(minutes=30)
+    index.record("sn", NOW - timedelta(minutes=10), "driver", "unit")
+
+    assert index.recent("sn", now=NOW + timedelta(minutes=25)) is None
+    assert index.stats()["entries"] == 0
+    assert index.stats()["expired"] == 1
+
+
+def test_record_keeps_latest_trigger():
+    index = CooldownIndex(minutes=30)
+    index.record("sn", NOW - timedelta(minutes=5), "new", "unit")
+    index.record("sn", NOW - timedelta(minutes=20), "old", "unit")
+
+    # The stale heap entry of the first record must not evict the newer one.
+    assert index.recent("sn", now=NOW + timedelta(minutes=15)).driver == "new"
+
+
+def test_load_reads_recent_triggers():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all(
+        [
+            CompanySN(
+                sn="recent",
+                driver="d",
+                unitId="u",
+                trigger_at=NOW - timedelta(minutes=5),
+            ),
+            CompanySN(
+                sn="old", driver="d", unitId="u", trigger_at=NOW - timedelta(hours=2)
+            ),
+        ]
+    )
+    db.commit()
+    index = CooldownIndex(minutes=30)
+
+    index.load(db, now=NOW)
+
+    assert index.recent("recent", now=NOW) is not None
+    assert index.recent("old", now=NOW) is None
+    db.close()
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from config import Settings
+from database import async_url, make_engine, run_db, sync_url
+
+
+def test_concurrent_profile_applies_pragmas(tmp_path):
+    engine = make_engine(
+        f"sqlite:///{tmp_path / 'profile.db'}", Settings(SQLITE_PROFILE="concurrent")
+    )
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    engine.dispose()
+
+
+def test_default_profile_leaves_sqlite_defaults(tmp_path):
+    engine = make_engine(
+        f"sqlite:///{tmp_path / 'profile.db'}", Settings(SQLITE_PROFILE="default")
+    )
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "delete"
+    engine.dispose()
+
+
+def test_async_url_picks_the_backend_async_driver():
+    assert async_url("sqlite:///./topfly.db") == "sqlite+aiosqlite:///./topfly.db"
+    assert (
+        async_url("postgresql://user:secret@db/topfly")
+        == "postgresql+asyncpg://user:secret@db/topfly"
+    )
+    with pytest.raises(ValueError):
+        async_url("mysql://db/topfly")
+
+
+def test_sync_url_picks_psycopg_for_bare_postgres_urls():
+    assert (
+        sync_url("postgresql://user:secret@db/topfly")
+        == "postgresql+psycopg://user:secret@db/topfly"
+    )
+    assert (
+        sync_url("postgresql+psycopg2://db/topfly") == "postgresql+psycopg2://db/topfly"
+    )
+    assert sync_url("sqlite:///./topfly.db") == "sqlite:///./topfly.db"
+
+
+def test_run_db_runs_a_plain_session_off_the_event_loop(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'run.db'}")
+
+    def select(session, x):
+        return threading.get_ident(), session.execute(text(f"SELECT {x}")).scalar()
+
+    with Session(engine) as db:
+        thread, result = asyncio.run(run_db(db, select, 3))
+    assert result == 3
+    assert thread != threading.get_ident()
+    engine.dispose()
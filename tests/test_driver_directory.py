@@ -0,0 +1,137 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from services.async_topfly_service import AsyncTopflyService
+from services.driver_directory import DriverDirectory, DriverEntry
+from services.topfly_service import TopflyService
+from tests.topfly_api_responeses import SEARCH_DRIVER_GROUP_ID_WITH_CODE_API_RESPONSE
+from utils.exception_handler import TopflyException
+
+ITEMS = [
+    {
+        "id": 101,
+        "drvrs": {"1": {"id": 1, "n": "Zaramella Andrea", "c": "I100000165067000"}},
+    },
+    {
+        "id": 102,
+        "drvrs": {"1": {"id": 1, "n": "Finotti Stefano", "c": "I100000056855003"}},
+    },
+]
+
+
+def test_lookup_after_load():
+    directory = DriverDirectory(ttl=60)
+    assert directory.get("Zaramella Andrea") is None
+    directory.load(ITEMS)
+    assert directory.get("Zaramella Andrea") == DriverEntry("I100000165067000", 101)
+    assert directory.get("Finotti Stefano").resource_id == 102
+    assert directory.get("Unknown") is None
+    assert directory.stats()["drivers"] == 2
+    assert (directory.hits, directory.misses, directory.refreshes) == (2, 2, 1)
+
+
+def test_expired_index_is_a_miss():
+    directory = DriverDirectory(ttl=-1)
+    directory.load(ITEMS)
+    assert directory.get("Zaramella Andrea") is None
+    assert directory.should_refresh()
+
+
+def test_miss_refresh_is_rate_limited():
+    directory = DriverDirectory(ttl=60, miss_refresh_interval=30)
+    assert directory.should_refresh()
+    directory.load(ITEMS)
+    assert not directory.should_refresh()
+
+
+@patch("services.topfly_service.http_client.get")
+def test_get_driver_c_code_uses_directory(mock_get, driver_name, c_code):
+    mock_get.return_value = Mock(ok=True)
+    mock_get.return_value.content = json.dumps(
+        SEARCH_DRIVER_GROUP_ID_WITH_CODE_API_RESPONSE
+    ).encode()
+    directory = DriverDirectory(ttl=60)
+    service = TopflyService("sid", "unitId", driver_name, "date", drivers=directory)
+    assert service.get_driver_c_code() == c_code
+    assert service.get_driver_c_code() == c_code
+    assert mock_get.call_count == 1
+
+    service = TopflyService(
+        "sid", "unitId", "invalid_driver", "date", drivers=directory
+    )
+    with pytest.raises(TopflyException) as exc_info:
+        service.get_driver_c_code()
+    assert exc_info.value.message == "No driver found with name invalid_driver"
+    assert mock_get.call_count == 1
+
+
+def test_refresh_applies_only_changed_drivers():
+    directory = DriverDirectory(ttl=60)
+    directory.load(ITEMS)
+    assert directory.last_sync == {"added": 2, "changed": 0, "removed": 0}
+
+    directory.load(
+        [
+            {
+                "id": 101,
+                "drvrs": {
+                    "1": {"id": 1, "n": "Zaramella Andrea", "c": "I100000165067000"}
+                },
+            },
+            {
+                "id": 102,
+                "drvrs": {
+                    "1": {
+                        "id": 1,
+                        "n": "Finotti Stefano",
+                        "c": "I100000056855004",
+                        "mt": 2,
+                    },
+                },
+            },
+            {
+                "id": 103,
+                "drvrs": {"2": {"id": 2, "n": "Rossi Mario", "c": "I100000000000001"}},
+            },
+        ]
+    )
+    assert directory.last_sync == {"added": 1, "changed": 1, "removed": 0}
+    assert directory.find("Finotti Stefano").c_code == "I100000056855004"
+
+    directory.load(ITEMS[:1])
+    assert directory.last_sync == {"added": 0, "changed": 0, "removed": 2}
+    assert directory.find("Finotti Stefano") is None
+    assert directory.find("Rossi Mario") is None
+    assert directory.stats()["drivers"] == 1
+
+
+@patch("services.topfly_service.async_http_client.get", new_callable=AsyncMock)
+def test_concurrent_lookups_share_one_directory_refresh(mock_get):
+    async def search(url):
+        await asyncio.sleep(0.01)
+        return Mock(content=json.dumps({"items": ITEMS}).encode())
+
+    mock_get.side_effect = search
+    directory = DriverDirectory(ttl=60)
+    names = ["Zaramella Andrea", "Finotti Stefano"] * 5
+
+    async def run():
+        return await asyncio.gather(
+            *(
+                AsyncTopflyService(
+                    "sid", "unitId", name, "date", drivers=directory
+                ).get_driver_c_code()
+                for name in names + ["Unknown"]
+            ),
+            return_exceptions=True,
+        )
+
+    *c_codes, missing = asyncio.run(run())
+    assert c_codes == ["I100000165067000", "I100000056855003"] * 5
+    assert missing.message == "No driver found with name Unknown"
+    assert mock_get.await_count == 1
+    assert directory.refreshes == 1
+    assert directory.stats()["coalesced_refreshes"] == 10
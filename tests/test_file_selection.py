@@ -0,0 +1,23 @@
+from services.file_selection import NewestFiles
+from tests.topfly_api_responeses import DRIVER_FILE_API_RESPONSE
+
+
+def test_newest_by_mt_not_by_position():
+    files = [
+        {"n": "a_tacho_file.DDD", "mt": 30, "s": 1, "ct": 1},
+        {"n": "b_tacho_file.DDD", "mt": 50, "s": 2, "ct": 2},
+        {"n": "other.txt", "mt": 90},
+        {"n": "c_tacho_file.DDD", "mt": 40, "s": 3, "ct": 3},
+    ]
+    selector = NewestFiles("tacho_file.DDD", top=2).update(files)
+    assert selector.mt == 50
+    assert selector.matched == 3
+    assert selector.files() == [
+        {"n": "b_tacho_file.DDD", "s": 2, "ct": 2, "mt": 50},
+        {"n": "c_tacho_file.DDD", "s": 3, "ct": 3, "mt": 40},
+    ]
+
+
+def test_no_match_and_fixture(c_code):
+    assert NewestFiles("tacho_file.DDD").update([{"n": "x", "mt": 1}]).mt is None
+    assert NewestFiles(c_code).update(DRIVER_FILE_API_RESPONSE).mt == 1663944440
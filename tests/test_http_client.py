@@ -0,0 +1,49 @@
+from unittest.mock import patch
+
+from services.http_client import WialonHttpClient
+
+
+def test_get_uses_pooled_session_with_default_timeout():
+    client = WialonHttpClient(pool_maxsize=5, timeout=12)
+    with patch.object(client.session, "get") as mock_get:
+        client.get("https://hst-api.wialon.com/wialon/ajax.html?svc=core/batch")
+        client.get(
+            "https://hst-api.wialon.com/wialon/ajax.html?svc=core/batch", timeout=1
+        )
+    assert mock_get.call_args_list[0].kwargs["timeout"] == 12
+    assert mock_get.call_args_list[1].kwargs["timeout"] == 1
+    assert client.stats()["requests"] == 2
+
+
+def test_stats_reports_per_host_pools():
+    client = WialonHttpClient(pool_maxsize=5)
+    client.adapter.poolmanager.connection_from_url("https://hst-api.wialon.com")
+    stats = client.stats()
+    assert stats["pools"] == [
+        {
+            "host": "hst-api.wialon.com",
+            "port": 443,
+            "maxsize": 5,
+            "idle": 0,
+            "connections_opened": 0,
+            "requests": 0,
+        }
+    ]
+
+
+def test_stats_reports_bytes_per_svc():
+    client = WialonHttpClient()
+    with patch.object(client.session, "get") as mock_get:
+        mock_get.return_value.content = b"[]" * 10
+        client.get(
+            "https://hst-api.wialon.com/wialon/ajax.html?svc=file/list&params={}"
+        )
+        client.get(
+            "https://hst-api.wialon.com/wialon/ajax.html?svc=file/list&params={}"
+        )
+        mock_get.return_value.content = b"{}"
+        client.get("https://hst-api.wialon.com/wialon/ajax.html?svc=core/search_items")
+    assert client.stats()["transfers"] == {
+        "file/list": {"calls": 2, "bytes": 40, "last": 20, "avg": 20},
+        "core/search_items": {"calls": 1, "bytes": 2, "last": 2, "avg": 2},
+    }
@@ -0,0 +1,23 @@
+import json
+
+from utils import json_backend
+from utils.resp import TopflyResponse
+
+
+def test_dumps_is_compact_utf8_and_round_trips():
+    payload = {"n": "Zaramella Sàrl", "mt": 1663944440, 7: [1.5, None, True]}
+    assert (
+        json_backend.dumps(payload)
+        == '{"n":"Zaramella Sàrl","mt":1663944440,"7":[1.5,null,true]}'
+    )
+    assert json_backend.loads(json_backend.dumps_bytes(payload)) == json.loads(
+        json.dumps(payload)
+    )
+
+
+def test_topfly_response_renders_with_backend():
+    response = TopflyResponse(message="ok", data={"trigger_at": "2022-01-01 00:00:00"})
+    assert response.body == json_backend.dumps_bytes(
+        {"message": "ok", "data": {"trigger_at": "2022-01-01 00:00:00"}}
+    )
+    assert response.headers["content-type"] == "application/json"
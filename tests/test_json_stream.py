@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from utils.json_stream import ITEMS, MEMBERS, Closed, JsonArrayStream, JsonStream
+
+
+def chunked(payload, size):
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    return [body[i : i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("size", [1, 3, 64, 1 << 20])
+def test_parse_yields_array_key_items_and_keeps_other_fields(size):
+    payload = {
+        "searchSpec": {"itemsType": "avl_resource"},
+        "totalItemsCount": 2,
+        "items": [{"id": 1, "n": "Sàrl"}, {"id": 2, "mt": -1.5e3}],
+        "dataFlags": 257,
+    }
+    stream = JsonArrayStream("items")
+    assert list(stream.parse(chunked(payload, size))) == payload["items"]
+    assert stream.fields == {
+        "searchSpec": {"itemsType": "avl_resource"},
+        "totalItemsCount": 2,
+        "dataFlags": 257,
+    }
+
+
+@pytest.mark.parametrize("size", [1, 2, 1 << 20])
+def test_parse_top_level_array_and_error_reply(size):
+    files = [{"n": "tacho_file.DDD", "mt": 1663944440}, 12.25, None, True]
+    assert list(JsonArrayStream().parse(chunked(files, size))) == files
+
+    stream = JsonArrayStream()
+    assert list(stream.parse(chunked({"error": 1}, size))) == []
+    assert stream.fields == {"error": 1}
+
+
+def test_parse_stops_reading_when_the_consumer_does():
+    chunks = iter(chunked([{"n": str(i)} for i in range(100)], 16))
+    for item in JsonArrayStream().parse(chunks):
+        if item["n"] == "1":
+            break
+    assert len(list(chunks)) > 0
+
+
+@pytest.mark.parametrize("body", [b"[1, 2", b"[1,,2]", b'{"a" 1}', b"[1] 2"])
+def test_parse_rejects_malformed_documents(body):
+    with pytest.raises(json.JSONDecodeError):
+        list(JsonArrayStream().parse([body]))
+
+
+@pytest.mark.parametrize("size", [1, 7, 1 << 20])
+def test_stream_walks_nested_members_and_reports_closed_containers(size):
+    payload = {
+        "items": [
+            {"nm": "A", "drvrs": {"1": {"n": "x"}, "2": {"n": "y"}}, "id": 10},
+            {"id": 11, "drvrs": {}},
+        ],
+        "totalItemsCount": 2,
+    }
+    stream = JsonStream(("items", ITEMS, "drvrs", MEMBERS))
+    assert list(stream.parse(chunked(payload, size))) == [
+        (("items", 0, "drvrs", "1"), {"n": "x"}),
+        (("items", 0, "drvrs", "2"), {"n": "y"}),
+        (("items", 0, "drvrs"), Closed({})),
+        (("items", 0), Closed({"nm": "A", "id": 10})),
+        (("items", 1, "drvrs"), Closed({})),
+        (("items", 1), Closed({"id": 11})),
+        (("items",), Closed({})),
+    ]
+    assert stream.fields == {"totalItemsCount": 2}
@@ -0,0 +1,29 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+from utils.lazy import LazyValue
+
+
+def test_lazy_value_fetches_once_on_demand():
+    factory = AsyncMock(return_value="value")
+    value = LazyValue(factory)
+    assert not value.started
+
+    async def run():
+        return await asyncio.gather(value.get(), value.get())
+
+    assert asyncio.run(run()) == ["value", "value"]
+    assert value.started
+    factory.assert_awaited_once()
+
+
+def test_lazy_value_discard_cancels_pending_fetch():
+    async def run():
+        value = LazyValue(lambda: asyncio.sleep(10))
+        value.start()
+        await asyncio.sleep(0)
+        value.discard()
+        await asyncio.sleep(0)
+        return value._task.cancelled()
+
+    assert asyncio.run(run())
@@ -1,22 +1,33 @@
+import asyncio
 from datetime import datetime, timedelta
 from unittest.mock import patch
 
 import pytest
 from fastapi.testclient import TestClient
 from freezegun import freeze_time
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 
-from database import Base
-from main import app, get_db
+from database import Base, make_async_engine, run_db
+from main import _claim_trigger, app, get_db, setting
 from models import CompanySN
+from services.company_sn import NEW
+from services.cooldown_index import cooldown_index
+from services.webhook_lookups import lookup_counters
+from utils.exception_handler import TopflyException
+from utils.sql_stats import sql_statements
+from utils.timing import webhook_timings
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
+sql_statements.attach(engine)
 
 
 Base.metadata.create_all(bind=engine)
@@ -36,6 +47,7 @@ app.dependency_overrides[get_db] = override_get_db
 @pytest.fixture()
 def test_db():
     Base.metadata.create_all(bind=engine)
+    cooldown_index.clear()
     yield
     Base.metadata.drop_all(bind=engine)
 
@@ -45,14 +57,17 @@ client = TestClient(app)
 
 @pytest.fixture
 def mock_get_sid(sid):
-    with patch("services.topfly_service.TopflyService.get_sid", return_value=sid):
+    with patch(
+        "services.topfly_service.wialon_session.async_get_sid", return_value=sid
+    ):
         yield
 
 
 @pytest.fixture
 def mock_get_driver_c_code(c_code):
     with patch(
-        "services.topfly_service.TopflyService.get_driver_c_code", return_value=c_code
+        "services.async_topfly_service.AsyncTopflyService.get_driver_c_code",
+        return_value=c_code,
     ):
         yield
 
@@ -60,7 +75,7 @@ def mock_get_driver_c_code(c_code):
 @pytest.fixture
 def mock_get_mt_epoch_time(mt_epoch_time):
     with patch(
-        "services.topfly_service.TopflyService.get_mt_epoch_time",
+        "services.async_topfly_service.AsyncTopflyService.get_mt_epoch_time",
         return_value=mt_epoch_time,
     ):
         yield
@@ -69,7 +84,7 @@ def mock_get_mt_epoch_time(mt_epoch_time):
 @pytest.fixture
 def mock_get_value_from_company_card_api(company_card_sn):
     with patch(
-        "services.topfly_service.TopflyService.get_value_from_company_card_api",
+        "services.async_topfly_service.AsyncTopflyService.get_value_from_company_card_api",
         return_value=company_card_sn,
     ):
         yield
@@ -78,16 +93,25 @@ def mock_get_value_from_company_card_api(company_card_sn):
 @pytest.fixture
 def mock_send_command(send_command_response):
     with patch(
-        "services.topfly_service.TopflyService.send_command",
+        "services.async_topfly_service.AsyncTopflyService.send_command",
         return_value=send_command_response,
     ):
         yield
 
 
+@pytest.fixture
+def mock_get_unit_mt_epoch_time():
+    with patch(
+        "services.async_topfly_service.AsyncTopflyService.get_unit_mt_epoch_time",
+        return_value=None,
+    ):
+        yield
+
+
 @pytest.fixture
 def mock_get_bact(get_bact):
     with patch(
-        "services.topfly_service.TopflyService.get_bact",
+        "services.async_topfly_service.AsyncTopflyService.get_bact",
         return_value=get_bact,
     ):
         yield
@@ -200,3 +224,343 @@ def test_notification_webhook_after_30_minutes(
     assert response.status_code == 200
     data = response.json()
     assert data["message"] == "Command has been triggered successfully"
+
+
+@freeze_time("2022-01-02")
+@patch.object(setting, "WEBHOOK_PREFETCH_LOOKUPS", True)
+def test_notification_webhook_prefetch_runs_lookups_concurrently(
+    mock_get_sid,
+    mock_get_mt_epoch_time,
+    mock_get_value_from_company_card_api,
+    get_bact,
+    c_code,
+    mt_epoch_time,
+):
+    c_code_requested = asyncio.Event()
+
+    async def get_bact_after_c_code(self):
+        await asyncio.wait_for(c_code_requested.wait(), timeout=1)
+        return get_bact
+
+    async def get_driver_c_code(self):
+        c_code_requested.set()
+        return c_code
+
+    data = {
+        "driver": "Zaramella Andrea",
+        "unitId": 23149010,
+        "date": "22.09.2022 19:15:56",
+    }
+    with patch(
+        "services.async_topfly_service.AsyncTopflyService.get_bact",
+        get_bact_after_c_code,
+    ), patch(
+        "services.async_topfly_service.AsyncTopflyService.get_driver_c_code",
+        get_driver_c_code,
+    ), patch(
+        "services.async_topfly_service.AsyncTopflyService.get_unit_mt_epoch_time",
+        return_value=mt_epoch_time,
+    ):
+        response = client.post("/topfly-webhook/notification/", data=data)
+    assert response.status_code == 200
+    assert (
+        response.json()["message"]
+        == "Last modification time for unit is less than 60 days and for driver is less than 15 days"
+    )
+    assert {
+        "get_bact",
+        "get_driver_c_code",
+        "get_unit_mt_epoch_time",
+        "get_mt_epoch_time",
+        "total",
+    } <= webhook_timings.stats().keys()
+
+
+def test_notification_webhook_skips_driver_lookups_without_unit_file(
+    test_db,
+    mock_get_sid,
+    mock_get_unit_mt_epoch_time,
+    mock_get_value_from_company_card_api,
+    mock_send_command,
+):
+    avoided = lookup_counters.stats()["avoided"]
+    data = {
+        "driver": "Zaramella Andrea",
+        "unitId": 23149010,
+        "date": "22.09.2022 19:15:56",
+    }
+    with patch(
+        "services.async_topfly_service.AsyncTopflyService.get_bact"
+    ) as mock_get_bact, patch(
+        "services.async_topfly_service.AsyncTopflyService.get_driver_c_code"
+    ) as mock_get_driver_c_code, patch(
+        "services.async_topfly_service.AsyncTopflyService.get_mt_epoch_time"
+    ) as mock_get_mt_epoch_time:
+        response = client.post("/topfly-webhook/notification/", data=data)
+    assert response.status_code == 200
+    assert (
+        response.json()["message"]
+        == "Tachigrafo command has been triggered successfully."
+    )
+    mock_get_bact.assert_not_called()
+    mock_get_driver_c_code.assert_not_called()
+    mock_get_mt_epoch_time.assert_not_called()
+    for name in ("get_bact", "get_driver_c_code", "get_mt_epoch_time"):
+        assert lookup_counters.stats()["avoided"][name] == avoided.get(name, 0) + 1
+
+
+@freeze_time("2022-01-02")
+@patch.object(setting, "WEBHOOK_BATCH_LOOKUPS", True)
+def test_notification_webhook_batches_independent_lookups(
+    mock_get_sid,
+    mock_get_mt_epoch_time,
+    get_bact,
+    c_code,
+    mt_epoch_time,
+):
+    parsers = {
+        "get_unit_mt_epoch_time": lambda: mt_epoch_time,
+        "get_bact": lambda: get_bact,
+        "get_driver_c_code": lambda: c_code,
+        "get_value_from_company_card_api": lambda: None,
+    }
+    data = {
+        "driver": "Zaramella Andrea",
+        "unitId": 23149010,
+        "date": "22.09.2022 19:15:56",
+    }
+    with patch(
+        "services.async_topfly_service.AsyncTopflyService.get_read_batch",
+        return_value=parsers,
+    ) as mock_get_read_batch, patch(
+        "services.async_topfly_service.AsyncTopflyService.get_bact"
+    ) as mock_get_bact:
+        response = client.post("/topfly-webhook/notification/", data=data)
+    assert response.status_code == 200
+    assert (
+        response.json()["message"]
+        == "Last modification time for unit is less than 60 days and for driver is less than 15 days"
+    )
+    mock_get_read_batch.assert_awaited_once()
+    mock_get_bact.assert_not_called()
+
+
+def test_tachograph_files(mock_get_sid, mock_get_driver_c_code, mock_get_bact):
+    unit_files = [{"n": "x_tacho_file.DDD", "s": 10, "ct": 1, "mt": 2}]
+    with patch(
+        "services.async_topfly_service.AsyncTopflyService.get_unit_files",
+        return_value=unit_files,
+    ) as mock_get_unit_files, patch(
+        "services.async_topfly_service.AsyncTopflyService.get_driver_files",
+        return_value=[],
+    ) as mock_get_driver_files:
+        response = client.get(
+            "/topfly-metrics/files/",
+            params={"unitId": 23149010, "driver": "Zaramella Andrea", "top": 3},
+        )
+    assert response.status_code == 200
+    assert response.json()["data"] == {"unit": unit_files, "driver": []}
+    mock_get_unit_files.assert_awaited_once_with("23149010", 3)
+    mock_get_driver_files.assert_awaited_once()
+
+
+def test_notification_webhook_coalesces_concurrent_duplicates(mock_get_sid):
+    from main import notification_webhook
+    from services.webhook_lookups import webhook_flights
+    from utils.resp import TopflyResponse
+
+    async def decide(lookups, db, unitId, driver):
+        await asyncio.sleep(0.01)
+        return TopflyResponse(message="decided")
+
+    followers = webhook_flights.stats()["followers"].get("notification", 0)
+
+    async def run():
+        return await asyncio.gather(
+            *(
+                notification_webhook(
+                    unitId="23149010", driver="Zaramella Andrea", date="", db=None
+                )
+                for _ in range(3)
+            )
+        )
+
+    with patch("main._notification", side_effect=decide) as mock_notification:
+        responses = asyncio.run(run())
+    assert mock_notification.call_count == 1
+    assert responses[0] is responses[1] is responses[2]
+    assert webhook_flights.stats()["followers"]["notification"] == followers + 2
+
+
+@patch.object(setting, "WEBHOOK_ASYNC_JOBS", True)
+def test_notification_webhook_queues_job(test_db):
+    from main import webhook_jobs
+
+    data = {
+        "driver": "Zaramella Andrea",
+        "unitId": 23149010,
+        "date": "22.09.2022 19:15:56",
+    }
+    with patch.object(webhook_jobs, "session_factory", TestingSessionLocal), patch(
+        "main._notification_webhook"
+    ) as mock_notification:
+        response = client.post("/topfly-webhook/notification/", data=data)
+        assert response.status_code == 202
+        job_id = response.json()["data"]["job_id"]
+        assert webhook_jobs.stats()["queue_depth"] == 1
+        mock_notification.assert_not_called()
+
+    response = client.get(f"/topfly-webhook/jobs/{job_id}/")
+    assert response.json()["data"]["status"] == "pending"
+
+
+@patch.object(setting, "COMMAND_OUTBOX", True)
+def test_notification_webhook_stages_command_in_outbox(
+    test_db,
+    mock_get_sid,
+    mock_get_unit_mt_epoch_time,
+    mock_get_value_from_company_card_api,
+    company_card_sn,
+):
+    from models import OutboxCommand
+
+    data = {
+        "driver": "Zaramella Andrea",
+        "unitId": 23149010,
+        "date": "22.09.2022 19:15:56",
+    }
+    with patch(
+        "services.async_topfly_service.AsyncTopflyService.send_command"
+    ) as mock_send_command:
+        response = client.post("/topfly-webhook/notification/", data=data)
+    assert response.status_code == 200
+    mock_send_command.assert_not_called()
+    db = TestingSessionLocal()
+    try:
+        command = db.query(OutboxCommand).one()
+        assert (command.sn, command.command, command.status) == (
+            company_card_sn,
+            "send_command",
+            "pending",
+        )
+        assert db.query(CompanySN).filter(CompanySN.sn == company_card_sn).count() == 1
+    finally:
+        db.close()
+
+
+def test_notification_webhook_answers_cooldown_from_index(
+    test_db,
+    mock_get_sid,
+    mock_get_unit_mt_epoch_time,
+    mock_get_value_from_company_card_api,
+    company_card_sn,
+):
+    trigger_at = datetime.utcnow() - timedelta(minutes=5)
+    cooldown_index.record(company_card_sn, trigger_at, "driver", "unitId")
+    data = {
+        "driver": "Zaramella Andrea",
+        "unitId": 23149010,
+        "date": "22.09.2022 19:15:56",
+    }
+    with patch(
+        "services.async_topfly_service.AsyncTopflyService.send_command"
+    ) as mock_send_command:
+        response = client.post("/topfly-webhook/notification/", data=data)
+    assert response.status_code == 200
+    assert response.json()["data"] == {
+        "trigger_at": str(trigger_at),
+        "driver": "driver",
+        "unitId": "unitId",
+    }
+    mock_send_command.assert_not_called()
+    assert cooldown_index.stats()["hits"] >= 1
+
+
+def test_notification_webhook_releases_claim_when_command_fails(
+    test_db,
+    mock_get_sid,
+    mock_get_unit_mt_epoch_time,
+    mock_get_value_from_company_card_api,
+    company_card_sn,
+):
+    data = {
+        "driver": "Zaramella Andrea",
+        "unitId": 23149010,
+        "date": "22.09.2022 19:15:56",
+    }
+    with patch(
+        "services.async_topfly_service.AsyncTopflyService.send_command",
+        side_effect=TopflyException(message="Upstream failed", status_code=502),
+    ):
+        response = client.post("/topfly-webhook/notification/", data=data)
+    assert response.status_code == 502
+    db = TestingSessionLocal()
+    try:
+        assert db.query(CompanySN).filter(CompanySN.sn == company_card_sn).count() == 0
+    finally:
+        db.close()
+
+
+def test_notification_webhook_sql_round_trips(
+    test_db,
+    mock_get_sid,
+    mock_get_unit_mt_epoch_time,
+    mock_get_value_from_company_card_api,
+    mock_send_command,
+):
+    data = {
+        "driver": "Zaramella Andrea",
+        "unitId": 23149010,
+        "date": "22.09.2022 19:15:56",
+    }
+    # A new card: the conditional UPDATE finds nothing, the INSERT claims it.
+    client.post("/topfly-webhook/notification/", data=data)
+    assert sql_statements.stats()["webhook"]["last"] == 2
+
+    # In cooldown: both claim statements miss, one SELECT reads the holder.
+    cooldown_index.clear()
+    response = client.post("/topfly-webhook/notification/", data=data)
+    assert response.json()["data"]["driver"] == "Zaramella Andrea"
+    assert sql_statements.stats()["webhook"]["last"] == 3
+
+
+def test_get_db_claims_trigger_on_an_async_session(tmp_path, company_card_sn):
+    url = f"sqlite:///{tmp_path / 'async.db'}"
+    sync_engine = create_engine(url)
+    Base.metadata.create_all(bind=sync_engine)
+    async_engine = make_async_engine(url)
+    now = datetime.utcnow()
+
+    async def claim_twice():
+        claims = []
+        for _ in range(2):
+            async for db in get_db():
+                claims.append(
+                    await run_db(
+                        db,
+                        _claim_trigger,
+                        "unitId",
+                        "driver",
+                        company_card_sn,
+                        "send_command",
+                        now,
+                    )
+                )
+        return claims
+
+    with patch(
+        "main.AsyncSessionLocal",
+        async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False),
+    ):
+        (first, _), (second, holder) = asyncio.run(claim_twice())
+    asyncio.run(async_engine.dispose())
+
+    assert first == NEW
+    assert second is None
+    assert (holder.sn, holder.trigger_at) == (company_card_sn, now)
+    with sync_engine.connect() as connection:
+        assert (
+            connection.execute(select(func.count()).select_from(CompanySN)).scalar()
+            == 1
+        )
+    sync_engine.dispose()
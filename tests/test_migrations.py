@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from migrations import migrate
+
+NOW = datetime(2022, 1, 30, 12, 0)
+
+
+def test_migrate_dedupes_company_sn_and_adds_unique_index():
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        # The table as older releases created it: no index on ``sn``.
+        connection.execute(
+            text(
+                "CREATE TABLE company_sn (id INTEGER PRIMARY KEY, sn VARCHAR, "
+                "driver VARCHAR, unitId VARCHAR, trigger_at DATETIME)"
+            )
+        )
+        for id, sn, driver, trigger_at in [
+            (1, "a", "tie, lower id", NOW),
+            (2, "a", "new", NOW),
+            (3, "a", "old", NOW - timedelta(days=1)),
+            (4, "b", "only", NOW),
+        ]:
+            connection.execute(
+                text(
+                    "INSERT INTO company_sn VALUES (:id, :sn, :driver, 'u', :trigger_at)"
+                ),
+                {"id": id, "sn": sn, "driver": driver, "trigger_at": trigger_at},
+            )
+
+    migrate(engine)
+    migrate(engine)
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text("SELECT sn, driver FROM company_sn ORDER BY sn")
+        ).all()
+        assert rows == [("a", "new"), ("b", "only")]
+    indexes = {
+        index["name"]: index for index in inspect(engine).get_indexes("company_sn")
+    }
+    assert indexes["ix_company_sn_sn"]["unique"]
+    with pytest.raises(IntegrityError), engine.begin() as connection:
+        connection.execute(text("INSERT INTO company_sn (sn) VALUES ('b')"))
+
+
+def test_migrate_adds_the_outbox_lease_column():
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        # The table before claimed_at was added.
+        connection.execute(
+            text(
+                "CREATE TABLE outbox_command (id INTEGER PRIMARY KEY, unitId VARCHAR, "
+                "driver VARCHAR, sn VARCHAR, command VARCHAR, status VARCHAR, "
+                "attempts INTEGER, last_error VARCHAR, next_attempt_at DATETIME, "
+                "created_at DATETIME, sent_at DATETIME)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE company_sn (id INTEGER PRIMARY KEY, sn VARCHAR, "
+                "driver VARCHAR, unitId VARCHAR, trigger_at DATETIME)"
+            )
+        )
+
+    migrate(engine)
+    migrate(engine)
+
+    columns = {
+        column["name"] for column in inspect(engine).get_columns("outbox_command")
+    }
+    assert "claimed_at" in columns
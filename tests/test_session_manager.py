@@ -0,0 +1,33 @@
+from unittest.mock import Mock
+
+from services.session_manager import WialonSessionManager
+
+
+def test_get_sid_logs_in_once(sid):
+    login = Mock(return_value=sid)
+    session = WialonSessionManager(login)
+    assert session.get_sid() == sid
+    assert session.get_sid() == sid
+    assert login.call_count == 1
+    assert session.stats()["logins"] == 1
+    assert session.stats()["relogins"] == 0
+    assert session.age >= 0
+
+
+def test_relogin_replaces_stale_sid():
+    login = Mock(side_effect=["first", "second"])
+    session = WialonSessionManager(login)
+    assert session.get_sid() == "first"
+    assert session.relogin("first") == "second"
+    assert session.relogin("first") == "second"
+    assert login.call_count == 2
+    assert session.relogins == 1
+
+
+def test_invalidate_forces_new_login():
+    login = Mock(side_effect=["first", "second"])
+    session = WialonSessionManager(login)
+    session.get_sid()
+    session.invalidate()
+    assert session.age is None
+    assert session.get_sid() == "second"
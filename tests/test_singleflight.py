@@ -0,0 +1,68 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_the_leader_result():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch(unit):
+        calls.append(unit)
+        await asyncio.sleep(0.01)
+        return f"sn-{unit}"
+
+    async def run():
+        return await asyncio.gather(
+            flights.do(("get_value_from_company_card_api", 1), lambda: fetch(1)),
+            flights.do(("get_value_from_company_card_api", 1), lambda: fetch(1)),
+            flights.do(("get_value_from_company_card_api", 2), lambda: fetch(2)),
+        )
+
+    assert asyncio.run(run()) == ["sn-1", "sn-1", "sn-2"]
+    assert calls == [1, 2]
+    assert flights.stats() == {
+        "in_flight": 0,
+        "leaders": {"get_value_from_company_card_api": 2},
+        "followers": {"get_value_from_company_card_api": 1},
+        "coalesced_total": 1,
+    }
+
+
+def test_followers_get_the_leader_exception_and_later_calls_run_again():
+    flights = SingleFlight()
+    fetch = AsyncMock(side_effect=[ValueError("upstream"), "ok"])
+
+    async def run():
+        return await asyncio.gather(
+            flights.do(("get_bact", "driver"), fetch),
+            flights.do(("get_bact", "driver"), fetch),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert asyncio.run(flights.do(("get_bact", "driver"), fetch)) == "ok"
+    assert fetch.await_count == 2
+
+
+def test_cancelled_follower_does_not_cancel_the_leader():
+    flights = SingleFlight()
+
+    async def run():
+        leader = asyncio.ensure_future(
+            flights.do(("k",), lambda: asyncio.sleep(0.01, "done"))
+        )
+        follower = asyncio.ensure_future(
+            flights.do(("k",), lambda: asyncio.sleep(0.01, "x"))
+        )
+        await asyncio.sleep(0)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        return await leader
+
+    assert asyncio.run(run()) == "done"
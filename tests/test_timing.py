@@ -0,0 +1,19 @@
+import asyncio
+
+from utils.timing import StepStats, StepTimer
+
+
+def test_step_timer_records_each_step():
+    timer = StepTimer()
+
+    async def run():
+        return await timer.measure("lookup", asyncio.sleep(0, result="value"))
+
+    assert asyncio.run(run()) == "value"
+    assert timer.steps["lookup"] >= 0
+
+    stats = StepStats()
+    stats.record(timer)
+    stats.record(timer)
+    assert stats.stats()["lookup"]["count"] == 2
+    assert stats.stats()["total"]["count"] == 2
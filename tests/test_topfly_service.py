@@ -1,9 +1,12 @@
+import json
 from unittest.mock import Mock, patch
 
 import pytest
 
 from config import Settings
-from services.topfly_service import TopflyService
+from services.driver_directory import DriverDirectory, DriverEntry
+from services.session_manager import WialonSessionManager
+from services.topfly_service import TopflyService, _find_hw_param, login
 from tests.topfly_api_responeses import (
     COMPANY_CARD_API_RESPONSE,
     DRIVER_FILE_API_RESPONSE,
@@ -16,17 +19,18 @@ from tests.topfly_api_responeses import (
     TOKEN_LOGIN_API_RESPONSE,
     TOKEN_LOGIN_API_WRONG_TOKEN_LENGTH_RESPONSE,
 )
+from utils.cache import TTLCache
 from utils.exception_handler import TopflyException
 
 setting = Settings()
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_sid_with_invalid_token(mock_get):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = (
+    mock_get.return_value.content = json.dumps(
         TOKEN_LOGIN_API_INVALID_AUTH_TOKEN_RESPONSE
-    )
+    ).encode()
 
     with pytest.raises(TopflyException) as exc_info:
         TopflyService.get_sid()
@@ -40,12 +44,12 @@ def test_get_sid_with_invalid_token(mock_get):
     assert exc_info.value.data == TOKEN_LOGIN_API_INVALID_AUTH_TOKEN_RESPONSE
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_sid_with_wrong_token_length(mock_get):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = (
+    mock_get.return_value.content = json.dumps(
         TOKEN_LOGIN_API_WRONG_TOKEN_LENGTH_RESPONSE
-    )
+    ).encode()
 
     with pytest.raises(TopflyException) as exc_info:
         TopflyService.get_sid()
@@ -58,28 +62,28 @@ def test_get_sid_with_wrong_token_length(mock_get):
     assert exc_info.value.data == TOKEN_LOGIN_API_WRONG_TOKEN_LENGTH_RESPONSE
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_sid(mock_get, sid):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = TOKEN_LOGIN_API_RESPONSE
+    mock_get.return_value.content = json.dumps(TOKEN_LOGIN_API_RESPONSE).encode()
     service = TopflyService("sid", "unitId", "driver", "date")
     assert service.get_sid() == sid
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_driver_c_code(mock_get, driver_name):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = (
+    mock_get.return_value.content = json.dumps(
         SEARCH_DRIVER_GROUP_ID_WITH_CODE_API_RESPONSE
-    )
+    ).encode()
     service = TopflyService("sid", "unitId", driver_name, "date")
     assert service.get_driver_c_code() == "I100000165067000"
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_driver_c_code_with_invalid_sid(mock_get):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = INVALID_SID_RESPONSE
+    mock_get.return_value.content = json.dumps(INVALID_SID_RESPONSE).encode()
 
     from services.topfly_service import TopflyService
 
@@ -95,12 +99,12 @@ def test_get_driver_c_code_with_invalid_sid(mock_get):
     assert exc_info.value.data == INVALID_SID_RESPONSE
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_driver_c_code_with_invalid_driver_name(mock_get):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = (
+    mock_get.return_value.content = json.dumps(
         SEARCH_DRIVER_GROUP_ID_WITH_CODE_API_RESPONSE
-    )
+    ).encode()
 
     service = TopflyService("sid", "unitId", "invalid_driver", "date")
     with pytest.raises(TopflyException) as exc_info:
@@ -110,18 +114,18 @@ def test_get_driver_c_code_with_invalid_driver_name(mock_get):
     assert exc_info.value.message == "No driver found with name invalid_driver"
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_mt_epoch_time(mock_get, c_code):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = DRIVER_FILE_API_RESPONSE
+    mock_get.return_value.content = json.dumps(DRIVER_FILE_API_RESPONSE).encode()
     service = TopflyService("sid", "unitId", "driver_name", "date")
     assert service.get_mt_epoch_time(c_code, 0000) == 1663944440
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_mt_epoch_time_with_invalid_sid(mock_get):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = INVALID_SID_RESPONSE
+    mock_get.return_value.content = json.dumps(INVALID_SID_RESPONSE).encode()
 
     service = TopflyService("invalid_sid", "unitId", "driver", "date")
     with pytest.raises(TopflyException) as exc_info:
@@ -130,18 +134,18 @@ def test_get_mt_epoch_time_with_invalid_sid(mock_get):
     assert exc_info.value.status_code == 400
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_value_from_company_card_api(mock_get):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = COMPANY_CARD_API_RESPONSE
+    mock_get.return_value.content = json.dumps(COMPANY_CARD_API_RESPONSE).encode()
     service = TopflyService("sid", "unitId", "driver_name", "date")
     assert service.get_value_from_company_card_api() == "000FD0B7121704A5"
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_value_from_company_card_api_with_invalid_sid(mock_get):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = INVALID_SID_RESPONSE
+    mock_get.return_value.content = json.dumps(INVALID_SID_RESPONSE).encode()
 
     service = TopflyService("invalid_sid", "unitId", "driver", "date")
     with pytest.raises(TopflyException) as exc_info:
@@ -150,26 +154,28 @@ def test_get_value_from_company_card_api_with_invalid_sid(mock_get):
     assert exc_info.value.status_code == 400
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_send_command(mock_get):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = SEND_COMMAND_API_RESPONSE
+    mock_get.return_value.content = json.dumps(SEND_COMMAND_API_RESPONSE).encode()
     service = TopflyService("sid", "unitId", "driver_name", "date")
     assert service.send_command() == SEND_COMMAND_API_RESPONSE
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_bact(mock_get):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = GET_BACT_API_RESPONSE
+    mock_get.return_value.content = json.dumps(GET_BACT_API_RESPONSE).encode()
     service = TopflyService("sid", "unitId", "driver_name", "date")
     assert service.get_bact() == 23080205
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_bact_with_invalid_driver(mock_get):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = GET_BACT_API_EMPTY_ITEMS_RESPONSE
+    mock_get.return_value.content = json.dumps(
+        GET_BACT_API_EMPTY_ITEMS_RESPONSE
+    ).encode()
     service = TopflyService("sid", "unitId", "driver_name", "date")
     with pytest.raises(TopflyException) as exc_info:
         service.get_bact()
@@ -177,13 +183,202 @@ def test_get_bact_with_invalid_driver(mock_get):
     assert exc_info.value.status_code == 400
 
 
-@patch("services.topfly_service.requests.get")
+@patch("services.topfly_service.http_client.get")
 def test_get_bact_with_invalid_sid(mock_get):
     mock_get.return_value = Mock(ok=True)
-    mock_get.return_value.json.return_value = INVALID_SID_RESPONSE
+    mock_get.return_value.content = json.dumps(INVALID_SID_RESPONSE).encode()
     service = TopflyService("sid", "unitId", "driver_name", "date")
     with pytest.raises(TopflyException) as exc_info:
         service.get_bact()
     assert isinstance(exc_info.value, TopflyException)
     assert exc_info.value.status_code == 400
     assert exc_info.value.data == INVALID_SID_RESPONSE
+
+
+@patch("services.topfly_service.http_client.get")
+def test_get_bact_relogin_on_invalid_sid(mock_get, sid):
+    responses = [INVALID_SID_RESPONSE, TOKEN_LOGIN_API_RESPONSE, GET_BACT_API_RESPONSE]
+    mock_get.side_effect = [
+        Mock(ok=True, content=json.dumps(response).encode()) for response in responses
+    ]
+    session = WialonSessionManager(login)
+    service = TopflyService(
+        "expired_sid", "unitId", "driver_name", "date", session=session
+    )
+    assert service.get_bact() == 23080205
+    assert service.sid == sid
+    assert session.relogins == 1
+    assert mock_get.call_args.args[0].endswith(f"&sid={sid}")
+
+
+@patch("services.topfly_service.http_client.get")
+def test_get_bact_is_cached(mock_get):
+    mock_get.return_value = Mock(ok=True)
+    mock_get.return_value.content = json.dumps(GET_BACT_API_RESPONSE).encode()
+    bacts = TTLCache(ttl=60)
+    service = TopflyService("sid", "unitId", "driver_name", "date", bacts=bacts)
+    assert service.get_bact() == 23080205
+    assert service.get_bact() == 23080205
+    assert mock_get.call_count == 1
+    assert bacts.get(("drivers", "driver_name")) == 23080205
+
+    bacts.invalidate(("drivers", "driver_name"))
+    assert service.get_bact() == 23080205
+    assert mock_get.call_count == 2
+
+
+@patch("services.topfly_service.http_client.get")
+def test_get_bact_caches_empty_items(mock_get):
+    mock_get.return_value = Mock(ok=True)
+    mock_get.return_value.content = json.dumps(
+        GET_BACT_API_EMPTY_ITEMS_RESPONSE
+    ).encode()
+    service = TopflyService(
+        "sid", "unitId", "driver_name", "date", bacts=TTLCache(ttl=60)
+    )
+    for _ in range(2):
+        with pytest.raises(TopflyException) as exc_info:
+            service.get_bact()
+        assert exc_info.value.message == "GET_BACT_API: items Array is empty"
+    assert mock_get.call_count == 1
+
+
+@patch("services.topfly_service.http_client.get")
+def test_get_bact_does_not_cache_errors(mock_get):
+    mock_get.return_value = Mock(ok=True)
+    mock_get.return_value.content = json.dumps(INVALID_SID_RESPONSE).encode()
+    bacts = TTLCache(ttl=60)
+    service = TopflyService("sid", "unitId", "driver_name", "date", bacts=bacts)
+    with pytest.raises(TopflyException):
+        service.get_bact()
+    assert len(bacts) == 0
+
+
+@patch("services.topfly_service.http_client.get")
+def test_get_value_from_company_card_api_is_cached_until_command(
+    mock_get, company_card_sn
+):
+    mock_get.side_effect = [
+        Mock(ok=True, content=json.dumps(response).encode())
+        for response in (
+            COMPANY_CARD_API_RESPONSE,
+            SEND_COMMAND_API_RESPONSE,
+            COMPANY_CARD_API_RESPONSE,
+        )
+    ]
+    company_cards = TTLCache(ttl=60)
+    service = TopflyService(
+        "sid", "unitId", "driver_name", "date", company_cards=company_cards
+    )
+    assert service.get_value_from_company_card_api() == company_card_sn
+    assert service.get_value_from_company_card_api() == company_card_sn
+    assert mock_get.call_count == 1
+
+    service.send_command()
+    assert company_cards.get("unitId") is None
+    assert service.get_value_from_company_card_api() == company_card_sn
+    assert mock_get.call_count == 3
+
+
+def test_find_hw_param_decodes_only_the_matching_entry(company_card_sn):
+    content = json.dumps(
+        [
+            {"name": "note", "description": 'mentions "cc_sn" {braces}', "value": "1"},
+        ]
+        + COMPANY_CARD_API_RESPONSE
+    ).encode()
+    assert _find_hw_param(content, "cc_sn")["value"] == company_card_sn
+    assert _find_hw_param(content, "missing") is None
+
+
+@patch("services.topfly_service.http_client.get")
+def test_get_mt_epoch_time_masks_file_list(mock_get, c_code):
+    mock_get.return_value = Mock(ok=True)
+    mock_get.return_value.content = json.dumps(DRIVER_FILE_API_RESPONSE).encode()
+    service = TopflyService("sid", "unitId", "driver_name", "date")
+    service.get_mt_epoch_time(c_code, 23080205)
+    params = json.loads(
+        mock_get.call_args.args[0].partition("params=")[2].partition("&")[0]
+    )
+    assert params["mask"] == f"*{c_code}*"
+
+
+@patch("services.topfly_service.http_client.get")
+def test_get_mt_epoch_time_retries_unmasked_when_mask_rejected(mock_get, c_code):
+    mock_get.side_effect = [
+        Mock(content=json.dumps({"error": 4}).encode()),
+        Mock(content=json.dumps(DRIVER_FILE_API_RESPONSE).encode()),
+    ]
+    service = TopflyService("sid", "unitId", "driver_name", "date")
+    assert service.get_mt_epoch_time(c_code, 23080205) == 1663944440
+    params = json.loads(
+        mock_get.call_args.args[0].partition("params=")[2].partition("&")[0]
+    )
+    assert params["mask"] == "*"
+
+
+def streamed(payload, chunk_size=32):
+    body = json.dumps(payload).encode()
+    chunks = iter([body[i : i + chunk_size] for i in range(0, len(body), chunk_size)])
+    stream = Mock()
+    stream.return_value.__enter__ = Mock(return_value=chunks)
+    stream.return_value.__exit__ = Mock(return_value=False)
+    return stream, chunks
+
+
+def test_streamed_get_driver_c_code_stops_at_first_match(driver_name):
+    payload = {
+        "items": [
+            {"id": i, "drvrs": {"1": {"n": driver_name, "c": f"C{i}"}}}
+            for i in range(50)
+        ],
+    }
+    stream, chunks = streamed(payload)
+    with patch("services.topfly_service.setting.STREAM_JSON_RESPONSES", True), patch(
+        "services.topfly_service.http_client.stream", stream
+    ):
+        service = TopflyService("sid", "unitId", driver_name, "date")
+        assert service.get_driver_c_code() == "C0"
+    assert len(list(chunks)) > 0
+
+
+def test_streamed_get_driver_c_code_loads_the_directory_per_driver(driver_name):
+    # The resource id follows its drivers, as Wialon may send it.
+    payload = {
+        "items": [
+            {"drvrs": {"1": {"n": "Other", "c": "C1", "mt": 1}}, "id": 10},
+            {
+                "drvrs": {"2": {"n": driver_name, "c": "C2", "mt": 2, "ds": "x" * 100}},
+                "id": 11,
+            },
+        ],
+    }
+    stream, _ = streamed(payload, chunk_size=8)
+    drivers = DriverDirectory()
+    with patch("services.topfly_service.setting.STREAM_JSON_RESPONSES", True), patch(
+        "services.topfly_service.http_client.stream", stream
+    ):
+        service = TopflyService("sid", "unitId", driver_name, "date", drivers=drivers)
+        assert service.get_driver_c_code() == "C2"
+    assert drivers.find("Other") == DriverEntry("C1", 10)
+    assert drivers.find(driver_name) == DriverEntry("C2", 11)
+
+
+def test_streamed_get_mt_epoch_time(c_code):
+    stream, _ = streamed(DRIVER_FILE_API_RESPONSE)
+    with patch("services.topfly_service.setting.STREAM_JSON_RESPONSES", True), patch(
+        "services.topfly_service.http_client.stream", stream
+    ):
+        service = TopflyService("sid", "unitId", "driver_name", "date")
+        assert service.get_mt_epoch_time(c_code, 23080205) == 1663944440
+
+
+def test_streamed_get_mt_epoch_time_with_invalid_sid(c_code):
+    stream, _ = streamed(INVALID_SID_RESPONSE)
+    with patch("services.topfly_service.setting.STREAM_JSON_RESPONSES", True), patch(
+        "services.topfly_service.http_client.stream", stream
+    ):
+        service = TopflyService("sid", "unitId", "driver_name", "date")
+        with pytest.raises(TopflyException) as exc_info:
+            service.get_mt_epoch_time(c_code, 23080205)
+    assert exc_info.value.data == INVALID_SID_RESPONSE
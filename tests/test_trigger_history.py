@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+
+from models import TriggerDailyCount, TriggerEvent
+from services.trigger_history import TriggerHistory
+
+NOW = datetime(2022, 3, 15, 12, 0)
+
+
+def test_flush_writes_buffered_triggers_at_once(session_factory):
+    history = TriggerHistory(session_factory)
+    history.record("a", "driver", "unit", "send_command", NOW)
+    history.record("b", "driver", "unit", "send_command_tachigrafo", NOW)
+
+    assert asyncio.run(history.flush()) == 2
+    assert asyncio.run(history.flush()) == 0
+
+    with session_factory() as db:
+        assert sorted(event.sn for event in db.query(TriggerEvent)) == ["a", "b"]
+    assert history.stats()["flushes"] == 1
+
+
+def test_failed_flush_keeps_rows_up_to_max_buffer(session_factory):
+    def broken():
+        raise RuntimeError("database is down")
+
+    history = TriggerHistory(broken, max_buffer=2)
+    for sn in ("a", "b", "c"):
+        history.record(sn, "driver", "unit", "send_command", NOW)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(history.flush())
+
+    assert [row["sn"] for row in history._buffer] == ["b", "c"]
+    assert history.stats()["dropped"] == 1
+
+    # Shutdown reports the failed final flush instead of raising it.
+    with patch("services.trigger_history.capture_exception") as capture:
+        asyncio.run(history.stop())
+    capture.assert_called_once()
+
+
+def test_rollup_folds_old_days_into_daily_counts(session_factory):
+    history = TriggerHistory(session_factory, retention_days=30)
+    old = NOW - timedelta(days=40)
+    for trigger_at in (old, old + timedelta(hours=1), NOW - timedelta(days=1)):
+        history.record("a", "driver", "unit", "send_command", trigger_at)
+    asyncio.run(history.flush())
+
+    assert history.rollup(now=NOW) == 2
+    # Events of the same day arriving late are added to the existing count.
+    history.record("a", "driver", "unit", "send_command", old)
+    asyncio.run(history.flush())
+    assert history.rollup(now=NOW) == 1
+
+    with session_factory() as db:
+        assert db.query(TriggerEvent).count() == 1
+        daily = db.query(TriggerDailyCount).one()
+        assert (daily.day, daily.sn, daily.count) == (old.date(), "a", 3)
+
+
+def test_a_full_batch_wakes_the_writer(session_factory):
+    history = TriggerHistory(session_factory, batch_size=2, flush_interval=60)
+
+    async def run():
+        await history.start()
+        await asyncio.sleep(0.01)
+        assert history.stats()["written"] == 0
+        history.record("a", "driver", "unit", "send_command", NOW)
+        history.record("b", "driver", "unit", "send_command", NOW)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if history.stats()["written"]:
+                break
+        await history.stop()
+
+    asyncio.run(run())
+    assert history.stats()["written"] == 2
@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+
+from models import WebhookJob
+from services.webhook_jobs import DONE, FAILED, PENDING, RUNNING, WebhookJobPool
+from utils.exception_handler import TopflyException
+from utils.resp import TopflyResponse
+
+
+async def handler(db, unitId, driver):
+    if driver == "unknown":
+        raise TopflyException(message=f"No driver found with name {driver}")
+    return TopflyResponse(message=f"Tessera command has been triggered for {unitId}.")
+
+
+def test_run_pending_records_outcomes_and_latency(session_factory):
+    pool = WebhookJobPool(session_factory, handler)
+    with session_factory() as db:
+        done = pool.enqueue(db, "1", "Zaramella Andrea", "").id
+        failed = pool.enqueue(db, "2", "unknown", "").id
+    assert pool.stats()["queue_depth"] == 2
+
+    assert asyncio.run(pool.run_pending()) == 2
+    with session_factory() as db:
+        assert db.get(WebhookJob, done).status == DONE
+        assert (
+            db.get(WebhookJob, done).message
+            == "Tessera command has been triggered for 1."
+        )
+        assert db.get(WebhookJob, failed).status == FAILED
+        assert db.get(WebhookJob, failed).status_code == 400
+    stats = pool.stats()
+    assert stats["queue_depth"] == 0
+    assert (stats["processed"], stats["failed"]) == (2, 1)
+    assert stats["latency"]["run"]["count"] == 2
+
+
+def test_workers_requeue_interrupted_jobs_and_bound_concurrency(session_factory):
+    running = 0
+    peak = 0
+
+    async def slow_handler(db, unitId, driver):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return TopflyResponse(message="ok")
+
+    pool = WebhookJobPool(session_factory, slow_handler, workers=2, poll_interval=0.01)
+    with session_factory() as db:
+        db.add(WebhookJob(unitId="0", driver="d", date="", status=RUNNING))
+        db.commit()
+
+    async def run():
+        await pool.start()
+        with session_factory() as db:
+            for unit in range(1, 6):
+                pool.enqueue(db, str(unit), "d", "")
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if pool.processed == 6:
+                break
+        await pool.stop()
+
+    asyncio.run(run())
+    assert pool.processed == 6
+    assert peak == 2
+    with session_factory() as db:
+        assert db.query(WebhookJob).filter(WebhookJob.status == PENDING).count() == 0
+
+
+def test_only_jobs_past_their_lease_are_rerun(session_factory):
+    pool = WebhookJobPool(session_factory, handler, lease=300)
+    now = datetime.datetime.utcnow()
+    with session_factory() as db:
+        for unit, started_at in [
+            ("lost", now - datetime.timedelta(minutes=10)),
+            ("live", now),
+        ]:
+            db.add(
+                WebhookJob(
+                    unitId=unit,
+                    driver="d",
+                    date="",
+                    status=RUNNING,
+                    started_at=started_at,
+                )
+            )
+        db.commit()
+
+    # Another worker is still running "live".
+    assert asyncio.run(pool.run_pending()) == 1
+    with session_factory() as db:
+        statuses = dict(db.query(WebhookJob.unitId, WebhookJob.status))
+    assert statuses == {"lost": DONE, "live": RUNNING}
+    assert pool.stats()["requeued"] == 1
@@ -0,0 +1,57 @@
+import asyncio
+
+from sentry_sdk import capture_exception
+
+
+class BackgroundLoop:
+    """Run ``step()`` over and over in ``tasks`` background tasks.
+
+    A step that returns something truthy did work, so the next one starts at
+    once; otherwise the task sleeps until ``wake()`` or ``interval`` seconds
+    pass. A step that raises is reported to Sentry and counts as idle, so a
+    locked database is retried after one ``interval`` instead of killing the
+    task or spinning on it.
+    """
+
+    def __init__(self, step, interval: float, tasks: int = 1):
+        self.step = step
+        self.interval = interval
+        self.tasks = tasks
+        self._wakeup = None
+        self._loop = None
+        self._tasks = []
+
+    @property
+    def running(self) -> int:
+        return len(self._tasks)
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._run()) for _ in range(self.tasks)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+
+    def wake(self) -> None:
+        """Cut the current sleep short; safe to call from any thread."""
+        if self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self) -> None:
+        while True:
+            # Cleared before the step, so a wake racing it is not lost.
+            self._wakeup.clear()
+            try:
+                if await self.step():
+                    continue
+            except Exception as exc:
+                capture_exception(exc)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,50 @@
+"""JSON codec for the Wialon calls and ``TopflyResponse``.
+
+Uses ``orjson`` when it is installed (and ``JSON_BACKEND`` allows it), the
+stdlib otherwise. Both produce compact UTF-8 JSON, so switching backends does
+not change what Wialon or our clients receive beyond whitespace.
+"""
+import json
+
+from config import Settings
+
+setting = Settings()
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _select(name: str) -> str:
+    if name == "orjson" and orjson is None:
+        raise ImportError("JSON_BACKEND=orjson but orjson is not installed")
+    if name == "auto":
+        return "json" if orjson is None else "orjson"
+    return name
+
+
+BACKEND = _select(setting.JSON_BACKEND)
+
+
+if BACKEND == "orjson":
+
+    def dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def dumps(obj) -> str:
+        return dumps_bytes(obj).decode()
+
+    loads = orjson.loads
+
+else:
+
+    def dumps(obj) -> str:
+        return json.dumps(
+            obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        )
+
+    def dumps_bytes(obj) -> bytes:
+        return dumps(obj).encode()
+
+    loads = json.loads
@@ -0,0 +1,241 @@
+import codecs
+import json
+from typing import NamedTuple
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",:]}"
+_decoder = json.JSONDecoder()
+
+
+class _Wildcard:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self) -> str:
+        return self.name
+
+
+# Path steps matching every element of an array / every member of an object.
+ITEMS = _Wildcard("ITEMS")
+MEMBERS = _Wildcard("MEMBERS")
+
+
+class Closed(NamedTuple):
+    """End of a container the stream walked into; ``fields`` holds its members it did not walk."""
+
+    fields: dict
+
+
+class JsonStream:
+    """Incremental decoder for one JSON document fed as byte chunks.
+
+    Walks into the containers along ``path``, a tuple of object keys and the
+    ``ITEMS`` / ``MEMBERS`` wildcards, and emits ``(path, value)`` for every
+    value at its end, e.g. ``("items", ITEMS, "drvrs", MEMBERS)`` emits each
+    driver as ``(("items", 0, "drvrs", "7"), {...})``. When a walked
+    container other than the top level ends, ``(path, Closed(fields))`` is
+    emitted with its other members. Values off the path are decoded whole,
+    so memory is bounded by the largest of those, not by the document; the
+    top level's other members end up in ``fields``.
+    """
+
+    def __init__(self, path: tuple = (ITEMS,)):
+        self.path = tuple(path)
+        self.fields = {}
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._stack = []
+        self._done = False
+        # Size the buffer must reach before retrying a value that did not decode.
+        self._retry_at = 0
+
+    def parse(self, chunks):
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.close()
+
+    async def aparse(self, chunks):
+        async for chunk in chunks:
+            for event in self.feed(chunk):
+                yield event
+        for event in self.close():
+            yield event
+
+    def feed(self, chunk: bytes) -> list:
+        self._retry_at = max(self._retry_at - self._pos, 0)
+        self._buffer = self._buffer[self._pos :] + self._text.decode(chunk)
+        self._pos = 0
+        return self._scan(final=False)
+
+    def close(self) -> list:
+        self._buffer = self._buffer[self._pos :] + self._text.decode(b"", final=True)
+        self._pos = 0
+        self._retry_at = 0
+        events = self._scan(final=True)
+        if not self._done:
+            raise json.JSONDecodeError(
+                "Truncated JSON document", self._buffer, self._pos
+            )
+        return events
+
+    def _scan(self, final: bool) -> list:
+        events = []
+        while self._skip_whitespace():
+            char = self._buffer[self._pos]
+            if not self._stack:
+                if self._done:
+                    self._fail("Extra data after the document")
+                if char not in "{[":
+                    self._fail("Expected an object or an array")
+                self._push(char)
+                continue
+            frame = self._stack[-1]
+            if frame.state in ("key_first", "key"):
+                if char == "}" and frame.state == "key_first":
+                    self._pop(events)
+                    continue
+                key = self._decode(final)
+                if key is _INCOMPLETE:
+                    break
+                if not isinstance(key, str):
+                    self._fail("Expected a key")
+                frame.key = key
+                frame.state = "colon"
+            elif frame.state == "colon":
+                self._expect(":")
+                frame.state = "value"
+            elif frame.state in ("first", "value"):
+                if char == "]" and frame.state == "first" and frame.kind == "array":
+                    self._pop(events)
+                    continue
+                if not self._value(frame, char, final, events):
+                    break
+            elif char == ("}" if frame.kind == "object" else "]"):
+                self._pop(events)
+            elif char == ",":
+                self._pos += 1
+                if frame.kind == "object":
+                    frame.state = "key"
+                else:
+                    frame.key += 1
+                    frame.state = "value"
+            else:
+                self._fail(
+                    "Expected ',' or '}'"
+                    if frame.kind == "object"
+                    else "Expected ',' or ']'"
+                )
+        return events
+
+    def _value(self, frame, char: str, final: bool, events: list) -> bool:
+        depth = len(self._stack) - 1
+        step = self.path[depth] if depth < len(self.path) else None
+        if step is ITEMS:
+            matched = frame.kind == "array"
+        elif step is MEMBERS:
+            matched = frame.kind == "object"
+        else:
+            matched = step is not None and step == frame.key
+        last = depth == len(self.path) - 1
+        if matched and not last and char in "{[":
+            frame.state = "end"
+            self._push(char)
+            return True
+        value = self._decode(final)
+        if value is _INCOMPLETE:
+            return False
+        frame.state = "end"
+        if matched and last:
+            events.append((self._current_path(), value))
+        elif frame.kind == "object":
+            frame.fields[frame.key] = value
+        return True
+
+    def _current_path(self) -> tuple:
+        return tuple(frame.key for frame in self._stack)
+
+    def _push(self, char: str) -> None:
+        self._pos += 1
+        fields = {} if self._stack else self.fields
+        if char == "[":
+            self._stack.append(_Frame("array", 0, "first", fields))
+        else:
+            self._stack.append(_Frame("object", None, "key_first", fields))
+
+    def _pop(self, events: list) -> None:
+        self._pos += 1
+        frame = self._stack.pop()
+        if self._stack:
+            events.append((self._current_path(), Closed(frame.fields)))
+        else:
+            self._done = True
+
+    def _decode(self, final: bool):
+        if not final and len(self._buffer) < self._retry_at:
+            return _INCOMPLETE
+        try:
+            value, end = _decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            self._retry_at = 2 * len(self._buffer)
+            return _INCOMPLETE
+        # A number cut by the chunk boundary ("-15" of "-15.5") still decodes; only
+        # trust a value once the delimiter after it has arrived.
+        if not final and (
+            end == len(self._buffer) or self._buffer[end] not in _DELIMITERS
+        ):
+            self._retry_at = len(self._buffer) + 1
+            return _INCOMPLETE
+        self._pos = end
+        self._retry_at = 0
+        return value
+
+    def _skip_whitespace(self) -> bool:
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+            self._pos += 1
+        return self._pos < len(self._buffer)
+
+    def _expect(self, char: str) -> None:
+        if self._buffer[self._pos] != char:
+            self._fail(f"Expected '{char}'")
+        self._pos += 1
+
+    def _fail(self, message: str):
+        raise json.JSONDecodeError(message, self._buffer, self._pos)
+
+
+class JsonArrayStream(JsonStream):
+    """:class:`JsonStream` yielding just the elements of one array.
+
+    The array is the top-level one, or the ``array_key`` member of a
+    top-level object, so at most one element is held in memory. Wialon error
+    replies (``{"error": 1}``) yield nothing and set ``fields``.
+    """
+
+    def __init__(self, array_key: str = None):
+        super().__init__((ITEMS,) if array_key is None else (array_key, ITEMS))
+
+    def feed(self, chunk: bytes) -> list:
+        return _values(super().feed(chunk))
+
+    def close(self) -> list:
+        return _values(super().close())
+
+
+class _Frame:
+    __slots__ = ("kind", "key", "state", "fields")
+
+    def __init__(self, kind: str, key, state: str, fields: dict):
+        self.kind = kind
+        self.key = key
+        self.state = state
+        self.fields = fields
+
+
+def _values(events: list) -> list:
+    return [value for _, value in events if not isinstance(value, Closed)]
+
+
+_INCOMPLETE = object()
@@ -0,0 +1,34 @@
+import asyncio
+
+
+class LazyValue:
+    """Memoized awaitable that only runs ``factory`` once somebody needs it.
+
+    ``start()`` schedules it ahead of time; ``get()`` starts it if needed and
+    waits for the shared result, so concurrent callers never fetch twice.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._task = None
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._factory())
+
+    async def get(self):
+        self.start()
+        return await self._task
+
+    def discard(self) -> None:
+        if self._task is None:
+            return
+        if not self._task.done():
+            self._task.cancel()
+        elif not self._task.cancelled():
+            # Mark a failure nobody awaited as retrieved.
+            self._task.exception()
@@ -1,8 +1,15 @@
 from fastapi.responses import JSONResponse
 
+from utils import json_backend
+
+
+class _TopflyJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return json_backend.dumps_bytes(content)
+
 
 def TopflyResponse(status_code: int = 200, message: str = "", data={}):
-    return JSONResponse(
+    return _TopflyJSONResponse(
         status_code=status_code,
         content={
             "message": message,
@@ -0,0 +1,51 @@
+import asyncio
+import functools
+import threading
+
+
+class SingleFlight:
+    """Run concurrent calls with the same key once and share the outcome.
+
+    The first caller for a key (the leader) starts ``factory()`` as a task;
+    callers arriving while it is in flight (followers) await that task
+    instead. Every caller gets the leader's result or exception. The task is
+    shielded, so a caller that goes away does not cancel it for the others.
+    Counts are kept per group, the first element of the key.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = {}
+        self.followers = {}
+
+    async def do(self, key: tuple, factory):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+            self._count(self.leaders, key[0])
+        else:
+            self._count(self.followers, key[0])
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": dict(self.leaders),
+                "followers": dict(self.followers),
+                "coalesced_total": sum(self.followers.values()),
+            }
+
+    def _count(self, counters: dict, group) -> None:
+        with self._lock:
+            counters[group] = counters.get(group, 0) + 1
+
+    def _done(self, key: tuple, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Every caller may have gone away; mark the outcome as retrieved anyway.
+        if not task.cancelled():
+            task.exception()
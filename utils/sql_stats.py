@@ -0,0 +1,49 @@
+import contextlib
+import contextvars
+import threading
+
+from sqlalchemy import event
+
+from utils.timing import StepStats
+
+
+class StatementCounter:
+    """SQL statements executed per unit of work, e.g. per webhook.
+
+    ``attach`` hooks an engine. While a ``scope`` is open, every statement
+    the current context runs (its task, thread or ``run_sync`` greenlet) is
+    appended to the scope's list; on exit the count is aggregated under the
+    scope's name.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statements = contextvars.ContextVar("sql_statements", default=None)
+        self.counts = StepStats()
+
+    def attach(self, engine) -> None:
+        if not event.contains(engine, "before_cursor_execute", self._before_execute):
+            event.listen(engine, "before_cursor_execute", self._before_execute)
+
+    @contextlib.contextmanager
+    def scope(self, name: str):
+        statements = []
+        token = self._statements.set(statements)
+        try:
+            yield statements
+        finally:
+            self._statements.reset(token)
+            self.counts.record_step(name, len(statements))
+
+    def stats(self) -> dict:
+        return self.counts.stats()
+
+    def _before_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        statements = self._statements.get()
+        if statements is not None:
+            statements.append(statement)
+
+
+sql_statements = StatementCounter()
@@ -0,0 +1,62 @@
+import threading
+import time
+
+
+class StepTimer:
+    """Wall-clock duration, in seconds, of each named step of one request."""
+
+    def __init__(self):
+        self.steps = {}
+        self._started_at = time.perf_counter()
+
+    async def measure(self, name: str, awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.steps[name] = time.perf_counter() - start
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self._started_at
+
+
+class StepStats:
+    """Process-wide aggregate of the :class:`StepTimer` of every request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._steps = {}
+
+    def record(self, timer: StepTimer) -> None:
+        with self._lock:
+            for name, seconds in {**timer.steps, "total": timer.total}.items():
+                self._add(name, seconds)
+
+    def record_step(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._add(name, seconds)
+
+    def _add(self, name: str, seconds: float) -> None:
+        step = self._steps.setdefault(
+            name, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0}
+        )
+        step["count"] += 1
+        step["total"] += seconds
+        step["max"] = max(step["max"], seconds)
+        step["last"] = seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "count": step["count"],
+                    "avg": step["total"] / step["count"],
+                    "max": step["max"],
+                    "last": step["last"],
+                }
+                for name, step in self._steps.items()
+            }
+
+
+webhook_timings = StepStats()